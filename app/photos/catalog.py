@@ -0,0 +1,883 @@
+"""
+Photo catalog for the Photos module.
+
+Keeps a persistent SQLite index of the photo directories so browsing,
+item counts and sorting don't need to scan and stat the SD card on
+every request. A directory is only rescanned when its mtime changes.
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.photos import tasks
+from app.photos.utils import (
+    is_image_file, compute_fingerprint, get_image_metadata, PIL_AVAILABLE, Image
+)
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Sort keys supported by browse_directory as (SQL expression, direction).
+# Directories always come first and the path breaks ties, so every sort
+# is a stable total order that cursors can resume from.
+SORT_KEYS = {
+    'name': ('name COLLATE NOCASE', 'ASC'),
+    'natural': ('natural_key', 'ASC'),
+    'date': ('mtime', 'DESC'),
+    'size': ('COALESCE(size, 0)', 'DESC'),
+}
+
+# Page size limits for browse_directory
+MAX_PAGE_SIZE = 1000
+
+# Columns returned by get_directory_metadata, as (name, SQL expression)
+METADATA_COLUMNS = (
+    ('name', 'name'),
+    ('size', 'size'),
+    ('modified', 'mtime'),
+    ('captured_at', 'captured_at'),
+    ('width', 'width'),
+    ('height', 'height'),
+    ('exposure_time', 'exposure_time'),
+    ('analogue_gain', 'analogue_gain'),
+    ('lens_position', 'lens_position'),
+    ('hdr_index', 'hdr_index'),
+)
+
+DIGITS_RE = re.compile(r'\d+')
+
+# EXIF tags holding the capture time
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+EXIF_IFD_POINTER = 0x8769
+
+# EXIF tags holding the capture settings
+EXIF_MAKE = 0x010F
+EXIF_EXPOSURE_TIME = 0x829A
+EXIF_ISO_SPEED_RATINGS = 0x8827
+EXIF_ISO_SPEED = 0x8833
+EXIF_FOCAL_LENGTH = 0x920A
+
+# TakePhoto.py names files <name>_YYYY_MM_DD__HH_MM_SS_HDR<n>.<ext>
+FILENAME_TIMESTAMP_RE = re.compile(r'(\d{4}_\d{2}_\d{2}__\d{2}_\d{2}_\d{2})')
+FILENAME_HDR_RE = re.compile(r'_HDR(\d+)\.[^.]+$')
+
+# Per-image columns filled from the file header by _read_image_info
+IMAGE_INFO_COLUMNS = (
+    'width', 'height', 'captured_at',
+    'exposure_time', 'analogue_gain', 'lens_position', 'hdr_index'
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS photo_directories (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    scanned_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS photo_entries (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    is_image INTEGER NOT NULL,
+    size INTEGER,
+    mtime REAL NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    captured_at TEXT,
+    item_count INTEGER,
+    natural_key TEXT,
+    exposure_time REAL,
+    analogue_gain REAL,
+    lens_position REAL,
+    hdr_index INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_photo_entries_directory
+    ON photo_entries (directory, is_dir, name);
+
+CREATE TABLE IF NOT EXISTS photo_fingerprints (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS photo_metadata (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    metadata TEXT NOT NULL
+);
+"""
+
+# Columns added after the first catalog release, as (name, definition)
+MIGRATIONS = [
+    ('natural_key', 'TEXT'),
+    ('exposure_time', 'REAL'),
+    ('analogue_gain', 'REAL'),
+    ('lens_position', 'REAL'),
+    ('hdr_index', 'INTEGER'),
+]
+
+INSERT_ENTRY = (
+    'INSERT OR REPLACE INTO photo_entries '
+    '(path, directory, name, is_dir, is_image, size, mtime, item_count, natural_key, '
+    f'{", ".join(IMAGE_INFO_COLUMNS)}) '
+    f'VALUES ({", ".join("?" * (9 + len(IMAGE_INFO_COLUMNS)))})'
+)
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_photo_entries_natural
+    ON photo_entries (directory, is_dir, natural_key, path);
+
+CREATE INDEX IF NOT EXISTS idx_photo_entries_mtime
+    ON photo_entries (directory, is_dir, mtime, path);
+"""
+
+# Database location (set at initialization) and per-thread connections
+DATABASE_PATH = None
+_local = threading.local()
+
+# Lock so that concurrent requests don't rescan the same directory twice
+catalog_lock = threading.Lock()
+
+
+def initialize(database_path: str) -> None:
+    """Initialize the catalog database and create the schema if needed."""
+    global DATABASE_PATH
+
+    DATABASE_PATH = database_path
+    os.makedirs(os.path.dirname(database_path), exist_ok=True)
+
+    conn = _get_connection()
+    conn.executescript(SCHEMA)
+    _migrate(conn)
+    conn.executescript(INDEXES)
+    conn.commit()
+
+    logger.info(f"Photo catalog initialized at {database_path}")
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Get the SQLite connection for the current thread."""
+    conn = getattr(_local, 'conn', None)
+    # A connection must not be used by a forked child of the process that opened it
+    if (conn is None or getattr(_local, 'pid', None) != os.getpid()
+            or getattr(_local, 'path', None) != DATABASE_PATH):
+        if not DATABASE_PATH:
+            raise RuntimeError("Photo catalog has not been initialized")
+
+        conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+        conn.row_factory = sqlite3.Row
+        # WAL lets readers continue while a rescan is being written
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.path = DATABASE_PATH
+    return conn
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """Add columns missing from catalogs created by older versions."""
+    columns = {row['name'] for row in conn.execute('PRAGMA table_info(photo_entries)')}
+    missing = [(name, definition) for name, definition in MIGRATIONS if name not in columns]
+    if not missing:
+        return
+
+    with conn:
+        for name, definition in missing:
+            conn.execute(f'ALTER TABLE photo_entries ADD COLUMN {name} {definition}')
+        # Force every directory to be rescanned so the new columns get filled
+        conn.execute('DELETE FROM photo_directories')
+
+    logger.info(f"Photo catalog migrated: added {', '.join(name for name, _ in missing)}")
+
+
+def natural_sort_key(name: str) -> str:
+    """
+    Build a key that sorts embedded numbers numerically.
+
+    Each run of digits is prefixed with its length, so 'img_HDR2' sorts
+    before 'img_HDR10' with a plain string comparison.
+
+    Args:
+        name: Filename
+
+    Returns:
+        Sort key string
+    """
+    def pad(match):
+        digits = match.group(0).lstrip('0') or '0'
+        return f"{len(digits):03d}{digits}"
+
+    return DIGITS_RE.sub(pad, name.lower())
+
+
+def _parse_exif_datetime(value: Any) -> Optional[str]:
+    """Convert an EXIF 'YYYY:MM:DD HH:MM:SS' value to ISO format."""
+    if isinstance(value, bytes):
+        value = value.decode('ascii', errors='ignore')
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value.strip('\x00 '), '%Y:%m:%d %H:%M:%S').isoformat()
+    except ValueError:
+        return None
+
+
+def _exif_number(value: Any) -> Optional[float]:
+    """Convert an EXIF numeric value (int or rational) to a float."""
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _read_image_info(path: str, name: str) -> Dict[str, Any]:
+    """
+    Read dimensions, capture time and capture settings for an image.
+
+    Only the file header is parsed; the image data is not decoded.
+
+    TakePhoto.py records the analogue gain as ISO speed (gain x 100) and
+    the lens position as focal length (position x 10), so those are
+    converted back for its photos.
+
+    Args:
+        path: Path to the image file
+        name: Filename, used as a fallback source for the capture time
+
+    Returns:
+        Dictionary with a value (or None) for each of IMAGE_INFO_COLUMNS
+    """
+    info = dict.fromkeys(IMAGE_INFO_COLUMNS)
+
+    if PIL_AVAILABLE and Image is not None:
+        try:
+            with Image.open(path) as img:
+                info['width'], info['height'] = img.size
+                exif = img.getexif()
+                exif_ifd = exif.get_ifd(EXIF_IFD_POINTER)
+                info['captured_at'] = (
+                    _parse_exif_datetime(exif_ifd.get(EXIF_DATETIME_ORIGINAL)) or
+                    _parse_exif_datetime(exif.get(EXIF_DATETIME))
+                )
+                info['exposure_time'] = _exif_number(exif_ifd.get(EXIF_EXPOSURE_TIME))
+
+                iso = _exif_number(exif_ifd.get(EXIF_ISO_SPEED) or exif_ifd.get(EXIF_ISO_SPEED_RATINGS))
+                if iso is not None:
+                    info['analogue_gain'] = iso / 100
+
+                make = str(exif.get(EXIF_MAKE, ''))
+                focal_length = _exif_number(exif_ifd.get(EXIF_FOCAL_LENGTH))
+                if make.startswith('Mothbox') and focal_length is not None:
+                    info['lens_position'] = focal_length / 10
+        except Exception as e:
+            logger.warning(f"Error reading image header for {path}: {str(e)}")
+
+    # TakePhoto.py doesn't write DateTimeOriginal, but encodes it in the name
+    if info['captured_at'] is None:
+        match = FILENAME_TIMESTAMP_RE.search(name)
+        if match:
+            try:
+                info['captured_at'] = datetime.strptime(match.group(1), '%Y_%m_%d__%H_%M_%S').isoformat()
+            except ValueError:
+                pass
+
+    match = FILENAME_HDR_RE.search(name)
+    if match:
+        info['hdr_index'] = int(match.group(1))
+
+    return info
+
+
+def _count_directory_items(path: str) -> Optional[int]:
+    """Count the visible entries of a directory without stat-ing them."""
+    try:
+        with os.scandir(path) as entries:
+            return sum(1 for entry in entries if not entry.name.startswith('.'))
+    except (PermissionError, OSError):
+        return None
+
+
+def _forget_tree(conn: sqlite3.Connection, path: str) -> None:
+    """Remove a directory and everything below it from the catalog."""
+    prefix = path.rstrip(os.sep) + os.sep
+    conn.execute(
+        'DELETE FROM photo_entries WHERE directory = ? OR substr(directory, 1, ?) = ?',
+        (path, len(prefix), prefix)
+    )
+    conn.execute(
+        'DELETE FROM photo_directories WHERE path = ? OR substr(path, 1, ?) = ?',
+        (path, len(prefix), prefix)
+    )
+    conn.execute(
+        'DELETE FROM photo_fingerprints WHERE substr(path, 1, ?) = ?',
+        (len(prefix), prefix)
+    )
+    conn.execute(
+        'DELETE FROM photo_metadata WHERE substr(path, 1, ?) = ?',
+        (len(prefix), prefix)
+    )
+
+
+def _refresh_directory_entry(conn: sqlite3.Connection, directory: str) -> None:
+    """Update the item count and mtime shown for a directory in its parent's listing."""
+    conn.execute(
+        'UPDATE photo_entries SET mtime = ?, '
+        'item_count = (SELECT COUNT(*) FROM photo_entries WHERE directory = ?) '
+        'WHERE path = ? AND is_dir = 1',
+        (os.stat(directory).st_mtime, directory, directory)
+    )
+
+
+def sync_directory(directory: str, force: bool = False) -> bool:
+    """
+    Bring the catalog entries of a directory up to date.
+
+    The directory is only rescanned if its mtime differs from the one
+    recorded at the last scan. Files whose size and mtime are unchanged
+    keep their cached dimensions and capture time.
+
+    Args:
+        directory: Directory path to synchronize
+        force: Whether to rescan even if the mtime is unchanged
+
+    Returns:
+        True if the directory was rescanned, False if the catalog was current
+    """
+    conn = _get_connection()
+    dir_mtime = os.stat(directory).st_mtime
+
+    row = conn.execute(
+        'SELECT mtime FROM photo_directories WHERE path = ?', (directory,)
+    ).fetchone()
+    if row is not None and row['mtime'] == dir_mtime and not force:
+        return False
+
+    with catalog_lock:
+        # Another request may have finished the scan while we were waiting
+        row = conn.execute(
+            'SELECT mtime FROM photo_directories WHERE path = ?', (directory,)
+        ).fetchone()
+        if row is not None and row['mtime'] == dir_mtime and not force:
+            return False
+
+        existing = {
+            r['name']: r for r in conn.execute(
+                f'SELECT name, is_dir, size, mtime, item_count, {", ".join(IMAGE_INFO_COLUMNS)} '
+                'FROM photo_entries WHERE directory = ?', (directory,)
+            )
+        }
+
+        rows = []
+        seen = set()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # Skip hidden files and directories
+                if entry.name.startswith('.'):
+                    continue
+
+                try:
+                    stat_info = entry.stat()
+                    is_dir = entry.is_dir()
+                except (PermissionError, OSError) as e:
+                    logger.warning(f"Error accessing {entry.path}: {str(e)}")
+                    continue
+
+                is_image = not is_dir and is_image_file(entry.name)
+                previous = existing.get(entry.name)
+                unchanged = (
+                    previous is not None and
+                    bool(previous['is_dir']) == is_dir and
+                    previous['mtime'] == stat_info.st_mtime and
+                    (is_dir or previous['size'] == stat_info.st_size)
+                )
+
+                item_count = None
+                info = dict.fromkeys(IMAGE_INFO_COLUMNS)
+                if is_dir:
+                    if unchanged and previous['item_count'] is not None:
+                        item_count = previous['item_count']
+                    else:
+                        item_count = _count_directory_items(entry.path)
+                elif is_image:
+                    if unchanged:
+                        info = {column: previous[column] for column in IMAGE_INFO_COLUMNS}
+                    else:
+                        info = _read_image_info(entry.path, entry.name)
+
+                seen.add(entry.name)
+                rows.append((
+                    entry.path, directory, entry.name, int(is_dir), int(is_image),
+                    None if is_dir else stat_info.st_size, stat_info.st_mtime,
+                    item_count, natural_sort_key(entry.name),
+                    *(info[column] for column in IMAGE_INFO_COLUMNS)
+                ))
+
+        with conn:
+            # Drop the catalogued contents of subdirectories that disappeared
+            for name, previous in existing.items():
+                if previous['is_dir'] and name not in seen:
+                    _forget_tree(conn, os.path.join(directory, name))
+
+            conn.execute('DELETE FROM photo_entries WHERE directory = ?', (directory,))
+            conn.executemany(INSERT_ENTRY, rows)
+            conn.execute(
+                'INSERT OR REPLACE INTO photo_directories (path, mtime, scanned_at) VALUES (?, ?, ?)',
+                (directory, dir_mtime, time.time())
+            )
+            _refresh_directory_entry(conn, directory)
+
+    logger.info(f"Catalog rescanned {directory} ({len(rows)} entries)")
+    return True
+
+
+def ingest_file(path: str) -> bool:
+    """
+    Add or update a single file in the catalog.
+
+    Used by the ingest watcher, so a new photo costs one stat and one
+    header read instead of a rescan of its directory. The directory's
+    recorded mtime is moved forward; other changes to the directory
+    arrive as their own watcher events.
+
+    Args:
+        path: Path of a file that has been completely written
+
+    Returns:
+        True if the catalog was updated
+    """
+    directory, name = os.path.split(path)
+    if name.startswith('.'):
+        return False
+
+    conn = _get_connection()
+    row = conn.execute(
+        'SELECT mtime FROM photo_directories WHERE path = ?', (directory,)
+    ).fetchone()
+    if row is None:
+        # First file in a directory the catalog hasn't seen (e.g. a new
+        # night's folder): a scan of it is just as cheap
+        try:
+            sync_directory(directory)
+        except FileNotFoundError:
+            return False
+        return True
+
+    with catalog_lock:
+        try:
+            stat_info = os.stat(path)
+            dir_mtime = os.stat(directory).st_mtime
+        except FileNotFoundError:
+            return False
+
+        is_image = is_image_file(name)
+        info = dict.fromkeys(IMAGE_INFO_COLUMNS)
+        if is_image:
+            info = _read_image_info(path, name)
+
+        with conn:
+            conn.execute(INSERT_ENTRY, (
+                path, directory, name, 0, int(is_image), stat_info.st_size, stat_info.st_mtime,
+                None, natural_sort_key(name),
+                *(info[column] for column in IMAGE_INFO_COLUMNS)
+            ))
+            conn.execute(
+                'UPDATE photo_directories SET mtime = ?, scanned_at = ? WHERE path = ?',
+                (dir_mtime, time.time(), directory)
+            )
+            # Keep the item count shown in the parent's listing current
+            _refresh_directory_entry(conn, directory)
+
+    return True
+
+
+def _row_to_item(row: sqlite3.Row) -> Dict[str, Any]:
+    """Convert a catalog row into the item format used by the browse API."""
+    item = {
+        'name': row['name'],
+        'path': row['path'],
+        'is_dir': bool(row['is_dir']),
+        'is_image': bool(row['is_image']),
+        'size': row['size'],
+        'modified': datetime.fromtimestamp(row['mtime']).isoformat(),
+    }
+
+    if item['is_dir']:
+        item['item_count'] = row['item_count']
+        item['has_more'] = False if row['item_count'] is not None else None
+    elif item['is_image']:
+        item['width'] = row['width']
+        item['height'] = row['height']
+        item['captured_at'] = row['captured_at']
+
+    return item
+
+
+def _sort_value(row: sqlite3.Row, sort: str) -> Any:
+    """Get the value of a row's sort key, as compared by SORT_KEYS."""
+    if sort == 'name':
+        return row['name']
+    if sort == 'natural':
+        return row['natural_key']
+    if sort == 'date':
+        return row['mtime']
+    return row['size'] or 0
+
+
+def encode_cursor(row: sqlite3.Row, sort: str) -> str:
+    """Encode the position after a row as an opaque cursor string."""
+    position = [sort, row['is_dir'], _sort_value(row, sort), row['path']]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[int, Any, str]:
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Args:
+        cursor: Cursor string
+        sort: Sort key the cursor must belong to
+
+    Returns:
+        Tuple of (is_dir, sort value, path)
+
+    Raises:
+        ValueError: If the cursor is malformed or from a different sort
+    """
+    try:
+        cursor_sort, is_dir, value, path = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        is_dir = int(is_dir)
+        value_types = (str,) if sort in ('name', 'natural') else (int, float)
+        if not isinstance(value, value_types) or isinstance(value, bool) or not isinstance(path, str):
+            raise TypeError("unexpected position values")
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+
+    if cursor_sort != sort:
+        raise ValueError("Cursor does not match the requested sort")
+
+    return is_dir, value, path
+
+
+def browse_directory(
+    directory: str,
+    sort: str = 'name',
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    List one page of a directory from the catalog.
+
+    Pages are addressed with keyset cursors, so fetching any page costs
+    the same regardless of how deep into the folder it is.
+
+    Args:
+        directory: Directory path to list
+        sort: Sort key ('name', 'natural', 'date' or 'size')
+        limit: Maximum number of items to return (None for all)
+        cursor: Cursor returned with the previous page
+
+    Returns:
+        Dictionary with the page contents, total count and next cursor
+
+    Raises:
+        ValueError: If the cursor is invalid
+    """
+    sync_directory(directory)
+
+    if sort not in SORT_KEYS:
+        sort = 'name'
+    expression, direction = SORT_KEYS[sort]
+    after = '>' if direction == 'ASC' else '<'
+
+    conn = _get_connection()
+    query = 'SELECT * FROM photo_entries WHERE directory = ?'
+    params = [directory]
+
+    if cursor:
+        is_dir, value, path = decode_cursor(cursor, sort)
+        query += (
+            f' AND (is_dir < ? OR (is_dir = ? AND ({expression} {after} ? OR '
+            f'({expression} = ? AND path > ?))))'
+        )
+        params += [is_dir, is_dir, value, value, path]
+
+    query += f' ORDER BY is_dir DESC, {expression} {direction}, path ASC'
+
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        # Fetch one extra row to know whether another page follows
+        query += ' LIMIT ?'
+        params.append(limit + 1)
+
+    rows = conn.execute(query, params).fetchall()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1], sort)
+
+    total = conn.execute(
+        'SELECT COUNT(*) AS count FROM photo_entries WHERE directory = ?', (directory,)
+    ).fetchone()['count']
+
+    return {
+        'contents': [_row_to_item(row) for row in rows],
+        'total': total,
+        'sort': sort,
+        'next_cursor': next_cursor
+    }
+
+
+def list_directory(directory: str, sort: str = 'name') -> List[Dict[str, Any]]:
+    """
+    List the full contents of a directory from the catalog.
+
+    Args:
+        directory: Directory path to list
+        sort: Sort key ('name', 'natural', 'date' or 'size')
+
+    Returns:
+        List of dictionaries with file/directory information
+    """
+    return browse_directory(directory, sort=sort)['contents']
+
+
+def get_directory_metadata(directory: str, sort: str = 'name') -> Dict[str, List[Any]]:
+    """
+    Get the metadata of every image in a directory, column by column.
+
+    Everything comes from the catalog, so no image file is opened unless
+    it changed since the directory was last scanned.
+
+    Args:
+        directory: Directory path
+        sort: Sort key ('name', 'natural', 'date' or 'size')
+
+    Returns:
+        Dictionary mapping each of METADATA_COLUMNS to a list of values,
+        one per image. 'modified' is a timestamp and 'exposure_time' is in
+        seconds.
+
+    Raises:
+        ValueError: If the sort key is unknown
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Unknown sort key: {sort}")
+
+    sync_directory(directory)
+
+    expression, direction = SORT_KEYS[sort]
+    rows = _get_connection().execute(
+        f'SELECT {", ".join(column for _, column in METADATA_COLUMNS)} FROM photo_entries '
+        f'WHERE directory = ? AND is_image = 1 ORDER BY {expression} {direction}, path ASC',
+        (directory,)
+    ).fetchall()
+
+    return {
+        name: [row[index] for row in rows]
+        for index, (name, _) in enumerate(METADATA_COLUMNS)
+    }
+
+
+def get_item_count(directory: str) -> int:
+    """
+    Get the number of visible entries in a directory.
+
+    Args:
+        directory: Directory path
+
+    Returns:
+        Number of files and subdirectories
+    """
+    sync_directory(directory)
+
+    row = _get_connection().execute(
+        'SELECT COUNT(*) AS count FROM photo_entries WHERE directory = ?', (directory,)
+    ).fetchone()
+    return row['count']
+
+
+def get_fingerprint(path: str, stat_result: Optional[os.stat_result] = None) -> str:
+    """
+    Get the content fingerprint of a file.
+
+    Fingerprints are remembered per path and reused while the file's size
+    and mtime are unchanged, so the file itself is only read once.
+
+    Args:
+        path: File path
+        stat_result: Result of os.stat for the file, if already known
+
+    Returns:
+        Fingerprint as a hex string
+    """
+    if stat_result is None:
+        stat_result = os.stat(path)
+
+    # Without an open catalog (outside the app, or in a render process,
+    # which the fork server starts from a fresh interpreter) it is computed
+    if not DATABASE_PATH:
+        return compute_fingerprint(path, stat_result)
+
+    conn = _get_connection()
+    row = conn.execute(
+        'SELECT size, mtime_ns, fingerprint FROM photo_fingerprints WHERE path = ?', (path,)
+    ).fetchone()
+    if row and row['size'] == stat_result.st_size and row['mtime_ns'] == stat_result.st_mtime_ns:
+        return row['fingerprint']
+
+    fingerprint = compute_fingerprint(path, stat_result)
+    with conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO photo_fingerprints (path, size, mtime_ns, fingerprint) '
+            'VALUES (?, ?, ?, ?)',
+            (path, stat_result.st_size, stat_result.st_mtime_ns, fingerprint)
+        )
+    return fingerprint
+
+
+def get_metadata(path: str, stat_result: Optional[os.stat_result] = None) -> Dict[str, Any]:
+    """
+    Get the metadata of an image.
+
+    Extracted metadata is stored in the catalog and reused while the
+    file's size and mtime are unchanged, so repeat requests are a lookup.
+
+    Args:
+        path: Image path
+        stat_result: Result of os.stat for the file, if already known
+
+    Returns:
+        Dictionary with metadata information (see get_image_metadata)
+    """
+    if stat_result is None:
+        stat_result = os.stat(path)
+
+    if not DATABASE_PATH:
+        return get_image_metadata(path, stat_result)
+
+    conn = _get_connection()
+    row = conn.execute(
+        'SELECT size, mtime_ns, metadata FROM photo_metadata WHERE path = ?', (path,)
+    ).fetchone()
+    if row and row['size'] == stat_result.st_size and row['mtime_ns'] == stat_result.st_mtime_ns:
+        return json.loads(row['metadata'])
+
+    metadata = get_image_metadata(path, stat_result)
+    with conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO photo_metadata (path, size, mtime_ns, metadata) '
+            'VALUES (?, ?, ?, ?)',
+            (path, stat_result.st_size, stat_result.st_mtime_ns, json.dumps(metadata, default=str))
+        )
+    return metadata
+
+
+def rescan_tree(root: str) -> Dict[str, Any]:
+    """
+    Rescan a directory tree, touching only directories whose mtime changed.
+
+    Subdirectories of unchanged directories are found from the catalog,
+    so an up-to-date tree costs one stat per directory.
+
+    Args:
+        root: Root directory of the tree
+
+    Returns:
+        Result information
+    """
+    results = {
+        'success': True,
+        'root': root,
+        'directories_checked': 0,
+        'directories_rescanned': 0,
+        'errors': 0
+    }
+
+    conn = _get_connection()
+    pending = [root]
+
+    while pending:
+        directory = pending.pop()
+        results['directories_checked'] += 1
+
+        try:
+            if sync_directory(directory):
+                results['directories_rescanned'] += 1
+        except (PermissionError, OSError) as e:
+            logger.warning(f"Error rescanning {directory}: {str(e)}")
+            results['errors'] += 1
+            continue
+
+        pending.extend(
+            row['path'] for row in conn.execute(
+                'SELECT path FROM photo_entries WHERE directory = ? AND is_dir = 1', (directory,)
+            )
+        )
+
+    return results
+
+
+def rescan(roots: List[str]) -> Dict[str, Any]:
+    """
+    Rescan the catalog for a set of directory trees in the background.
+
+    Args:
+        roots: Root directories to rescan
+
+    Returns:
+        Task information
+    """
+    task_id = tasks.enqueue_task(
+        'catalog_rescan',
+        _rescan_task,
+        roots
+    )
+
+    return {
+        'success': True,
+        'task_id': task_id,
+        'roots': roots
+    }
+
+
+def _rescan_task(roots: List[str]) -> Dict[str, Any]:
+    """
+    Background task to rescan catalog trees.
+
+    Args:
+        roots: Root directories to rescan
+
+    Returns:
+        Result information
+    """
+    results = {
+        'success': True,
+        'directories_checked': 0,
+        'directories_rescanned': 0,
+        'errors': 0
+    }
+
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+
+        tree_results = rescan_tree(root)
+        for key in ('directories_checked', 'directories_rescanned', 'errors'):
+            results[key] += tree_results[key]
+
+    return results
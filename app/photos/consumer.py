@@ -0,0 +1,35 @@
+"""
+Dedicated task consumer for the Photos module.
+
+Runs the background tasks queued by the web workers in a process of its
+own, so renders and archives don't tie up gunicorn workers and the task
+system doesn't change with the number of workers:
+
+    CREATUREBOX_TASK_CONSUMER=external python -m app.photos.consumer
+
+Tasks are claimed with leases, so more than one consumer may run.
+"""
+
+import signal
+import logging
+
+from app import create_app
+from app.photos import tasks
+
+
+def main() -> None:
+    """Set up the application and run tasks until SIGTERM or Ctrl-C."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+
+    # Opens the task store, the photo catalog and the thumbnail directories
+    create_app()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: tasks.stop_worker(wait=False))
+    tasks.run_consumer()
+
+
+if __name__ == '__main__':
+    main()
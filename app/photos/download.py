@@ -2,19 +2,27 @@
 Download handler for the Photos module.
 
 Provides functionality for single and batch downloads of images.
+
+Batch archives are content addressed: they are named after a digest of
+the photos they contain (path, size, mtime) and the options, so asking
+for the same photos again returns the archive that already exists. The
+download store is kept under a size quota by evicting the archives that
+were used least recently. Archive tasks report their progress in bytes
+and can be cancelled part way.
 """
 
 import os
+import json
 import time
+import hashlib
 import zipfile
 import logging
-import tempfile
 import threading
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 from pathlib import Path
 
 from app.photos import tasks
-from app.photos.utils import get_safe_path, is_image_file
+from app.photos.utils import get_safe_path, is_image_file, BASE_DIR
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -22,6 +30,21 @@ logger = logging.getLogger(__name__)
 # Constants
 DEFAULT_BATCH_NAME = "photo_download"
 
+# Bytes read from a photo at a time while streaming or building an archive
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Where batch archives are kept (on disk: the temporary directory is
+# often tmpfs, i.e. RAM, on the Pi)
+DOWNLOAD_DIR = os.environ.get(
+    'CREATUREBOX_DOWNLOAD_DIR', os.path.join(BASE_DIR, 'instance', 'downloads')
+)
+
+# The most space archives may take, in MB. Unless it is set, the store
+# may take this share of the space available to it on its filesystem
+# (its own size plus the free space), which leaves room for new photos
+DOWNLOAD_QUOTA_MB = int(os.environ.get('CREATUREBOX_DOWNLOAD_QUOTA_MB', 0))
+DOWNLOAD_SPACE_SHARE = float(os.environ.get('CREATUREBOX_DOWNLOAD_SPACE_SHARE', 0.25))
+
 # Lock for thread safety
 download_lock = threading.Lock()
 
@@ -42,22 +65,12 @@ def create_zip_archive(
         include_folders: Whether to preserve folder structure
         
     Returns:
-        Information about the created archive
+        Information about the archive: 'filename' names it in the download
+        store and 'download_name' is offered to the browser. If an identical
+        archive already exists, 'ready' is True and no task is started.
     """
-    # Generate a unique filename if not provided
-    if not download_filename:
-        download_filename = f"{DEFAULT_BATCH_NAME}_{int(time.time())}.zip"
-    
-    # Ensure the filename ends with .zip
-    if not download_filename.lower().endswith('.zip'):
-        download_filename += '.zip'
-    
-    # Sanitize the paths for security
-    safe_images = []
-    for path in images:
-        safe_path = get_safe_path(path, allowed_roots)
-        if safe_path and os.path.isfile(safe_path) and is_image_file(safe_path):
-            safe_images.append(safe_path)
+    download_filename = _archive_filename(download_filename)
+    safe_images = _safe_images(images, allowed_roots)
     
     # If no valid images found, return an error
     if not safe_images:
@@ -67,40 +80,228 @@ def create_zip_archive(
             'task_id': None
         }
     
-    # Enqueue the batch download task
-    task_id = tasks.enqueue_task(
+    try:
+        archive_filename = _archive_key(safe_images, include_folders) + '.zip'
+    except OSError as e:
+        return {
+            'success': False,
+            'error': str(e),
+            'task_id': None
+        }
+    
+    # The same photos with the same options make the same archive
+    if get_download_path(archive_filename):
+        logger.info(f"Reusing download archive {archive_filename}")
+        return {
+            'success': True,
+            'task_id': None,
+            'ready': True,
+            'filename': archive_filename,
+            'download_name': download_filename,
+            'image_count': len(safe_images)
+        }
+    
+    # Enqueue the batch download task (one per archive, so identical
+    # requests share it and never build the same file at once)
+    task_id = tasks.enqueue_unique_task(
+        f"download:{archive_filename}",
         'batch_download',
         _create_zip_archive_task,
-        safe_images, download_filename, include_folders
+        safe_images, archive_filename, include_folders, download_filename
     )
     
     return {
         'success': True,
         'task_id': task_id,
-        'filename': download_filename,
+        'ready': False,
+        'filename': archive_filename,
+        'download_name': download_filename,
         'image_count': len(safe_images)
     }
 
 
+def _archive_key(images: List[str], include_folders: bool) -> str:
+    """
+    Get the content key of an archive.
+    
+    Args:
+        images: Validated image paths
+        include_folders: Whether to preserve folder structure
+        
+    Returns:
+        Hex digest of the sorted (path, size, mtime) list and the options
+    """
+    entries = []
+    for image_path in sorted(set(images)):
+        stat_result = os.stat(image_path)
+        entries.append([image_path, stat_result.st_size, stat_result.st_mtime_ns])
+    
+    return hashlib.sha1(json.dumps([entries, include_folders]).encode()).hexdigest()
+
+
+def stream_zip_archive(
+    images: List[str],
+    allowed_roots: List[str],
+    download_filename: Optional[str] = None,
+    include_folders: bool = True
+) -> Dict[str, Any]:
+    """
+    Prepare a ZIP archive that is generated while it is being sent.
+    
+    Photos are stored uncompressed (JPEGs don't compress) and written
+    straight into the response as they are read, so the download starts
+    at once and needs no temporary file. Large archives use ZIP64.
+    
+    Args:
+        images: List of image paths to include
+        allowed_roots: List of allowed root directories
+        download_filename: Filename for the download archive
+        include_folders: Whether to preserve folder structure
+        
+    Returns:
+        Information about the archive, with 'stream' yielding its bytes
+    """
+    download_filename = _archive_filename(download_filename)
+    safe_images = _safe_images(images, allowed_roots)
+    
+    if not safe_images:
+        return {
+            'success': False,
+            'error': 'No valid images found',
+            'stream': None
+        }
+    
+    return {
+        'success': True,
+        'filename': download_filename,
+        'image_count': len(safe_images),
+        'stream': _generate_zip_stream(safe_images, include_folders)
+    }
+
+
+class _StreamBuffer:
+    """Write-only file that holds what ZipFile writes until it is drained."""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self) -> None:
+        pass
+    
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _generate_zip_stream(images: List[str], include_folders: bool) -> Iterator[bytes]:
+    """
+    Generate a ZIP archive of the images, a chunk at a time.
+    
+    The output isn't seekable, so each entry is followed by a data
+    descriptor carrying its CRC and sizes; at most one chunk of a photo is
+    held in memory.
+    
+    Args:
+        images: Validated image paths
+        include_folders: Whether to preserve folder structure
+        
+    Yields:
+        Archive bytes
+    """
+    buffer = _StreamBuffer()
+    
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zip_file:
+        for image_path in images:
+            try:
+                source = open(image_path, 'rb')
+            except OSError as e:
+                # Headers are already sent, so a missing photo is left out
+                logger.error(f"Error adding {image_path} to ZIP stream: {str(e)}")
+                continue
+            
+            with source:
+                zip_info = zipfile.ZipInfo.from_file(image_path, _archive_name(image_path, include_folders))
+                zip_info.compress_type = zipfile.ZIP_STORED
+                
+                with zip_file.open(zip_info, 'w') as entry:
+                    while True:
+                        chunk = source.read(STREAM_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        entry.write(chunk)
+                        yield buffer.drain()
+    
+    # Data descriptor of the last entry and the central directory
+    yield buffer.drain()
+
+
+def _archive_filename(download_filename: Optional[str]) -> str:
+    """Get the archive's filename, generating one if not provided."""
+    # Generate a unique filename if not provided
+    if not download_filename:
+        download_filename = f"{DEFAULT_BATCH_NAME}_{int(time.time())}.zip"
+    
+    # Ensure the filename ends with .zip
+    if not download_filename.lower().endswith('.zip'):
+        download_filename += '.zip'
+    
+    return download_filename
+
+
+def _safe_images(images: List[str], allowed_roots: List[str]) -> List[str]:
+    """Keep the paths that are images inside the allowed roots."""
+    # Sanitize the paths for security
+    safe_images = []
+    for path in images:
+        safe_path = get_safe_path(path, allowed_roots)
+        if safe_path and os.path.isfile(safe_path) and is_image_file(safe_path):
+            safe_images.append(safe_path)
+    return safe_images
+
+
+def _archive_name(image_path: str, include_folders: bool) -> str:
+    """Get the path of an image inside the archive."""
+    if include_folders:
+        # Use just the filename without the full path
+        return os.path.basename(image_path)
+    
+    # Use the full relative path structure
+    # Extract the common prefix from the first allowed root that matches
+    return image_path
+
+
 def _create_zip_archive_task(
     images: List[str],
-    download_filename: str,
-    include_folders: bool
+    archive_filename: str,
+    include_folders: bool,
+    download_filename: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Background task to create a ZIP archive.
     
+    Photos are copied a chunk at a time, reporting progress in bytes and
+    stopping (without leaving a partial archive) when cancelled. Photos
+    that can't be added are listed in 'failed_images', and the archive is
+    then not stored under its content key, so it is never reused.
+    
     Args:
         images: List of image paths to include
-        download_filename: Filename for the download archive
+        archive_filename: Name of the archive in the download store
         include_folders: Whether to preserve folder structure
+        download_filename: Filename offered to the browser
         
     Returns:
         Result information
     """
     results = {
         'success': False,
-        'filename': download_filename,
+        'filename': archive_filename,
+        'download_name': download_filename or archive_filename,
         'image_count': len(images),
         'archive_size': 0,
         'failed_images': []
@@ -110,26 +311,45 @@ def _create_zip_archive_task(
         results['error'] = 'No images to process'
         return results
     
+    final_path = os.path.join(DOWNLOAD_DIR, archive_filename)
+    
     try:
-        # Create a temporary file for the ZIP archive
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as temp_file:
-            temp_path = temp_file.name
+        # An identical request may have built it in the meantime
+        if get_download_path(archive_filename):
+            results['success'] = True
+            results['archive_path'] = final_path
+            results['archive_size'] = os.path.getsize(final_path)
+            return results
+        
+        # Make room for the new archive (photos are stored, so it is about
+        # as large as the photos themselves)
+        os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+        expected_size = sum(os.path.getsize(image_path) for image_path in images)
+        _evict_downloads(expected_size)
+        
+        # Build next to its final location, so it can be renamed into place
+        temp_path = f"{final_path}.{os.getpid()}.tmp"
         
-        # Create the ZIP archive
-        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for image_path in images:
+        # Create the ZIP archive (stored: JPEGs don't compress any further)
+        bytes_done = 0
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_STORED) as zip_file:
+            for index, image_path in enumerate(images):
                 try:
-                    # Determine the path inside the archive
-                    if include_folders:
-                        # Use just the filename without the full path
-                        arcname = os.path.basename(image_path)
-                    else:
-                        # Use the full relative path structure
-                        # Extract the common prefix from the first allowed root that matches
-                        arcname = image_path
-                    
                     # Add the file to the archive
-                    zip_file.write(image_path, arcname=arcname)
+                    zip_info = zipfile.ZipInfo.from_file(image_path, _archive_name(image_path, include_folders))
+                    zip_info.compress_type = zipfile.ZIP_STORED
+                    
+                    with open(image_path, 'rb') as source, zip_file.open(zip_info, 'w') as entry:
+                        while True:
+                            chunk = source.read(STREAM_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            entry.write(chunk)
+                            bytes_done += len(chunk)
+                            
+                            if tasks.cancel_requested():
+                                raise tasks.TaskCancelled()
+                            tasks.report_progress(index, len(images), bytes_done, expected_size)
                     
                 except Exception as e:
                     logger.error(f"Error adding {image_path} to ZIP archive: {str(e)}")
@@ -138,48 +358,57 @@ def _create_zip_archive_task(
                         'error': str(e)
                     })
         
-        # Move the temporary file to the download location
-        download_dir = os.path.join(tempfile.gettempdir(), 'creaturebox_downloads')
-        os.makedirs(download_dir, exist_ok=True)
+        tasks.report_progress(len(images), len(images), bytes_done, expected_size)
         
-        final_path = os.path.join(download_dir, download_filename)
+        if results['failed_images']:
+            # An archive missing photos mustn't be reused for this selection:
+            # give it a name of its own, so it is offered only this once
+            # (and evicted like any other archive)
+            stem, extension = os.path.splitext(archive_filename)
+            final_path = os.path.join(DOWNLOAD_DIR, f"{stem}-incomplete-{int(time.time())}{extension}")
+            results['filename'] = os.path.basename(final_path)
+            results['incomplete'] = True
+            logger.warning(
+                f"ZIP archive {archive_filename} is missing {len(results['failed_images'])} photos"
+            )
         
-        # Ensure we don't overwrite an existing file
-        counter = 1
-        while os.path.exists(final_path):
-            base_name, ext = os.path.splitext(download_filename)
-            new_filename = f"{base_name}_{counter}{ext}"
-            final_path = os.path.join(download_dir, new_filename)
-            counter += 1
-        
-        # Move the file
+        # Move the file into the download store
         os.replace(temp_path, final_path)
         
         # Update results
         results['success'] = True
         results['archive_path'] = final_path
         results['archive_size'] = os.path.getsize(final_path)
-        results['filename'] = os.path.basename(final_path)
         
         return results
     
+    except tasks.TaskCancelled:
+        logger.info(f"ZIP archive {archive_filename} cancelled")
+        _remove_partial_archive(locals().get('temp_path'))
+        raise
+    
     except Exception as e:
         logger.error(f"Error creating ZIP archive: {str(e)}")
         
         # Clean up temporary file if it exists
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
+        _remove_partial_archive(locals().get('temp_path'))
         
         results['error'] = str(e)
         return results
 
 
+def _remove_partial_archive(temp_path: Optional[str]) -> None:
+    """Remove an archive that wasn't finished, if it was started."""
+    if temp_path and os.path.exists(temp_path):
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+
+
 def get_download_path(filename: str) -> Optional[str]:
     """
-    Get the full path for a download file.
+    Get the full path for a download file, marking it as recently used.
     
     Args:
         filename: Name of the download file
@@ -187,15 +416,100 @@ def get_download_path(filename: str) -> Optional[str]:
     Returns:
         Full path to the file or None if not found
     """
-    download_dir = os.path.join(tempfile.gettempdir(), 'creaturebox_downloads')
-    file_path = os.path.join(download_dir, filename)
+    file_path = os.path.join(DOWNLOAD_DIR, filename)
+    
+    try:
+        stat_result = os.stat(file_path)
+        # Last use is kept in the access time, so the modification time
+        # (and the ETag that resumed downloads check) stays the same
+        os.utime(file_path, ns=(time.time_ns(), stat_result.st_mtime_ns))
+    except FileNotFoundError:
+        return None
     
-    if os.path.exists(file_path) and os.path.isfile(file_path):
+    if os.path.isfile(file_path):
         return file_path
     
     return None
 
 
+def _list_downloads() -> List[os.DirEntry]:
+    """List the archives in the download store, least recently used first."""
+    try:
+        with os.scandir(DOWNLOAD_DIR) as entries:
+            archives = [
+                entry for entry in entries
+                if entry.is_file(follow_symlinks=False) and entry.name.endswith('.zip')
+            ]
+    except FileNotFoundError:
+        return []
+    
+    return sorted(archives, key=_last_used)
+
+
+def _last_used(entry: os.DirEntry) -> float:
+    """Get the time an archive was last built or downloaded."""
+    stat_result = entry.stat(follow_symlinks=False)
+    return max(stat_result.st_atime, stat_result.st_mtime)
+
+
+def _evict_downloads(needed_bytes: int = 0) -> Dict[str, int]:
+    """
+    Remove least recently used archives until the store fits its quota.
+    
+    Args:
+        needed_bytes: Space to leave free for an archive about to be built
+        
+    Returns:
+        Dictionary with 'files_removed' and 'bytes_freed'
+    """
+    results = {'files_removed': 0, 'bytes_freed': 0}
+    
+    with download_lock:
+        archives = _list_downloads()
+        total = sum(entry.stat(follow_symlinks=False).st_size for entry in archives)
+        quota = _download_quota(total)
+        
+        for entry in archives:
+            if total + needed_bytes <= quota:
+                break
+            
+            size = entry.stat(follow_symlinks=False).st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            results['files_removed'] += 1
+            results['bytes_freed'] += size
+            logger.info(f"Evicted download archive {entry.name} ({size} bytes)")
+    
+    return results
+
+
+def _download_quota(store_bytes: int) -> int:
+    """
+    Get the most space the download store may take, in bytes.
+    
+    Args:
+        store_bytes: Space the archives take now
+        
+    Returns:
+        DOWNLOAD_QUOTA_MB if set, otherwise DOWNLOAD_SPACE_SHARE of the
+        space available to the store on its filesystem
+    """
+    if DOWNLOAD_QUOTA_MB > 0:
+        return DOWNLOAD_QUOTA_MB * 1024 * 1024
+    
+    try:
+        fs_stat = os.statvfs(DOWNLOAD_DIR)
+    except (AttributeError, OSError):
+        # No statvfs (Windows) or no download directory yet: allow 1GB
+        return 1024 * 1024 * 1024
+    
+    free_bytes = fs_stat.f_bavail * fs_stat.f_frsize
+    return int((store_bytes + free_bytes) * DOWNLOAD_SPACE_SHARE)
+
+
 def cleanup_downloads(max_age_hours: int = 24) -> Dict[str, Any]:
     """
     Clean up old downloads.
@@ -240,7 +554,7 @@ def _cleanup_downloads_task(max_age_hours: int) -> Dict[str, Any]:
         cutoff_time = time.time() - (max_age_hours * 3600)
         
         # Get the download directory
-        download_dir = os.path.join(tempfile.gettempdir(), 'creaturebox_downloads')
+        download_dir = DOWNLOAD_DIR
         
         # Skip if directory doesn't exist
         if not os.path.exists(download_dir) or not os.path.isdir(download_dir):
@@ -254,10 +568,11 @@ def _cleanup_downloads_task(max_age_hours: int) -> Dict[str, Any]:
             if not os.path.isfile(file_path):
                 continue
             
-            # Check file modification time
-            if os.path.getmtime(file_path) < cutoff_time:
+            # Check when the file was last built or downloaded
+            stat_result = os.stat(file_path)
+            if max(stat_result.st_atime, stat_result.st_mtime) < cutoff_time:
                 # Get file size before removing
-                file_size = os.path.getsize(file_path)
+                file_size = stat_result.st_size
                 
                 # Remove the file
                 os.remove(file_path)
@@ -0,0 +1,303 @@
+"""
+HTTP caching helpers for the Photos module.
+
+Builds validators (ETag / Last-Modified) from the source files and sets
+Cache-Control policies, so repeat visits over the field hotspot turn
+into cheap 304 responses or are served from the browser cache. Large
+generated responses are streamed, gzip-compressed when the client
+accepts it. Files support Range requests (206 Partial Content,
+validated with If-Range), so interrupted downloads resume. Behind nginx, file bytes can be handed to nginx with
+X-Accel-Redirect so that a gunicorn worker is free as soon as the
+request has been checked.
+"""
+
+import os
+import zlib
+import hashlib
+import mimetypes
+from urllib.parse import quote
+from datetime import datetime, timezone
+from typing import Any, Iterable, List, Optional, Tuple
+
+from flask import request, Response, send_file, stream_with_context
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+
+# Versioned URLs (with a `v` parameter that changes with the source) never change
+IMMUTABLE_MAX_AGE = 365 * 86400
+
+CACHE_CONTROL_IMMUTABLE = f'private, max-age={IMMUTABLE_MAX_AGE}, immutable'
+CACHE_CONTROL_REVALIDATE = 'private, no-cache'
+CACHE_CONTROL_NO_STORE = 'no-store'
+
+# zlib level for streamed responses
+GZIP_LEVEL = 6
+
+# Let nginx send file bodies: the app only checks the request and answers
+# with the file's path under an internal nginx location (see install.sh)
+X_ACCEL_REDIRECT = os.environ.get('CREATUREBOX_X_ACCEL_REDIRECT', '0') == '1'
+X_ACCEL_PREFIX = os.environ.get('CREATUREBOX_X_ACCEL_PREFIX', '/_accel')
+
+# Directories nginx sends files from, each through its own internal
+# location: (resolved directory, location), deepest directory first
+_accel_roots: List[Tuple[str, str]] = []
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Build a strong ETag value from the parts that identify a representation.
+
+    Args:
+        *parts: Values such as path, mtime, size and rendition name
+
+    Returns:
+        ETag value (unquoted)
+    """
+    return hashlib.sha1('\0'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def is_not_modified(etag: str, last_modified: Optional[float] = None) -> bool:
+    """
+    Check the request's validators against the current representation.
+
+    If-None-Match takes precedence over If-Modified-Since, and uses weak
+    comparison so ETags weakened by a compressing proxy still match.
+
+    Args:
+        etag: Current ETag value
+        last_modified: Current modification time as a timestamp
+
+    Returns:
+        True if the client's cached copy is still valid
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    if last_modified is not None and request.if_modified_since is not None:
+        modified = datetime.fromtimestamp(int(last_modified), tz=timezone.utc)
+        return modified <= request.if_modified_since
+
+    return False
+
+
+def set_cache_headers(
+    response: Response,
+    etag: Optional[str] = None,
+    last_modified: Optional[float] = None,
+    cache_control: str = CACHE_CONTROL_REVALIDATE
+) -> Response:
+    """
+    Attach validators and a Cache-Control policy to a response.
+
+    Args:
+        response: Response to update
+        etag: ETag value
+        last_modified: Modification time as a timestamp
+        cache_control: Cache-Control header value
+
+    Returns:
+        The same response
+    """
+    if etag:
+        response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = datetime.fromtimestamp(int(last_modified), tz=timezone.utc)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def not_modified(
+    etag: str,
+    last_modified: Optional[float] = None,
+    cache_control: str = CACHE_CONTROL_REVALIDATE
+) -> Response:
+    """Build an empty 304 Not Modified response carrying the validators."""
+    return set_cache_headers(Response(status=304), etag, last_modified, cache_control)
+
+
+def send_cached_file(
+    path: str,
+    etag: str,
+    last_modified: float,
+    immutable: bool = False,
+    **kwargs
+) -> Response:
+    """
+    Send a file with the given validators and a matching cache policy.
+
+    Args:
+        path: File to send
+        etag: ETag value identifying the representation
+        last_modified: Modification time of the source as a timestamp
+        immutable: Whether the URL is versioned and can be cached forever
+        **kwargs: Extra arguments for send_file (mimetype, as_attachment, ...)
+
+    Returns:
+        The response (304 if the client's copy is current)
+    """
+    cache_control = CACHE_CONTROL_IMMUTABLE if immutable else CACHE_CONTROL_REVALIDATE
+
+    # A current copy wins over a Range request (send_file would answer 206)
+    if is_not_modified(etag, last_modified):
+        return not_modified(etag, last_modified, cache_control)
+
+    if accel_location(path) is not None:
+        response = send_file_response(path, **kwargs)
+        return set_cache_headers(response, etag, last_modified, cache_control)
+
+    response = _send_file_range(path, etag=etag, last_modified=last_modified, **kwargs)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def _send_file_range(path: str, **kwargs) -> Response:
+    """
+    Call send_file, answering an unsatisfiable Range with a 416.
+
+    send_file handles Range and If-Range itself: a matching If-Range (or
+    none) gets 206 Partial Content for the requested bytes, a stale one
+    gets the whole file.
+    """
+    try:
+        return send_file(path, **kwargs)
+    except RequestedRangeNotSatisfiable as e:
+        # Carries `Content-Range: bytes */<length>` for the client to retry
+        return e.get_response()
+
+
+def add_accel_root(directory: str) -> None:
+    """
+    Let nginx send the files below a directory.
+
+    nginx needs an internal location for the directory, named after it
+    (see install.sh):
+    `location <X_ACCEL_PREFIX><directory>/ { internal; alias <directory>/; }`
+
+    Args:
+        directory: Directory as nginx is configured with it
+    """
+    location = X_ACCEL_PREFIX + quote(os.path.abspath(directory).rstrip('/')) + '/'
+    root = (os.path.realpath(directory), location)
+    if root not in _accel_roots:
+        _accel_roots.append(root)
+        _accel_roots.sort(key=lambda r: len(r[0]), reverse=True)
+
+
+def accel_location(path: str) -> Optional[str]:
+    """
+    Get the internal nginx URI of a file.
+
+    Args:
+        path: Path of the file
+
+    Returns:
+        The URI under the location of the directory that holds the file,
+        or None if X-Accel-Redirect is off or nginx doesn't serve it
+    """
+    if not X_ACCEL_REDIRECT:
+        return None
+
+    real_path = os.path.realpath(path)
+    for root, location in _accel_roots:
+        if real_path.startswith(root + os.sep):
+            return location + quote(os.path.relpath(real_path, root))
+    return None
+
+
+def accel_redirect(
+    path: str,
+    mimetype: Optional[str] = None,
+    as_attachment: bool = False,
+    download_name: Optional[str] = None
+) -> Optional[Response]:
+    """
+    Hand a file to nginx with X-Accel-Redirect.
+
+    The response has no body; nginx replaces it with the file (handling
+    Range requests itself) and keeps the headers set here.
+
+    Args:
+        path: Absolute path of the file to send
+        mimetype: MIME type, guessed from the name if not given
+        as_attachment: Whether the browser should save the file
+        download_name: File name offered to the browser
+
+    Returns:
+        The redirect response, or None if nginx doesn't send this file
+        (see accel_location)
+    """
+    location = accel_location(path)
+    if location is None:
+        return None
+
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    response = Response(mimetype=mimetype)
+    response.headers['X-Accel-Redirect'] = location
+    if as_attachment:
+        response.headers.set(
+            'Content-Disposition', 'attachment',
+            filename=download_name or os.path.basename(path)
+        )
+    return response
+
+
+def send_file_response(path: str, **kwargs) -> Response:
+    """
+    Send a file through nginx when X-Accel-Redirect is enabled and nginx
+    serves its directory, or with send_file otherwise.
+
+    Args:
+        path: File to send
+        **kwargs: Arguments for send_file (mimetype, as_attachment, download_name)
+
+    Returns:
+        The response
+    """
+    response = accel_redirect(
+        path,
+        mimetype=kwargs.get('mimetype'),
+        as_attachment=kwargs.get('as_attachment', False),
+        download_name=kwargs.get('download_name')
+    )
+    if response is not None:
+        return response
+    return _send_file_range(path, **kwargs)
+
+
+def accepts_gzip() -> bool:
+    """Check whether the client accepts gzip-compressed responses."""
+    return 'gzip' in request.accept_encodings
+
+
+def stream_response(chunks: Iterable[str], mimetype: str, compress: bool = False) -> Response:
+    """
+    Stream a response generated in chunks.
+
+    Args:
+        chunks: Text chunks of the body
+        mimetype: Response MIME type
+        compress: Whether to gzip the body (see accepts_gzip)
+
+    Returns:
+        Streaming response
+    """
+    def generate():
+        if not compress:
+            for chunk in chunks:
+                yield chunk.encode()
+            return
+
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode())
+            if data:
+                yield data
+        yield compressor.flush()
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,128 @@
+"""
+In-memory LRU cache for the Photos module.
+
+Holds hot thumbnail bytes and parsed metadata so that scrolling back over
+a grid is served from RAM instead of the SD card. Entries carry a
+validator (source mtime and size) and are dropped as soon as the source
+changes. Each gunicorn worker process has its own cache.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+# Total size of cached values, in MB (0 disables the cache)
+MEMORY_CACHE_MB = int(os.environ.get('CREATUREBOX_MEMORY_CACHE_MB', 32))
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by the total size of its values."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, validator: Any = None) -> Optional[Any]:
+        """
+        Look up a value.
+
+        Args:
+            key: Cache key
+            validator: Current source validator; a stored entry with a
+                different validator is stale and gets dropped
+
+        Returns:
+            The cached value, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, size, stored_validator = entry
+            if stored_validator != validator:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, size: int, validator: Any = None) -> None:
+        """
+        Store a value, evicting least recently used entries to make room.
+
+        Args:
+            key: Cache key
+            value: Value to store
+            size: Approximate size of the value in bytes
+            validator: Source validator stored with the value
+        """
+        # Don't let a single large value flush the whole cache
+        if size > self.max_bytes // 4:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, size, validator)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop a single entry."""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        """Drop all entries (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Get size and hit/miss statistics."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'size_bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'pid': os.getpid()
+            }
+
+    def _remove(self, key: Hashable) -> None:
+        """Remove an entry (caller holds the lock)."""
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+# Shared cache for thumbnails and metadata
+cache = LRUCache(MEMORY_CACHE_MB * 1024 * 1024)
+
+
+def source_validator(stat_result: os.stat_result) -> tuple:
+    """Build the validator for a cached value derived from a source file."""
+    return (stat_result.st_mtime_ns, stat_result.st_size)
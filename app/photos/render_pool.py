@@ -0,0 +1,166 @@
+"""
+Process pool for CPU-heavy image rendering in the Photos module.
+
+Decoding a 64MP JPEG is CPU bound and holds the GIL, so thumbnail work
+is handed to a pool of worker processes that can use every core.
+
+The processes are started by a fork server (see render_worker.py), never
+forked from the calling process, which runs threads. Batch work runs in
+the task consumer, which gets one render process per core; each web
+worker only renders what a request is waiting for and keeps a small pool.
+"""
+
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Any, Optional
+
+from app.photos import tasks, render_worker
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Number of render processes in the process running the task consumer,
+# and in every other (web worker) process; 0 renders inline in the
+# calling thread
+RENDER_WORKERS = int(os.environ.get('CREATUREBOX_RENDER_WORKERS', os.cpu_count() or 1))
+WEB_RENDER_WORKERS = int(os.environ.get('CREATUREBOX_WEB_RENDER_WORKERS', 1))
+
+# Memory a render process may use on top of what it takes once started,
+# in MB (0 disables the cap)
+RENDER_WORKER_MEMORY_MB = int(os.environ.get('CREATUREBOX_RENDER_WORKER_MEMORY_MB', 1024))
+
+# Pool state
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Get the shared render pool, creating it on first use.
+
+    Returns:
+        The process pool, or None if rendering runs inline
+    """
+    global _pool
+
+    workers = pool_size()
+    if workers <= 0:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=_get_context(),
+                initializer=render_worker.init_worker,
+                initargs=(RENDER_WORKER_MEMORY_MB,)
+            )
+            logger.info(
+                f"Render pool started with {workers} workers "
+                f"({RENDER_WORKER_MEMORY_MB} MB headroom each)"
+            )
+        return _pool
+
+
+def pool_size() -> int:
+    """Get the number of render processes for this process."""
+    return RENDER_WORKERS if tasks.worker_running else WEB_RENDER_WORKERS
+
+
+def _get_context() -> multiprocessing.context.BaseContext:
+    """Get the multiprocessing context render processes are started with."""
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+
+    context = multiprocessing.get_context('forkserver')
+    # Load the render functions in the fork server once, instead of in
+    # every render process
+    context.set_forkserver_preload([render_worker.__name__])
+    return context
+
+
+def _reset_pool(broken: ProcessPoolExecutor) -> None:
+    """Discard a pool whose worker died so the next call starts a new one."""
+    global _pool
+
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+    logger.warning("Render pool was broken (worker died) and has been reset")
+
+
+def submit(func: Callable, *args, **kwargs) -> Future:
+    """
+    Submit a render function to the pool.
+
+    The function and its arguments must be picklable. When the pool is
+    disabled the function runs immediately and a completed future is
+    returned.
+
+    Args:
+        func: Module-level function to execute
+        *args: Arguments to pass to the function
+        **kwargs: Keyword arguments to pass to the function
+
+    Returns:
+        Future for the result
+    """
+    pool = get_pool()
+
+    if pool is None:
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    try:
+        return pool.submit(func, *args, **kwargs)
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        return get_pool().submit(func, *args, **kwargs)
+
+
+def run(func: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """
+    Run a render function in the pool and wait for its result.
+
+    Args:
+        func: Module-level function to execute
+        *args: Arguments to pass to the function
+        timeout: Maximum time to wait in seconds
+        **kwargs: Keyword arguments to pass to the function
+
+    Returns:
+        The function's return value
+
+    Raises:
+        Exception: Whatever the function raised, or BrokenProcessPool if
+            the worker was killed (e.g. by the memory cap)
+    """
+    pool = get_pool()
+    future = submit(func, *args, **kwargs)
+    try:
+        return future.result(timeout)
+    except BrokenProcessPool:
+        if pool is not None:
+            _reset_pool(pool)
+        raise
+
+
+def shutdown(wait: bool = True) -> None:
+    """Shut down the render pool."""
+    global _pool
+
+    with _pool_lock:
+        pool, _pool = _pool, None
+
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=True)
+        logger.info("Render pool stopped")
@@ -0,0 +1,58 @@
+"""
+Render process entry point for the Photos module.
+
+The render pool starts its processes from a fork server: a fresh,
+single-threaded interpreter that imports this module (and with it the
+render functions and Pillow) once. Render processes are forked from it,
+so they start quickly and never inherit the threads or the locks held by
+a web worker or the task consumer.
+"""
+
+import os
+import logging
+from typing import Optional
+
+# Imported here so the fork server loads the render functions only once
+from app.photos import utils  # noqa: F401
+
+# The resource module is only available on Unix
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+def init_worker(memory_mb: int) -> None:
+    """
+    Initialize a render process: cap its memory and lower its priority.
+
+    Args:
+        memory_mb: Address space the process may add to what it has once
+            started, in MB (0 for no cap)
+    """
+    if resource is not None and memory_mb > 0:
+        # Measured here, after start-up, so the cap is headroom for the
+        # render itself whatever the interpreter and Pillow already take
+        limit = (_address_space() or 0) + memory_mb * 1024 * 1024
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ValueError, OSError) as e:
+            logger.warning(f"Could not set render worker memory limit: {str(e)}")
+
+    # Keep the web interface responsive while renders are running
+    try:
+        os.nice(5)
+    except (AttributeError, OSError):
+        pass
+
+
+def _address_space() -> Optional[int]:
+    """Get the virtual address space of this process in bytes (Linux only)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
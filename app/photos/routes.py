@@ -5,20 +5,20 @@ These routes handle photo browsing, viewing, and management.
 """
 
 import os
+import io
 import json
-import datetime
-import tempfile
-from pathlib import Path
-from flask import render_template, jsonify, current_app, request, send_file, abort, session, url_for
+import time
+import sqlite3
+from flask import render_template, jsonify, current_app, request, send_file, abort, url_for, stream_with_context
 from werkzeug.utils import secure_filename
 from app.photos import bp
 from app.auth.decorators import login_required
 from app.photos.utils import (
-    get_safe_path, list_directory_contents, get_thumbnail_path,
-    get_image_metadata, create_thumbnail, is_image_file,
-    BASE_DIR
+    get_safe_path, list_directory_contents, get_contact_sheet_path,
+    get_deep_zoom_info, get_image_metadata, is_image_file, BASE_DIR
 )
-from app.photos import thumbnail_manager, tasks, download
+from app.photos import thumbnail_manager, thumbnail_store, tasks, download, catalog, http_cache, watcher
+from app.photos.memory_cache import cache as memory_cache, source_validator
 
 # Configuration
 # These will eventually move to a settings file
@@ -47,8 +47,37 @@ if not os.path.exists('/home/pi'):
     # Add user Pictures directory for testing
     PHOTO_ROOT_DIRS.append(os.path.join(os.path.expanduser('~'), 'Pictures'))
 
-# Initialize the thumbnail manager
-thumbnail_manager.initialize(BASE_DIR)
+# Task event streams: seconds between checks of the task, between keepalive
+# comments, and before the stream ends (the browser then reconnects)
+TASK_EVENTS_INTERVAL = 0.5
+TASK_EVENTS_KEEPALIVE = 15
+TASK_EVENTS_MAX_SECONDS = 300
+
+
+@bp.record_once
+def _initialize_thumbnails(state):
+    """Set up the thumbnail directories and start the task system."""
+    # Not done on import: render processes import this module too
+    thumbnail_manager.initialize(BASE_DIR)
+
+@bp.record_once
+def _register_accel_roots(state):
+    """Let nginx send files from the directories the app serves them from."""
+    for directory in PHOTO_ROOT_DIRS + [thumbnail_store.STORE_DIR, download.DOWNLOAD_DIR]:
+        http_cache.add_accel_root(directory)
+
+@bp.record_once
+def _initialize_catalog(state):
+    """Open the photo catalog in the application's database."""
+    catalog.initialize(state.app.config.get(
+        'DATABASE', os.path.join(BASE_DIR, 'instance', 'creaturebox.sqlite')
+    ))
+
+@bp.record_once
+def _start_watcher(state):
+    """Start ingesting new photos as they are written."""
+    if state.app.config.get('PHOTO_WATCHER', watcher.WATCHER_ENABLED):
+        watcher.start(PHOTO_ROOT_DIRS, BASE_DIR)
 
 @bp.route('/')
 @login_required
@@ -77,10 +106,16 @@ def api_list_directories():
     
     for root_dir in PHOTO_ROOT_DIRS:
         if os.path.exists(root_dir) and os.path.isdir(root_dir):
+            try:
+                item_count = catalog.get_item_count(root_dir)
+            except Exception as e:
+                current_app.logger.warning(f"Error counting items in {root_dir}: {str(e)}")
+                item_count = None
+            
             directories.append({
                 'path': root_dir,
                 'name': os.path.basename(root_dir) or root_dir,
-                'item_count': len(os.listdir(root_dir)) if os.access(root_dir, os.R_OK) else None
+                'item_count': item_count
             })
     
     return jsonify({
@@ -91,8 +126,16 @@ def api_list_directories():
 @bp.route('/api/browse')
 @login_required
 def api_browse_directory():
-    """Browse a directory and return its contents."""
+    """
+    Browse a directory and return its contents.
+    
+    Supports cursor pagination: pass `limit` to get one page and
+    `cursor` (the `next_cursor` of the previous page) to continue.
+    """
     path = request.args.get('path', '')
+    sort = request.args.get('sort', 'name')
+    cursor = request.args.get('cursor') or None
+    limit = request.args.get('limit', type=int)
     
     # Ensure the path is valid and within allowed directories
     safe_path = get_safe_path(path, PHOTO_ROOT_DIRS)
@@ -103,12 +146,48 @@ def api_browse_directory():
         }), 400
     
     try:
-        contents = list_directory_contents(safe_path)
+        directory_mtime = os.stat(safe_path).st_mtime_ns
+    except OSError:
+        # Removed after the path was checked
         return jsonify({
+            'success': False,
+            'message': 'Directory not found'
+        }), 404
+    
+    # A listing only changes when the directory's mtime does, so a
+    # revalidating client can be answered without querying the catalog
+    etag = http_cache.make_etag('browse', safe_path, directory_mtime, sort, limit, cursor)
+    if http_cache.is_not_modified(etag):
+        return http_cache.not_modified(etag)
+    
+    try:
+        try:
+            page = catalog.browse_directory(safe_path, sort=sort, limit=limit, cursor=cursor)
+        except sqlite3.Error as e:
+            # Fall back to scanning the directory if the catalog is unusable
+            current_app.logger.warning(f"Photo catalog unavailable, scanning {safe_path}: {str(e)}")
+            contents = list_directory_contents(safe_path)
+            page = {
+                'contents': contents,
+                'total': len(contents),
+                'sort': 'name',
+                'next_cursor': None
+            }
+        
+        response = jsonify({
             'success': True,
             'path': safe_path,
-            'contents': contents
+            'contents': page['contents'],
+            'total': page['total'],
+            'sort': page['sort'],
+            'next_cursor': page['next_cursor']
         })
+        return http_cache.set_cache_headers(response, etag)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
     except Exception as e:
         current_app.logger.error(f"Error browsing directory {safe_path}: {str(e)}")
         return jsonify({
@@ -129,6 +208,29 @@ def api_get_thumbnail():
     if safe_path is None or not os.path.isfile(safe_path) or not is_image_file(safe_path):
         abort(404)
     
+    # The ETag depends only on the source and rendition, so a client that
+    # already has this thumbnail gets a 304 without touching the cache dir
+    try:
+        source_stat = os.stat(safe_path)
+    except OSError:
+        abort(404)
+    etag = http_cache.make_etag(safe_path, source_stat.st_mtime_ns, source_stat.st_size, size)
+    # Browser URLs carry the source version (`v`), so they can be cached forever
+    immutable = bool(request.args.get('v'))
+    cache_control = http_cache.CACHE_CONTROL_IMMUTABLE if immutable else http_cache.CACHE_CONTROL_REVALIDATE
+    if not force and http_cache.is_not_modified(etag, source_stat.st_mtime):
+        return http_cache.not_modified(etag, source_stat.st_mtime, cache_control)
+    
+    cache_key = ('thumbnail', safe_path, size)
+    validator = source_validator(source_stat)
+    
+    # Recently served thumbnails come straight from RAM
+    if not force:
+        data = memory_cache.get(cache_key, validator)
+        if data is not None:
+            response = current_app.response_class(data, mimetype='image/jpeg')
+            return http_cache.set_cache_headers(response, etag, source_stat.st_mtime, cache_control)
+    
     try:
         # Get or create thumbnail
         result = thumbnail_manager.get_or_create_thumbnail(
@@ -143,21 +245,128 @@ def api_get_thumbnail():
             abort(500)
             
         if not result['ready']:
-            # If thumbnail is not ready and being generated in background,
-            # return a placeholder or fallback
-            placeholder_path = os.path.join(current_app.static_folder, 'img', 'thumbnail-placeholder.svg')
-            if os.path.exists(placeholder_path):
-                return send_file(placeholder_path, mimetype='image/svg+xml')
+            # Serve the image's embedded EXIF preview while the thumbnail renders
+            # Neither may be cached, or the real thumbnail would never replace them
+            if result.get('preview'):
+                response = send_file(io.BytesIO(result['preview']), mimetype='image/jpeg')
             else:
-                # If no placeholder exists, redirect to the original image
-                return send_file(safe_path)
+                # Otherwise return a placeholder or fallback
+                placeholder_path = os.path.join(current_app.static_folder, 'img', 'thumbnail-placeholder.svg')
+                if os.path.exists(placeholder_path):
+                    response = send_file(placeholder_path, mimetype='image/svg+xml', etag=False)
+                else:
+                    # If no placeholder exists, redirect to the original image
+                    response = send_file(safe_path, etag=False)
+            
+            # Names the render, so the client can fetch the thumbnail once it is done
+            response.headers['X-Thumbnail-Task'] = result['task_id']
+            return http_cache.set_cache_headers(response, cache_control=http_cache.CACHE_CONTROL_NO_STORE)
         
-        # Send the thumbnail
-        return send_file(result['path'], mimetype='image/jpeg')
+        # Files can be sent by nginx; packed thumbnails only exist as bytes
+        if not thumbnail_store.PACKED:
+            response = http_cache.accel_redirect(result['path'], mimetype='image/jpeg')
+            if response is not None:
+                return http_cache.set_cache_headers(response, etag, source_stat.st_mtime, cache_control)
+        
+        # Send the thumbnail and keep its bytes for the next request
+        data = thumbnail_store.read(result['path'])
+        memory_cache.put(cache_key, data, len(data), validator)
+        
+        response = current_app.response_class(data, mimetype='image/jpeg')
+        return http_cache.set_cache_headers(response, etag, source_stat.st_mtime, cache_control)
     except Exception as e:
         current_app.logger.error(f"Error creating thumbnail for {safe_path}: {str(e)}")
         abort(500)
 
+@bp.route('/api/contact-sheet')
+@login_required
+def api_contact_sheet():
+    """
+    Get a contact sheet for one page of a directory.
+    
+    Takes the same `path`, `sort`, `limit` and `cursor` parameters as
+    /api/browse and returns the URL of a single sprite JPEG holding the
+    thumbnails of that page's images, with each thumbnail's offset in it.
+    """
+    path = request.args.get('path', '')
+    sort = request.args.get('sort', 'name')
+    cursor = request.args.get('cursor') or None
+    limit = request.args.get('limit', 100, type=int)
+    size = request.args.get('size', 'small')
+    
+    # Ensure the path is valid and within allowed directories
+    safe_path = get_safe_path(path, PHOTO_ROOT_DIRS)
+    if safe_path is None or not os.path.isdir(safe_path):
+        return jsonify({
+            'success': False,
+            'message': 'Invalid directory path'
+        }), 400
+    
+    try:
+        directory_mtime = os.stat(safe_path).st_mtime_ns
+    except OSError:
+        # Removed after the path was checked
+        return jsonify({
+            'success': False,
+            'message': 'Directory not found'
+        }), 404
+    
+    # Like the listing itself, the sheet is revalidated against the directory mtime
+    etag = http_cache.make_etag('contact-sheet', safe_path, directory_mtime, sort, limit, cursor, size)
+    if http_cache.is_not_modified(etag):
+        return http_cache.not_modified(etag)
+    
+    try:
+        page = catalog.browse_directory(safe_path, sort=sort, limit=limit, cursor=cursor)
+        image_paths = [item['path'] for item in page['contents'] if item['is_image']]
+        
+        sheet = thumbnail_manager.get_contact_sheet(image_paths, size)
+        
+        response = jsonify({
+            'success': True,
+            'path': safe_path,
+            'url': url_for('photos.api_contact_sheet_image', sheet_id=sheet['id']) if sheet['id'] else None,
+            'width': sheet['width'],
+            'height': sheet['height'],
+            'tiles': sheet['tiles'],
+            'missing': sheet['missing']
+        })
+        if sheet['missing']:
+            # The next request gets a fuller sheet as the renders finish
+            response.headers['Cache-Control'] = http_cache.CACHE_CONTROL_NO_STORE
+            return response
+        return http_cache.set_cache_headers(response, etag)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        current_app.logger.error(f"Error creating contact sheet for {safe_path}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error: {str(e)}'
+        }), 500
+
+@bp.route('/api/contact-sheet/<sheet_id>.jpg')
+@login_required
+def api_contact_sheet_image(sheet_id):
+    """Return a contact sheet sprite."""
+    if len(sheet_id) != 40 or any(c not in '0123456789abcdef' for c in sheet_id):
+        abort(404)
+    
+    # Sheets are content addressed, so a given URL never changes
+    if http_cache.is_not_modified(sheet_id):
+        return http_cache.not_modified(sheet_id, cache_control=http_cache.CACHE_CONTROL_IMMUTABLE)
+    
+    try:
+        data = thumbnail_store.read(get_contact_sheet_path(sheet_id))
+    except FileNotFoundError:
+        abort(404)
+    
+    response = current_app.response_class(data, mimetype='image/jpeg')
+    return http_cache.set_cache_headers(response, sheet_id, cache_control=http_cache.CACHE_CONTROL_IMMUTABLE)
+
 @bp.route('/api/image')
 @login_required
 def api_get_image():
@@ -170,11 +379,109 @@ def api_get_image():
         abort(404)
     
     try:
-        return send_file(safe_path)
+        source_stat = os.stat(safe_path)
+        etag = http_cache.make_etag(safe_path, source_stat.st_mtime_ns, source_stat.st_size, 'original')
+        return http_cache.send_cached_file(
+            safe_path, etag, source_stat.st_mtime,
+            immutable=bool(request.args.get('v'))
+        )
     except Exception as e:
         current_app.logger.error(f"Error serving image {safe_path}: {str(e)}")
         abort(500)
 
+@bp.route('/api/deep-zoom')
+@login_required
+def api_deep_zoom():
+    """
+    Describe the deep zoom pyramid of an image.
+    
+    Tiles are fetched from `tile_url` with `{level}`, `{column}` and `{row}`
+    filled in; the URL carries the source version, so tiles are cached
+    forever by the browser.
+    """
+    path = request.args.get('path', '')
+    
+    # Ensure the path is valid and within allowed directories
+    safe_path = get_safe_path(path, PHOTO_ROOT_DIRS)
+    if safe_path is None or not os.path.isfile(safe_path) or not is_image_file(safe_path):
+        return jsonify({
+            'success': False,
+            'message': 'Invalid image path'
+        }), 400
+    
+    try:
+        source_stat = os.stat(safe_path)
+    except OSError:
+        return jsonify({
+            'success': False,
+            'message': 'Image not found'
+        }), 404
+    etag = http_cache.make_etag(safe_path, source_stat.st_mtime_ns, source_stat.st_size, 'deep-zoom')
+    if http_cache.is_not_modified(etag, source_stat.st_mtime):
+        return http_cache.not_modified(etag, source_stat.st_mtime)
+    
+    try:
+        info = get_deep_zoom_info(safe_path)
+    except Exception as e:
+        current_app.logger.error(f"Error reading {safe_path} for deep zoom: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error: {str(e)}'
+        }), 500
+    
+    tile_url = url_for('photos.api_deep_zoom_tile', level=0, column=0, row=0, path=safe_path, v=source_stat.st_mtime_ns)
+    tile_url = tile_url.replace('/0/0_0.jpg', '/{level}/{column}_{row}.jpg', 1)
+    
+    response = jsonify({
+        'success': True,
+        'path': safe_path,
+        **info,
+        'tile_url': tile_url
+    })
+    return http_cache.set_cache_headers(response, etag, source_stat.st_mtime)
+
+@bp.route('/api/deep-zoom/<int:level>/<int:column>_<int:row>.jpg')
+@login_required
+def api_deep_zoom_tile(level, column, row):
+    """Return one deep zoom tile, rendering its level on first use."""
+    path = request.args.get('path', '')
+    
+    # Ensure the path is valid and within allowed directories
+    safe_path = get_safe_path(path, PHOTO_ROOT_DIRS)
+    if safe_path is None or not os.path.isfile(safe_path) or not is_image_file(safe_path):
+        abort(404)
+    
+    try:
+        source_stat = os.stat(safe_path)
+    except OSError:
+        abort(404)
+    etag = http_cache.make_etag(
+        safe_path, source_stat.st_mtime_ns, source_stat.st_size, 'tile', level, column, row
+    )
+    immutable = bool(request.args.get('v'))
+    cache_control = http_cache.CACHE_CONTROL_IMMUTABLE if immutable else http_cache.CACHE_CONTROL_REVALIDATE
+    if http_cache.is_not_modified(etag, source_stat.st_mtime):
+        return http_cache.not_modified(etag, source_stat.st_mtime, cache_control)
+    
+    try:
+        tile_path = thumbnail_manager.get_deep_zoom_tile(safe_path, level, column, row)
+        data = thumbnail_store.read(tile_path) if tile_path else None
+    except ValueError:
+        abort(404)
+    except Exception as e:
+        current_app.logger.error(f"Error creating deep zoom tile for {safe_path}: {str(e)}")
+        abort(500)
+    
+    if data is None:
+        # The level is still being rendered; the viewer asks again
+        response = current_app.response_class(status=503)
+        response.headers['Retry-After'] = '2'
+        response.headers['Cache-Control'] = http_cache.CACHE_CONTROL_NO_STORE
+        return response
+    
+    response = current_app.response_class(data, mimetype='image/jpeg')
+    return http_cache.set_cache_headers(response, etag, source_stat.st_mtime, cache_control)
+
 @bp.route('/api/metadata')
 @login_required
 def api_get_metadata():
@@ -190,11 +497,33 @@ def api_get_metadata():
         }), 404
     
     try:
-        metadata = get_image_metadata(safe_path)
+        source_stat = os.stat(safe_path)
+    except OSError:
         return jsonify({
+            'success': False,
+            'message': 'Image not found'
+        }), 404
+    etag = http_cache.make_etag('metadata', safe_path, source_stat.st_mtime_ns, source_stat.st_size)
+    if http_cache.is_not_modified(etag):
+        return http_cache.not_modified(etag)
+    
+    try:
+        cache_key = ('metadata', safe_path)
+        validator = source_validator(source_stat)
+        metadata = memory_cache.get(cache_key, validator)
+        if metadata is None:
+            try:
+                metadata = catalog.get_metadata(safe_path, source_stat)
+            except sqlite3.Error as e:
+                current_app.logger.warning(f"Photo catalog unavailable, reading {safe_path}: {str(e)}")
+                metadata = get_image_metadata(safe_path, source_stat)
+            memory_cache.put(cache_key, metadata, len(json.dumps(metadata, default=str)), validator)
+        
+        response = jsonify({
             'success': True,
             'metadata': metadata
         })
+        return http_cache.set_cache_headers(response, etag)
     except Exception as e:
         current_app.logger.error(f"Error reading metadata for {safe_path}: {str(e)}")
         return jsonify({
@@ -202,6 +531,66 @@ def api_get_metadata():
             'message': f'Error: {str(e)}'
         }), 500
 
+@bp.route('/api/directory-metadata')
+@login_required
+def api_directory_metadata():
+    """
+    Return the metadata of every image in a directory, column by column.
+    
+    The response is `{"success", "path", "count", "columns": {name: [...]}}`
+    with one list per field (name, size, modified, captured_at, width,
+    height, exposure_time, analogue_gain, lens_position, hdr_index), all
+    in the same order. It is streamed, and gzipped if the client accepts it.
+    """
+    path = request.args.get('path', '')
+    sort = request.args.get('sort', 'name')
+    
+    # Ensure the path is valid and within allowed directories
+    safe_path = get_safe_path(path, PHOTO_ROOT_DIRS)
+    if safe_path is None or not os.path.isdir(safe_path):
+        return jsonify({
+            'success': False,
+            'message': 'Invalid directory path'
+        }), 400
+    
+    try:
+        directory_mtime = os.stat(safe_path).st_mtime_ns
+    except OSError:
+        # Removed after the path was checked
+        return jsonify({
+            'success': False,
+            'message': 'Directory not found'
+        }), 404
+    
+    compress = http_cache.accepts_gzip()
+    etag = http_cache.make_etag('directory-metadata', safe_path, directory_mtime, sort, compress)
+    if http_cache.is_not_modified(etag):
+        return http_cache.not_modified(etag)
+    
+    try:
+        columns = catalog.get_directory_metadata(safe_path, sort)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        current_app.logger.error(f"Error reading metadata for {safe_path}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error: {str(e)}'
+        }), 500
+    
+    def generate():
+        header = json.dumps({'success': True, 'path': safe_path, 'count': len(columns['name'])})
+        yield header[:-1] + ', "columns": {'
+        for index, (name, values) in enumerate(columns.items()):
+            yield f'{", " if index else ""}{json.dumps(name)}: {json.dumps(values)}'
+        yield '}}'
+    
+    response = http_cache.stream_response(generate(), 'application/json', compress)
+    return http_cache.set_cache_headers(response, etag)
+
 @bp.route('/api/download')
 @login_required
 def api_download_image():
@@ -214,8 +603,14 @@ def api_download_image():
         abort(404)
     
     try:
-        return send_file(safe_path, as_attachment=True, 
-                        download_name=secure_filename(os.path.basename(safe_path)))
+        # Validators let an interrupted download resume with Range / If-Range
+        source_stat = os.stat(safe_path)
+        etag = http_cache.make_etag(safe_path, source_stat.st_mtime_ns, source_stat.st_size, 'original')
+        return http_cache.send_cached_file(
+            safe_path, etag, source_stat.st_mtime,
+            as_attachment=True,
+            download_name=secure_filename(os.path.basename(safe_path))
+        )
     except Exception as e:
         current_app.logger.error(f"Error downloading file {safe_path}: {str(e)}")
         abort(500)
@@ -251,11 +646,20 @@ def api_batch_download():
                 'message': result.get('error', 'Failed to create download')
             }), 500
         
+        # An identical archive that already exists can be downloaded at once
+        download_url = None
+        if result['ready']:
+            download_url = url_for(
+                'photos.api_download_archive',
+                filename=result['filename'], name=result['download_name']
+            )
+        
         return jsonify({
             'success': True,
             'task_id': result['task_id'],
             'filename': result['filename'],
-            'image_count': result['image_count']
+            'image_count': result['image_count'],
+            'download_url': download_url
         })
     except Exception as e:
         current_app.logger.error(f"Error creating batch download: {str(e)}")
@@ -265,6 +669,36 @@ def api_batch_download():
         }), 500
 
 
+@bp.route('/api/download-stream', methods=['POST'])
+@login_required
+def api_download_stream():
+    """
+    Download several images as a ZIP archive generated on the fly.
+    
+    Takes a form post (so the browser saves the response as a download)
+    with one `images` field per photo, plus `filename` and `include_folders`.
+    """
+    result = download.stream_zip_archive(
+        images=request.form.getlist('images'),
+        allowed_roots=PHOTO_ROOT_DIRS,
+        download_filename=secure_filename(request.form.get('filename', '')),
+        include_folders=request.form.get('include_folders', '1') == '1'
+    )
+    
+    if not result['success']:
+        return jsonify({
+            'success': False,
+            'message': result.get('error', 'Failed to create download')
+        }), 400
+    
+    response = current_app.response_class(stream_with_context(result['stream']), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename=result['filename'])
+    response.headers['Cache-Control'] = http_cache.CACHE_CONTROL_NO_STORE
+    # Pass chunks straight through nginx instead of spooling them to disk
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @bp.route('/api/download-status')
 @login_required
 def api_download_status():
@@ -285,17 +719,11 @@ def api_download_status():
             'message': 'Unknown task ID'
         }), 404
     
-    # Create a download URL if the task is completed
-    download_url = None
-    if status['status'] == tasks.STATUS_COMPLETED and 'result' in status:
-        result = status['result']
-        if result.get('success') and 'filename' in result:
-            download_url = url_for('photos.api_download_archive', filename=result['filename'])
-    
     return jsonify({
         'success': True,
         'status': status['status'],
-        'download_url': download_url,
+        'download_url': _archive_download_url(status),
+        'failed_images': _archive_failed_images(status),
         'details': {
             key: value for key, value in status.items()
             if key not in ('func', 'args', 'kwargs')
@@ -303,6 +731,26 @@ def api_download_status():
     })
 
 
+def _archive_download_url(status):
+    """Get the download URL of a completed batch download task, if any."""
+    if status['status'] == tasks.STATUS_COMPLETED and 'result' in status:
+        result = status['result']
+        if result.get('success') and 'filename' in result:
+            return url_for(
+                'photos.api_download_archive',
+                filename=result['filename'], name=result.get('download_name')
+            )
+    return None
+
+
+def _archive_failed_images(status):
+    """Get the photos a batch download task couldn't add to its archive."""
+    result = status.get('result')
+    if isinstance(result, dict):
+        return result.get('failed_images', [])
+    return []
+
+
 @bp.route('/api/download-archive')
 @login_required
 def api_download_archive():
@@ -313,6 +761,7 @@ def api_download_archive():
     
     # Sanitize the filename to prevent path traversal
     filename = secure_filename(filename)
+    download_name = secure_filename(request.args.get('name', '')) or filename
     
     # Get the download path
     file_path = download.get_download_path(filename)
@@ -320,10 +769,13 @@ def api_download_archive():
         abort(404)
     
     try:
-        return send_file(
-            file_path,
+        # Validators let an interrupted download resume with Range / If-Range
+        archive_stat = os.stat(file_path)
+        etag = http_cache.make_etag(file_path, archive_stat.st_mtime_ns, archive_stat.st_size)
+        return http_cache.send_cached_file(
+            file_path, etag, archive_stat.st_mtime,
             as_attachment=True,
-            download_name=filename
+            download_name=download_name
         )
     except Exception as e:
         current_app.logger.error(f"Error sending download archive: {str(e)}")
@@ -407,6 +859,105 @@ def api_task_status():
     })
 
 
+@bp.route('/api/task-events')
+@login_required
+def api_task_events():
+    """
+    Stream a task's status and progress as server-sent events.
+    
+    A `progress` event is sent whenever the task changes, and a `done`
+    event once it has finished (completed, failed or cancelled), with the
+    download URL for a finished batch download. The stream ends after
+    TASK_EVENTS_MAX_SECONDS; EventSource then reconnects by itself.
+    """
+    task_id = request.args.get('task_id', '')
+    if not task_id:
+        return jsonify({
+            'success': False,
+            'message': 'Missing task ID'
+        }), 400
+    
+    if tasks.get_task_status(task_id)['status'] == 'unknown':
+        return jsonify({
+            'success': False,
+            'message': 'Unknown task ID'
+        }), 404
+    
+    def generate():
+        # Reconnect soon if the connection drops
+        yield f"retry: {int(TASK_EVENTS_INTERVAL * 4000)}\n\n"
+        
+        deadline = time.time() + TASK_EVENTS_MAX_SECONDS
+        last_data = None
+        last_sent = time.time()
+        while True:
+            status = tasks.get_task_status(task_id)
+            finished = status['status'] not in (tasks.STATUS_PENDING, tasks.STATUS_PROCESSING)
+            data = json.dumps({
+                'status': status['status'],
+                'progress': status.get('progress'),
+                'download_url': _archive_download_url(status),
+                'failed_images': _archive_failed_images(status),
+                'details': {
+                    key: value for key, value in status.items()
+                    if key not in ('func', 'args', 'kwargs')
+                }
+            })
+            
+            if data != last_data:
+                yield f"event: {'done' if finished else 'progress'}\ndata: {data}\n\n"
+                last_data = data
+                last_sent = time.time()
+            elif time.time() - last_sent >= TASK_EVENTS_KEEPALIVE:
+                # Keeps proxies from closing an idle connection
+                yield ": keepalive\n\n"
+                last_sent = time.time()
+            
+            if finished or time.time() >= deadline:
+                return
+            time.sleep(TASK_EVENTS_INTERVAL)
+    
+    response = current_app.response_class(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = http_cache.CACHE_CONTROL_NO_STORE
+    # Pass events straight through nginx instead of buffering them
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@bp.route('/api/task-cancel', methods=['POST'])
+@login_required
+def api_task_cancel():
+    """
+    Cancel a pending or running task.
+    
+    A running task stops at its next check, so its final status arrives
+    on the task's event stream.
+    """
+    data = request.get_json(silent=True) or {}
+    task_id = data.get('task_id', '')
+    if not task_id:
+        return jsonify({
+            'success': False,
+            'message': 'Missing task ID'
+        }), 400
+    
+    if not tasks.cancel_task(task_id):
+        if tasks.get_task_status(task_id)['status'] == 'unknown':
+            return jsonify({
+                'success': False,
+                'message': 'Unknown task ID'
+            }), 404
+        return jsonify({
+            'success': False,
+            'message': 'Task has already finished'
+        }), 409
+    
+    return jsonify({
+        'success': True,
+        'message': 'Cancellation requested'
+    })
+
+
 @bp.route('/api/tasks')
 @login_required
 def api_list_tasks():
@@ -431,6 +982,16 @@ def api_thumbnail_stats():
     return jsonify(stats)
 
 
+@bp.route('/api/cache-stats')
+@login_required
+def api_cache_stats():
+    """Get statistics of this worker's in-memory thumbnail/metadata cache."""
+    return jsonify({
+        'success': True,
+        'cache': memory_cache.stats()
+    })
+
+
 @bp.route('/api/cleanup-thumbnails', methods=['POST'])
 @login_required
 def api_cleanup_thumbnails():
@@ -456,6 +1017,42 @@ def api_cleanup_thumbnails():
         }), 500
 
 
+@bp.route('/api/rescan-catalog', methods=['POST'])
+@login_required
+def api_rescan_catalog():
+    """Rescan the photo catalog for directories that changed on disk."""
+    try:
+        # Get the options
+        data = request.get_json(silent=True) or {}
+        directory = data.get('directory')
+        
+        if directory:
+            safe_path = get_safe_path(directory, PHOTO_ROOT_DIRS)
+            if safe_path is None or not os.path.isdir(safe_path):
+                return jsonify({
+                    'success': False,
+                    'message': 'Invalid directory path'
+                }), 400
+            roots = [safe_path]
+        else:
+            roots = [root for root in PHOTO_ROOT_DIRS if os.path.isdir(root)]
+        
+        # Start the rescan
+        result = catalog.rescan(roots)
+        
+        return jsonify({
+            'success': True,
+            'task_id': result['task_id'],
+            'roots': result['roots']
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error starting catalog rescan: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Error: {str(e)}'
+        }), 500
+
+
 @bp.route('/api/cleanup-downloads', methods=['POST'])
 @login_required
 def api_cleanup_downloads():
@@ -1,18 +1,51 @@
 """
 Background task processing for the Photos module.
 
-Handles thumbnail generation and other long-running tasks in a way that's 
+Handles thumbnail generation and other long-running tasks in a way that's
 resistant to interruptions like system shutdowns.
+
+Tasks are queued in a small SQLite database shared by every process of
+the application, so any gunicorn worker can enqueue a task or report on
+it. A consumer claims a task with a lease and renews the lease while the
+task runs; if the consumer dies, the task is claimed again once its lease
+has expired. The consumer normally runs in a dedicated process
+(`python -m app.photos.consumer`); otherwise the web worker holding the
+consumer lock runs it.
+
+Tasks run in priority lanes: interactive tasks (thumbnails someone is
+waiting for) before batch jobs a user started, and those before
+maintenance. Long batch tasks check between items whether something
+more urgent is waiting and, if so, hand the rest of their work back to
+the queue.
+
+Tasks enqueued with a key are coalesced: while one is unfinished, the
+same key returns that task instead of queueing the work again.
+
+Long tasks report their progress as they go (items, bytes and an
+estimated time left) and stop when asked to: cancelling a running task
+sets a flag they check between items.
+
+Every transition writes just the row of the task that changed, and old
+finished tasks are compacted away in the background, so the cost of a
+transition doesn't grow with the task history.
 """
 
 import os
 import time
 import json
+import uuid
+import sqlite3
 import logging
 import threading
-import queue
+import itertools
+import importlib
 from typing import Dict, Any, List, Callable, Optional
-from pathlib import Path
+
+# fcntl is only available on Unix
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -23,202 +56,849 @@ STATUS_PROCESSING = 'processing'
 STATUS_COMPLETED = 'completed'
 STATUS_FAILED = 'failed'
 STATUS_INTERRUPTED = 'interrupted'
+STATUS_CANCELLED = 'cancelled'
+
+# Statuses a task never leaves (it is given a completed_at on reaching one)
+TERMINAL_STATUSES = (STATUS_COMPLETED, STATUS_FAILED, STATUS_INTERRUPTED, STATUS_CANCELLED)
+
+# Number of worker threads. Heavy image work runs in the render pool
+# (see render_pool.py), so these threads mostly wait on it; several of
+# them let independent tasks keep every render process busy.
+WORKER_THREADS = int(os.environ.get('CREATUREBOX_TASK_WORKERS', os.cpu_count() or 1))
+
+# Where tasks run: 'embedded' (in the web worker that holds the consumer
+# lock) or 'external' (only in a dedicated consumer process)
+TASK_CONSUMER = os.environ.get('CREATUREBOX_TASK_CONSUMER', 'embedded')
 
-# Task queue and worker thread
-task_queue = queue.Queue()
-worker_thread = None
+# Seconds a claimed task is leased for; the lease is renewed while it runs
+LEASE_SECONDS = int(os.environ.get('CREATUREBOX_TASK_LEASE', 60))
+
+# Priority lanes, most urgent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_MAINTENANCE = 2
+
+# Lane of each task type; other types run as batch jobs
+TASK_PRIORITIES = {
+    'thumbnail': PRIORITY_INTERACTIVE,
+    'deep_zoom': PRIORITY_INTERACTIVE,
+    'batch_thumbnails': PRIORITY_BATCH,
+    'batch_download': PRIORITY_BATCH,
+    'image_thumbnails': PRIORITY_MAINTENANCE,
+    'catalog_rescan': PRIORITY_MAINTENANCE,
+    'cleanup_thumbnails': PRIORITY_MAINTENANCE,
+    'cleanup_downloads': PRIORITY_MAINTENANCE,
+}
+
+# Claims of a task (each ended by a lost lease) before it's given up
+MAX_ATTEMPTS = 3
+
+# Seconds an idle worker thread waits before looking for new tasks
+POLL_INTERVAL = 0.5
+
+# Seconds between progress writes and cancellation checks of a running task
+PROGRESS_INTERVAL = 0.5
+
+# Worker threads and the thread renewing their leases
+worker_threads = []
 worker_running = False
-task_registry = {}
+heartbeat_thread = None
 
 # Task state persistence
-TASKS_STATE_FILE = None  # Will be set at initialization
+TASKS_DB_PATH = None  # Will be set at initialization
+
+# State file written by earlier versions, imported once
+LEGACY_STATE_FILE_NAME = 'photo_tasks.json'
+
+# Lock file held by the web worker that runs the embedded consumer
+CONSUMER_LOCK_NAME = 'photo_tasks.lock'
+
+# Finished tasks are kept this long, and compaction runs this often (seconds)
+TASK_RETENTION = 86400
+COMPACT_INTERVAL = 3600
+
+# Columns of the tasks table; any other field is stored in `data` as JSON
+TASK_COLUMNS = ('id', 'type', 'status', 'created_at', 'started_at', 'completed_at')
+
+# Fields read from columns of their own, written by report_progress and cancel_task
+LIVE_FIELDS = ('progress', 'cancel_requested')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    completed_at REAL,
+    data TEXT NOT NULL DEFAULT '{}',
+    func TEXT,
+    payload TEXT,
+    lease_id TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    dedupe_key TEXT,
+    priority INTEGER NOT NULL DEFAULT 1,
+    progress TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Columns added since the first version of the task store
+MIGRATIONS = [
+    ('func', 'TEXT'),
+    ('payload', 'TEXT'),
+    ('lease_id', 'TEXT'),
+    ('lease_expires', 'REAL'),
+    ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+    ('dedupe_key', 'TEXT'),
+    ('priority', 'INTEGER NOT NULL DEFAULT 1'),
+    ('progress', 'TEXT'),
+    ('cancel_requested', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_tasks_status
+    ON tasks (status, completed_at);
+
+CREATE INDEX IF NOT EXISTS idx_tasks_type
+    ON tasks (type, created_at);
+
+DROP INDEX IF EXISTS idx_tasks_queue;
+
+CREATE INDEX IF NOT EXISTS idx_tasks_priority
+    ON tasks (status, priority, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_tasks_lease
+    ON tasks (lease_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_dedupe
+    ON tasks (dedupe_key) WHERE status IN ('pending', 'processing');
+"""
+
+# Tasks a worker may claim, tried in order: tasks whose consumer stopped
+# renewing the lease, then new tasks, each by priority and oldest first
+CLAIM_CANDIDATES = (
+    "SELECT id FROM tasks WHERE status = 'processing' AND lease_expires < :now "
+    "AND attempts < :max_attempts AND priority <= :max_priority AND func IS NOT NULL "
+    "ORDER BY priority, created_at LIMIT 1",
+    "SELECT id FROM tasks WHERE status = 'pending' AND priority <= :max_priority "
+    "AND func IS NOT NULL ORDER BY priority, created_at LIMIT 1",
+)
+
+# Per-thread database connections and the time of the last compaction
+_local = threading.local()
+
+# Task running in each worker thread (priority, lease, progress state)
+_current = threading.local()
+_last_compaction = 0.0
+
+# Sequence number for task IDs
+_task_counter = itertools.count(1)
+
+# Set when a task is enqueued in this process, to wake an idle worker
+_wakeup = threading.Event()
+
+# Leases held by this process's workers, renewed by the heartbeat thread
+_active_leases = set()
+_leases_lock = threading.Lock()
+
+# Consumer lock file (embedded consumer)
+_lock_file = None
+
+
+class Continuation:
+    """
+    Returned by a task function that has done part of its work: the task
+    goes back to the queue, to be called again with these arguments once
+    more urgent tasks have run.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+
+
+class TaskCancelled(BaseException):
+    """
+    Raised by a task function that stopped because it was cancelled.
+    
+    Like asyncio.CancelledError it isn't an Exception, so the handlers a
+    task has for failures of single items don't swallow it.
+    """
 
 
 def initialize(base_dir: str) -> None:
     """Initialize the task system with proper state file location."""
-    global TASKS_STATE_FILE
+    global TASKS_DB_PATH
     
-    # Set the state file path
+    # Set the state database path
     state_dir = os.path.join(base_dir, 'instance', 'state')
     os.makedirs(state_dir, exist_ok=True)
-    TASKS_STATE_FILE = os.path.join(state_dir, 'photo_tasks.json')
+    TASKS_DB_PATH = os.path.join(state_dir, 'photo_tasks.sqlite')
     
-    # Load any existing tasks
-    _load_tasks_state()
+    conn = _get_connection()
+    _migrate(conn)
+    conn.executescript(INDEXES)
+    conn.commit()
+    
+    # Bring in tasks recorded by earlier versions
+    _import_legacy_state(os.path.join(state_dir, LEGACY_STATE_FILE_NAME))
+    _interrupt_orphaned_tasks()
     
     # Start the worker thread
     start_worker()
 
 
+def _migrate(conn: sqlite3.Connection) -> None:
+    """Add columns missing from task stores created by older versions."""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(tasks)')}
+    missing = [(name, definition) for name, definition in MIGRATIONS if name not in columns]
+    if not missing:
+        return
+    
+    with conn:
+        for name, definition in missing:
+            conn.execute(f'ALTER TABLE tasks ADD COLUMN {name} {definition}')
+    
+    logger.info(f"Task store migrated: added {', '.join(name for name, _ in missing)}")
+
+
 def start_worker() -> None:
-    """Start the background worker thread if not already running."""
-    global worker_thread, worker_running
+    """
+    Start the embedded consumer in this process if it is the one to run it.
+    
+    With several gunicorn workers the first one to take the consumer lock
+    runs the tasks for all of them. Nothing is started if tasks are run by
+    a dedicated consumer process.
+    """
+    if TASK_CONSUMER != 'embedded' or not _acquire_consumer_lock():
+        return
+    _start_threads()
+
+
+def run_consumer(timeout: int = 30) -> None:
+    """
+    Run the task consumer in the current process until it is stopped.
+    
+    Used by the dedicated consumer process; any number of consumers may
+    run at once.
+    
+    Args:
+        timeout: Maximum time to wait for running tasks when stopping, in seconds
+    """
+    _start_threads()
+    try:
+        while worker_running:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    stop_worker(wait=True, timeout=timeout)
+
+
+def _acquire_consumer_lock() -> bool:
+    """Take the embedded consumer lock, if no other process holds it."""
+    global _lock_file
+    
+    if _lock_file is not None:
+        return True
+    if fcntl is None or not TASKS_DB_PATH:
+        return True
     
-    if worker_thread is None or not worker_thread.is_alive():
-        worker_running = True
-        worker_thread = threading.Thread(target=_worker_loop, daemon=True)
-        worker_thread.start()
-        logger.info("Background worker thread started")
+    lock_path = os.path.join(os.path.dirname(TASKS_DB_PATH), CONSUMER_LOCK_NAME)
+    lock_file = open(lock_path, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    
+    _lock_file = lock_file
+    logger.info("This process runs the photo task consumer")
+    return True
+
+
+def _start_threads() -> None:
+    """Start the worker threads and the lease heartbeat if not already running."""
+    global worker_threads, worker_running, heartbeat_thread
+    
+    worker_threads = [thread for thread in worker_threads if thread.is_alive()]
+    missing_lanes = _worker_lanes()
+    for thread in worker_threads:
+        missing_lanes.remove(thread.lane)
+    if not missing_lanes and heartbeat_thread is not None:
+        return
+    
+    worker_running = True
+    for lane in missing_lanes:
+        thread = threading.Thread(target=_worker_loop, args=(lane,), daemon=True)
+        thread.lane = lane
+        thread.start()
+        worker_threads.append(thread)
+    
+    if heartbeat_thread is None or not heartbeat_thread.is_alive():
+        heartbeat_thread = threading.Thread(target=_heartbeat_loop, daemon=True)
+        heartbeat_thread.start()
+    logger.info(f"Background worker threads started ({len(worker_threads)})")
+
+
+def _worker_lanes() -> List[int]:
+    """Get the lowest priority each worker thread may claim, one per thread."""
+    lanes = [PRIORITY_MAINTENANCE] * max(1, WORKER_THREADS)
+    # With several threads, one is kept for interactive tasks so that they
+    # never wait for a thread behind batch jobs
+    if len(lanes) > 1:
+        lanes[0] = PRIORITY_INTERACTIVE
+    return lanes
 
 
 def stop_worker(wait: bool = True, timeout: int = 5) -> None:
     """
-    Stop the background worker thread.
+    Stop the background worker threads.
+    
+    Tasks that are still running when the timeout expires keep their
+    lease until it runs out, and are then claimed again.
     
     Args:
-        wait: Whether to wait for current task to complete
+        wait: Whether to wait for current tasks to complete
         timeout: Maximum time to wait in seconds
     """
-    global worker_running
+    global worker_running, _lock_file
     
-    if worker_thread and worker_thread.is_alive():
-        logger.info("Stopping background worker thread...")
+    alive = [thread for thread in worker_threads if thread.is_alive()]
+    if alive:
+        logger.info("Stopping background worker threads...")
         worker_running = False
+        _wakeup.set()
         
-        # Clear the queue to prevent processing additional tasks
-        while not task_queue.empty():
-            try:
-                task_queue.get_nowait()
-                task_queue.task_done()
-            except queue.Empty:
-                break
-        
-        # Add a sentinel task to unblock the worker
-        task_queue.put(None)
-        
-        # Wait for the worker to finish current task
-        if wait and worker_thread.is_alive():
-            worker_thread.join(timeout)
-            if worker_thread.is_alive():
-                logger.warning("Worker thread did not terminate gracefully within timeout")
+        # Wait for the workers to finish their current tasks
+        if wait:
+            deadline = time.time() + timeout
+            for thread in alive:
+                thread.join(max(0, deadline - time.time()))
+                if thread.is_alive():
+                    logger.warning("Worker thread did not terminate gracefully within timeout")
         
-        # Save current state
-        _save_tasks_state()
-        logger.info("Background worker thread stopped")
+        logger.info("Background worker threads stopped")
+    
+    if _lock_file is not None:
+        _lock_file.close()
+        _lock_file = None
 
 
-def _worker_loop() -> None:
-    """Main worker thread loop."""
-    global worker_running
+def _worker_loop(max_priority: int = PRIORITY_MAINTENANCE) -> None:
+    """
+    Main worker thread loop.
+    
+    Args:
+        max_priority: Lowest priority (highest number) this thread claims
+    """
     logger.info("Worker loop started")
     
     while worker_running:
         try:
-            # Get the next task
-            task = task_queue.get(timeout=1.0)
-            
-            # Check for sentinel task
-            if task is None:
-                task_queue.task_done()
-                continue
-            
-            task_id = task.get('id')
-            
-            # Process the task
-            try:
-                logger.info(f"Processing task {task_id}: {task.get('type')}")
-                task['status'] = STATUS_PROCESSING
-                task['started_at'] = time.time()
-                _save_tasks_state()  # Save state before processing
-                
-                # Execute the task function
-                result = task['func'](*task.get('args', []), **task.get('kwargs', {}))
-                
-                # Update task state
-                task['status'] = STATUS_COMPLETED
-                task['completed_at'] = time.time()
-                task['result'] = result
-                
-                logger.info(f"Task {task_id} completed successfully")
-            except Exception as e:
-                logger.error(f"Error processing task {task_id}: {str(e)}")
-                task['status'] = STATUS_FAILED
-                task['error'] = str(e)
-            finally:
-                _save_tasks_state()  # Save state after processing
-                task_queue.task_done()
+            task = _claim_task(max_priority)
+        except Exception as e:
+            logger.error(f"Error claiming task: {str(e)}")
+            task = None
         
-        except queue.Empty:
-            # Timeout - opportunity to check if we should keep running
-            pass
+        if task is None:
+            # Nothing to do - opportunity to compact the task store while
+            # idle, then wait for a new task
+            _maybe_compact()
+            _wakeup.wait(POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+        
+        _run_task(task)
+    
+    logger.info("Worker loop exited")
+
+
+def _run_task(task: Dict[str, Any]) -> None:
+    """Run a claimed task and record its outcome."""
+    task_id = task['id']
+    lease_id = task.pop('lease_id')
+    _current.priority = task.pop('priority')
+    _current.task_id = task_id
+    _current.lease_id = lease_id
+    _current.progress_at = 0.0
+    _current.progress_base = None
+    _current.cancel_checked_at = time.time()
+    _current.cancelled = bool(task.pop('cancel_requested', False))
+    
+    with _leases_lock:
+        _active_leases.add(lease_id)
+    
+    # Process the task
+    try:
+        if _current.cancelled:
+            # Cancelled while its previous consumer held it
+            raise TaskCancelled()
+        
+        logger.info(f"Processing task {task_id}: {task.get('type')}")
+        func = _resolve_function(task.pop('func'))
+        payload = json.loads(task.pop('payload') or '{}')
+        
+        # Execute the task function
+        result = func(*payload.get('args', []), **payload.get('kwargs', {}))
+        
+        if isinstance(result, Continuation):
+            # Part of the work is done; queue the rest behind more urgent tasks
+            if _requeue_task(task_id, lease_id, result):
+                logger.info(f"Task {task_id} yielded, rest of its work queued again")
+            else:
+                logger.warning(f"Task {task_id} lost its lease, progress discarded")
+            return
+        
+        # Update task state
+        task['status'] = STATUS_COMPLETED
+        task['completed_at'] = time.time()
+        task['result'] = result
+        
+        logger.info(f"Task {task_id} completed successfully")
+    except TaskCancelled:
+        logger.info(f"Task {task_id} cancelled")
+        task['status'] = STATUS_CANCELLED
+        task['completed_at'] = time.time()
+    except Exception as e:
+        logger.error(f"Error processing task {task_id}: {str(e)}")
+        task['status'] = STATUS_FAILED
+        task['completed_at'] = time.time()
+        task['error'] = str(e)
+    finally:
+        _current.priority = None
+        _current.task_id = None
+        with _leases_lock:
+            _active_leases.discard(lease_id)
+    
+    if not _update_task(task, lease_id):
+        logger.warning(f"Task {task_id} lost its lease, result discarded")
+
+
+def _heartbeat_loop() -> None:
+    """Renew the leases of the tasks this process is running."""
+    while worker_running:
+        time.sleep(LEASE_SECONDS / 3)
+        
+        with _leases_lock:
+            leases = list(_active_leases)
+        if not leases:
+            continue
+        
+        try:
+            conn = _get_connection()
+            with conn:
+                conn.executemany(
+                    'UPDATE tasks SET lease_expires = ? WHERE lease_id = ?',
+                    [(time.time() + LEASE_SECONDS, lease_id) for lease_id in leases]
+                )
         except Exception as e:
-            logger.error(f"Error in worker loop: {str(e)}")
+            logger.error(f"Error renewing task leases: {str(e)}")
+
+
+def _claim_task(max_priority: int = PRIORITY_MAINTENANCE) -> Optional[Dict[str, Any]]:
+    """
+    Claim the next task for this worker.
     
-    # Mark incomplete tasks as interrupted
-    for task_id, task in task_registry.items():
-        if task['status'] in (STATUS_PENDING, STATUS_PROCESSING):
-            task['status'] = STATUS_INTERRUPTED
+    The claim is a single UPDATE, so two consumers can never take the
+    same task; the new lease ID then identifies the row that was claimed.
     
-    # Save final state before exit
-    _save_tasks_state()
-    logger.info("Worker loop exited")
+    Args:
+        max_priority: Lowest priority (highest number) to claim
+        
+    Returns:
+        The claimed task with its function, payload and lease ID, or None
+    """
+    conn = _get_connection()
+    if conn is None:
+        return None
+    
+    now = time.time()
+    lease_id = uuid.uuid4().hex
+    
+    for candidate in CLAIM_CANDIDATES:
+        with conn:
+            cursor = conn.execute(
+                f"UPDATE tasks SET status = :status, lease_id = :lease_id, "
+                f"lease_expires = :expires, attempts = attempts + 1, "
+                f"started_at = COALESCE(started_at, :now) "
+                f"WHERE id = ({candidate})",
+                {
+                    'status': STATUS_PROCESSING,
+                    'lease_id': lease_id,
+                    'expires': now + LEASE_SECONDS,
+                    'now': now,
+                    'max_attempts': MAX_ATTEMPTS,
+                    'max_priority': max_priority,
+                }
+            )
+        if cursor.rowcount:
+            break
+    else:
+        return None
+    
+    conn.row_factory = sqlite3.Row
+    try:
+        row = conn.execute('SELECT * FROM tasks WHERE lease_id = ?', (lease_id,)).fetchone()
+    finally:
+        conn.row_factory = None
+    
+    task = _row_task(row)
+    task.update(
+        func=row['func'], payload=row['payload'], priority=row['priority'], lease_id=lease_id
+    )
+    return task
+
+
+def _requeue_task(task_id: str, lease_id: str, continuation: Continuation) -> bool:
+    """
+    Put a task that yielded back in the queue with its remaining work.
+    
+    Returns:
+        True if the task still held the lease and was requeued
+    """
+    conn = _get_connection()
+    try:
+        with conn:
+            return conn.execute(
+                'UPDATE tasks SET status = ?, payload = ?, lease_id = NULL, lease_expires = NULL, '
+                'attempts = 0 WHERE id = ? AND lease_id = ?',
+                (
+                    STATUS_PENDING,
+                    json.dumps({'args': continuation.args, 'kwargs': continuation.kwargs}),
+                    task_id,
+                    lease_id
+                )
+            ).rowcount > 0
+    except Exception as e:
+        logger.error(f"Error requeuing task {task_id}: {str(e)}")
+        return False
+
+
+def should_yield() -> bool:
+    """
+    Check whether the task running in this thread should make way for a
+    more urgent one.
+    
+    Long tasks call this between items and, if it returns True, return a
+    Continuation with the work that's left.
+    
+    Returns:
+        True if a task of a higher priority is waiting
+    """
+    priority = getattr(_current, 'priority', None)
+    if not priority:
+        return False
+    
+    conn = _get_connection()
+    row = conn.execute(
+        'SELECT 1 FROM tasks WHERE status = ? AND priority < ? LIMIT 1',
+        (STATUS_PENDING, priority)
+    ).fetchone()
+    return row is not None
+
+
+def report_progress(
+    done: int,
+    total: int,
+    bytes_done: Optional[int] = None,
+    bytes_total: Optional[int] = None
+) -> None:
+    """
+    Record the progress of the task running in this thread.
+    
+    Long tasks call this after each item (or chunk); it writes at most
+    every PROGRESS_INTERVAL seconds, and always once the work is done.
+    The estimated time left comes from the rate since the first report
+    of the current run, by bytes when they are known.
+    
+    Args:
+        done: Items finished
+        total: Items in the whole task
+        bytes_done: Bytes processed
+        bytes_total: Bytes in the whole task
+    """
+    task_id = getattr(_current, 'task_id', None)
+    if task_id is None:
+        return
+    
+    now = time.time()
+    if done < total and now - _current.progress_at < PROGRESS_INTERVAL:
+        return
+    _current.progress_at = now
+    
+    if _current.progress_base is None:
+        _current.progress_base = (now, done, bytes_done or 0)
+    base_time, base_done, base_bytes = _current.progress_base
+    
+    if bytes_total and bytes_done is not None:
+        fraction = bytes_done / bytes_total
+        processed, remaining = bytes_done - base_bytes, bytes_total - bytes_done
+    else:
+        fraction = done / total if total else 1.0
+        processed, remaining = done - base_done, total - done
+    
+    eta_seconds = None
+    if processed > 0 and now > base_time:
+        eta_seconds = round(remaining * (now - base_time) / processed, 1)
+    
+    progress = {
+        'done': done,
+        'total': total,
+        'percent': round(100 * fraction, 1),
+        'eta_seconds': eta_seconds,
+        'updated_at': now
+    }
+    if bytes_done is not None:
+        progress.update(bytes_done=bytes_done, bytes_total=bytes_total)
+    
+    try:
+        conn = _get_connection()
+        with conn:
+            conn.execute(
+                'UPDATE tasks SET progress = ? WHERE id = ? AND lease_id = ?',
+                (json.dumps(progress), task_id, _current.lease_id)
+            )
+    except Exception as e:
+        logger.error(f"Error saving progress of task {task_id}: {str(e)}")
+
+
+def cancel_requested() -> bool:
+    """
+    Check whether the task running in this thread has been cancelled.
+    
+    Long tasks call this between items (or chunks) and, if it returns
+    True, clean up and raise TaskCancelled. The task store is read at
+    most every PROGRESS_INTERVAL seconds.
+    
+    Returns:
+        True if the task should stop
+    """
+    task_id = getattr(_current, 'task_id', None)
+    if task_id is None:
+        return False
+    
+    now = time.time()
+    if not _current.cancelled and now - _current.cancel_checked_at >= PROGRESS_INTERVAL:
+        _current.cancel_checked_at = now
+        row = _get_connection().execute(
+            'SELECT cancel_requested FROM tasks WHERE id = ?', (task_id,)
+        ).fetchone()
+        _current.cancelled = bool(row and row[0])
+    return _current.cancelled
+
+
+def cancel_task(task_id: str) -> bool:
+    """
+    Cancel a task.
+    
+    A pending task is taken off the queue at once. A running task is asked
+    to stop: it is marked cancelled when it next checks cancel_requested,
+    and tasks that never check run to completion.
+    
+    Args:
+        task_id: ID of the task
+    
+    Returns:
+        True if the task was pending or running
+    """
+    conn = _get_connection()
+    if conn is None:
+        return False
+    
+    with conn:
+        cancelled = conn.execute(
+            'UPDATE tasks SET status = ?, completed_at = ?, cancel_requested = 1 '
+            'WHERE id = ? AND status = ?',
+            (STATUS_CANCELLED, time.time(), task_id, STATUS_PENDING)
+        ).rowcount
+        if not cancelled:
+            cancelled = conn.execute(
+                'UPDATE tasks SET cancel_requested = 1 WHERE id = ? AND status = ?',
+                (task_id, STATUS_PROCESSING)
+            ).rowcount
+    
+    if cancelled:
+        logger.info(f"Task {task_id} cancellation requested")
+    return cancelled > 0
+
+
+def _resolve_function(reference: str) -> Callable:
+    """Import the task function named by a `module:qualname` reference."""
+    module_name, _, qualname = reference.partition(':')
+    target = importlib.import_module(module_name)
+    for attribute in qualname.split('.'):
+        target = getattr(target, attribute)
+    return target
 
 
 def enqueue_task(
-    task_type: str, 
-    func: Callable, 
-    *args, 
+    task_type: str,
+    func: Callable,
+    *args,
     **kwargs
 ) -> str:
     """
     Enqueue a new task to be processed in the background.
     
+    The task may run in another process, so func must be a module-level
+    function and the arguments must be JSON serializable (tuples arrive
+    as lists). It runs in the priority lane TASK_PRIORITIES gives its type.
+    
     Args:
         task_type: Type of task (used for identification)
         func: Function to execute
         *args: Arguments to pass to the function
         **kwargs: Keyword arguments to pass to the function
-        
+    
     Returns:
         Task ID
     """
-    # Generate a unique ID
-    task_id = f"{task_type}_{int(time.time())}_{len(task_registry) + 1}"
+    return _insert_task(task_type, func, args, kwargs)
+
+
+def enqueue_unique_task(
+    key: str,
+    task_type: str,
+    func: Callable,
+    *args,
+    **kwargs
+) -> str:
+    """
+    Enqueue a task unless an unfinished task with the same key exists.
+    
+    Duplicate requests for the same work (browser retries, several open
+    tabs, several gunicorn workers) then share one task and its result.
+    
+    Args:
+        key: Identifies the work, e.g. the source and rendition
+        task_type: Type of task (used for identification)
+        func: Function to execute
+        *args: Arguments to pass to the function
+        **kwargs: Keyword arguments to pass to the function
+    
+    Returns:
+        ID of the new task, or of the unfinished task with the same key
+    """
+    for _ in range(3):
+        try:
+            return _insert_task(task_type, func, args, kwargs, key)
+        except sqlite3.IntegrityError:
+            pass
+        
+        row = _find_active_task(key)
+        if row is None:
+            # It finished in the meantime
+            continue
+        
+        task_id, _, lease_expires, attempts = row
+        if lease_expires is not None and lease_expires < time.time() and attempts >= MAX_ATTEMPTS:
+            # A task that will never be claimed again mustn't block new ones
+            _interrupt_orphaned_tasks()
+            continue
+        
+        logger.debug(f"Task {key} is already queued as {task_id}")
+        return task_id
+    
+    raise RuntimeError(f"Could not enqueue task {key}")
+
+
+def _insert_task(
+    task_type: str,
+    func: Callable,
+    args: tuple,
+    kwargs: Dict[str, Any],
+    key: Optional[str] = None
+) -> str:
+    """Add a task to the queue and wake a worker; see enqueue_task."""
+    conn = _get_connection()
+    if conn is None:
+        raise RuntimeError("Task store has not been initialized")
+    
+    # Generate a unique ID (gunicorn workers share the task store)
+    task_id = f"{task_type}_{int(time.time())}_{os.getpid()}_{next(_task_counter)}"
     
     # Create task record
     task = {
         'id': task_id,
         'type': task_type,
         'status': STATUS_PENDING,
-        'created_at': time.time(),
-        'func': func,
-        'args': args,
-        'kwargs': kwargs
+        'created_at': time.time()
     }
     
-    # Register the task
-    task_registry[task_id] = task
-    
-    # Add to processing queue
-    task_queue.put(task)
+    # Add to the queue
+    with conn:
+        conn.execute(
+            f"INSERT INTO tasks ({', '.join(TASK_COLUMNS)}, data, func, payload, dedupe_key, priority) "
+            f"VALUES ({', '.join('?' * (len(TASK_COLUMNS) + 5))})",
+            _task_row(task) + (
+                f"{func.__module__}:{func.__qualname__}",
+                json.dumps({'args': args, 'kwargs': kwargs}),
+                key,
+                TASK_PRIORITIES.get(task_type, PRIORITY_BATCH)
+            )
+        )
     logger.info(f"Task {task_id} ({task_type}) enqueued")
     
-    # Make sure worker is running
+    # Make sure a worker is running, and wake it if it's in this process
     start_worker()
-    
-    # Save task state
-    _save_tasks_state()
+    _wakeup.set()
     
     return task_id
 
 
+def _find_active_task(key: str) -> Optional[tuple]:
+    """Get (id, status, lease_expires, attempts) of the unfinished task with a key."""
+    conn = _get_connection()
+    if conn is None:
+        return None
+    
+    return conn.execute(
+        'SELECT id, status, lease_expires, attempts FROM tasks '
+        'WHERE dedupe_key = ? AND status IN (?, ?)',
+        (key, STATUS_PENDING, STATUS_PROCESSING)
+    ).fetchone()
+
+
+def get_active_task(key: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the unfinished task enqueued with a key.
+    
+    Args:
+        key: Key passed to enqueue_unique_task
+    
+    Returns:
+        Task status information, or None if no such task is pending or running
+    """
+    row = _find_active_task(key)
+    if row is None:
+        return None
+    return get_task_status(row[0])
+
+
 def get_task_status(task_id: str) -> Dict[str, Any]:
     """
     Get the status of a task.
     
     Args:
         task_id: ID of the task
-        
+    
     Returns:
         Task status information
     """
-    task = task_registry.get(task_id)
-    if not task:
-        return {'status': 'unknown', 'error': 'Task not found'}
+    conn = _get_connection()
+    row = None
+    if conn is not None:
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute('SELECT * FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        finally:
+            conn.row_factory = None
     
-    # Return a sanitized copy without the function and arguments
-    status = {k: v for k, v in task.items() if k not in ('func', 'args', 'kwargs')}
-    return status
+    if row is None:
+        return {'status': 'unknown', 'error': 'Task not found'}
+    return _row_task(row)
 
 
 def get_all_tasks(task_type: Optional[str] = None) -> List[Dict[str, Any]]:
@@ -227,114 +907,219 @@ def get_all_tasks(task_type: Optional[str] = None) -> List[Dict[str, Any]]:
     
     Args:
         task_type: Optional type to filter by
-        
+    
     Returns:
         List of task status information
     """
-    tasks = []
-    for task_id, task in task_registry.items():
-        if task_type is None or task.get('type') == task_type:
-            # Return a sanitized copy
-            status = {k: v for k, v in task.items() if k not in ('func', 'args', 'kwargs')}
-            tasks.append(status)
+    conn = _get_connection()
+    if conn is None:
+        return []
     
     # Sort by creation time, newest first
-    tasks.sort(key=lambda x: x.get('created_at', 0), reverse=True)
-    return tasks
+    conn.row_factory = sqlite3.Row
+    try:
+        if task_type is None:
+            rows = conn.execute('SELECT * FROM tasks ORDER BY created_at DESC').fetchall()
+        else:
+            rows = conn.execute(
+                'SELECT * FROM tasks WHERE type = ? ORDER BY created_at DESC', (task_type,)
+            ).fetchall()
+    finally:
+        conn.row_factory = None
+    
+    return [_row_task(row) for row in rows]
 
 
-def _save_tasks_state() -> None:
-    """Save task registry to disk for persistence across restarts."""
-    if not TASKS_STATE_FILE:
-        logger.warning("Task state file not configured, state will not persist")
+def _get_connection() -> Optional[sqlite3.Connection]:
+    """Get the task database connection for the current thread."""
+    if not TASKS_DB_PATH:
+        return None
+    
+    conn = getattr(_local, 'conn', None)
+    # Connections must not be shared with forked render processes
+    if (conn is None or getattr(_local, 'pid', None) != os.getpid()
+            or getattr(_local, 'path', None) != TASKS_DB_PATH):
+        conn = sqlite3.connect(TASKS_DB_PATH, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.path = TASKS_DB_PATH
+    return conn
+
+
+def _task_row(task: Dict[str, Any]) -> tuple:
+    """Convert a task to a row of the tasks table."""
+    data = {k: v for k, v in task.items() if k not in TASK_COLUMNS + LIVE_FIELDS}
+    return tuple(task.get(column) for column in TASK_COLUMNS) + (json.dumps(data, default=str),)
+
+
+def _row_task(row: sqlite3.Row) -> Dict[str, Any]:
+    """Convert a row of the tasks table back to a task."""
+    task = json.loads(row['data'])
+    for column in TASK_COLUMNS:
+        if row[column] is not None:
+            task[column] = row[column]
+    if row['progress'] is not None:
+        task['progress'] = json.loads(row['progress'])
+    if row['cancel_requested']:
+        task['cancel_requested'] = True
+    return task
+
+
+def _update_task(task: Dict[str, Any], lease_id: Optional[str] = None) -> bool:
+    """
+    Write one task's current state to the task store.
+    
+    Args:
+        task: Task to save
+        lease_id: Lease the caller holds; the task is only written (and
+            the lease released) if it is still the current one
+    
+    Returns:
+        True if the task was written
+    """
+    conn = _get_connection()
+    if conn is None:
+        logger.warning("Task store not configured, state will not persist")
+        return False
+    
+    _, _, status, _, started_at, completed_at, data = _task_row(task)
+    query = (
+        'UPDATE tasks SET status = ?, started_at = ?, completed_at = ?, data = ?, '
+        'lease_id = NULL, lease_expires = NULL WHERE id = ?'
+    )
+    params = (status, started_at, completed_at, data, task['id'])
+    if lease_id is not None:
+        query += ' AND lease_id = ?'
+        params += (lease_id,)
+    
+    try:
+        with conn:
+            return conn.execute(query, params).rowcount > 0
+    except Exception as e:
+        logger.error(f"Error saving task {task.get('id')}: {str(e)}")
+        return False
+
+
+def _interrupt_orphaned_tasks() -> None:
+    """Mark unfinished tasks that can't be run or resumed as interrupted."""
+    conn = _get_connection()
+    if conn is None:
         return
-        
+    
     try:
-        # Create a serializable copy of the registry
-        serializable_tasks = {}
-        for task_id, task in task_registry.items():
-            # Skip completed tasks older than a day to prevent the state file from growing too large
-            if (task.get('status') == STATUS_COMPLETED and 
-                task.get('completed_at', 0) < time.time() - 86400):
-                continue
-                
-            # Create a copy without the function and arguments
-            task_copy = {k: v for k, v in task.items() if k not in ('func', 'args', 'kwargs')}
-            serializable_tasks[task_id] = task_copy
+        # Tasks recorded before functions were stored, and tasks whose
+        # lease ran out too many times
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(
+                'SELECT * FROM tasks WHERE status IN (?, ?) '
+                'AND (func IS NULL OR (lease_expires < ? AND attempts >= ?))',
+                (STATUS_PENDING, STATUS_PROCESSING, time.time(), MAX_ATTEMPTS)
+            ).fetchall()
+        finally:
+            conn.row_factory = None
         
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(TASKS_STATE_FILE), exist_ok=True)
+        for row in rows:
+            task = _row_task(row)
+            task['status'] = STATUS_INTERRUPTED
+            task['completed_at'] = time.time()
+            task['error'] = "Task was interrupted by system shutdown"
+            _update_task(task)
         
-        # Write atomically by using a temporary file
-        temp_file = f"{TASKS_STATE_FILE}.tmp"
-        with open(temp_file, 'w') as f:
-            json.dump(serializable_tasks, f, indent=2)
+        if rows:
+            logger.info(f"Marked {len(rows)} tasks as interrupted")
+    
+    except Exception as e:
+        logger.error(f"Error recovering task state: {str(e)}")
+
+
+def _import_legacy_state(state_file: str) -> None:
+    """Move the tasks of a JSON state file into the task store, once."""
+    if not os.path.exists(state_file):
+        return
+    
+    conn = _get_connection()
+    try:
+        with open(state_file, 'r') as f:
+            loaded_tasks = json.load(f)
         
-        # Rename to final location (atomic on most platforms)
-        os.replace(temp_file, TASKS_STATE_FILE)
+        with conn:
+            for task_id, task in loaded_tasks.items():
+                task.setdefault('id', task_id)
+                conn.execute(
+                    f"INSERT OR IGNORE INTO tasks ({', '.join(TASK_COLUMNS)}, data) "
+                    f"VALUES ({', '.join('?' * (len(TASK_COLUMNS) + 1))})",
+                    _task_row(task)
+                )
         
+        os.remove(state_file)
+        logger.info(f"Imported {len(loaded_tasks)} tasks from {state_file}")
     except Exception as e:
-        logger.error(f"Error saving task state: {str(e)}")
+        logger.error(f"Error importing task state file: {str(e)}")
 
 
-def _load_tasks_state() -> None:
-    """Load task registry from disk."""
-    global task_registry
+def _maybe_compact() -> None:
+    """Compact the task store if it hasn't been compacted recently."""
+    global _last_compaction
     
-    if not TASKS_STATE_FILE:
-        logger.warning("Task state file not configured, no state will be loaded")
+    now = time.time()
+    if now - _last_compaction < COMPACT_INTERVAL:
         return
-        
-    if not os.path.exists(TASKS_STATE_FILE):
-        logger.info("No task state file found, starting with empty registry")
+    _last_compaction = now
+    
+    conn = _get_connection()
+    if conn is None:
         return
-        
+    
     try:
-        with open(TASKS_STATE_FILE, 'r') as f:
-            loaded_tasks = json.load(f)
+        # Give up on tasks whose lease ran out too many times
+        _interrupt_orphaned_tasks()
         
-        # Restore tasks but mark processing ones as interrupted
-        for task_id, task in loaded_tasks.items():
-            if task['status'] in (STATUS_PENDING, STATUS_PROCESSING):
-                task['status'] = STATUS_INTERRUPTED
-                task['error'] = "Task was interrupted by system shutdown"
-            
-            # Add to registry (function will be None)
-            task_registry[task_id] = task
+        # Finished tasks are only kept for a day (tasks that failed before
+        # they were given a completed_at go by their creation time)
+        with conn:
+            removed = conn.execute(
+                f"DELETE FROM tasks WHERE status IN ({', '.join('?' * len(TERMINAL_STATUSES))}) "
+                'AND COALESCE(completed_at, created_at) < ?',
+                TERMINAL_STATUSES + (now - TASK_RETENTION,)
+            ).rowcount
         
-        logger.info(f"Loaded {len(loaded_tasks)} tasks from state file")
+        # Fold the write-ahead log back into the database file
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
         
+        if removed:
+            logger.info(f"Compacted task store ({removed} finished tasks removed)")
     except Exception as e:
-        logger.error(f"Error loading task state: {str(e)}")
-        # Start with empty registry
-        task_registry = {}
+        logger.error(f"Error compacting task store: {str(e)}")
 
 
 def cleanup_tasks(max_age_days: int = 7) -> int:
     """
-    Clean up old completed and failed tasks.
+    Clean up old finished (completed, failed, interrupted or cancelled) tasks.
     
     Args:
         max_age_days: Maximum age of tasks to keep in days
-        
+    
     Returns:
         Number of tasks removed
     """
     max_age = time.time() - (max_age_days * 86400)
-    to_remove = []
     
-    for task_id, task in task_registry.items():
-        # Remove completed/failed tasks older than max_age
-        if task['status'] in (STATUS_COMPLETED, STATUS_FAILED):
-            created_at = task.get('created_at', 0)
-            if created_at < max_age:
-                to_remove.append(task_id)
+    conn = _get_connection()
+    if conn is None:
+        return 0
     
-    # Remove the tasks
-    for task_id in to_remove:
-        task_registry.pop(task_id, None)
-    
-    # Save the updated registry
-    _save_tasks_state()
-    
-    return len(to_remove)
+    # Remove finished tasks older than max_age
+    try:
+        with conn:
+            return conn.execute(
+                f"DELETE FROM tasks WHERE status IN ({', '.join('?' * len(TERMINAL_STATUSES))}) "
+                'AND created_at < ?',
+                TERMINAL_STATUSES + (max_age,)
+            ).rowcount
+    except Exception as e:
+        logger.error(f"Error removing tasks from the task store: {str(e)}")
+        return 0
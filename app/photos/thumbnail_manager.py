@@ -6,16 +6,24 @@ caching, and cleanup.
 """
 
 import os
+import json
+import bisect
 import time
+import hashlib
 import logging
 import threading
+from contextlib import contextmanager
+from concurrent.futures import wait, FIRST_COMPLETED
 from typing import Tuple, List, Dict, Any, Optional
 from pathlib import Path
 
-from app.photos import tasks
+from app.photos import tasks, render_pool, thumbnail_store
+from app.photos.catalog import get_fingerprint
 from app.photos.utils import (
-    create_thumbnail, get_thumbnail_path, is_image_file,
-    THUMBNAIL_DIR
+    create_thumbnail, create_thumbnail_from_embedded, render_thumbnails,
+    render_contact_sheet, get_embedded_preview, get_thumbnail_path,
+    get_contact_sheet_path, get_deep_zoom_info, get_deep_zoom_level_size,
+    get_deep_zoom_tile_path, render_deep_zoom_level, is_image_file, THUMBNAIL_DIR
 )
 
 # Set up logging
@@ -27,10 +35,37 @@ THUMBNAIL_SIZES = {
     'medium': (240, 240),
     'large': (480, 480),
     'xlarge': (800, 800),
+    # Screen-sized rendition shown by the viewer instead of the original
+    'preview': (2048, 2048),
 }
 
-# Lock for thread safety
-thumbnail_lock = threading.Lock()
+# Sizes that may be taken from the JPEG's embedded EXIF preview
+EMBEDDED_PREVIEW_SIZES = ('small', 'medium')
+
+# Renders kept in flight per render worker during batch generation
+BATCH_QUEUE_DEPTH = 2
+
+# Largest file list a continued batch task carries along instead of
+# walking its directory again
+BATCH_CONTINUATION_MAX_FILES = 5000
+
+# Contact sheet layout and the largest page a sheet may cover
+CONTACT_SHEET_COLUMNS = 10
+CONTACT_SHEET_MAX_TILES = 200
+
+# Seconds a request that needs a thumbnail now waits for a render of the
+# same thumbnail that is already running (possibly in another process)
+RENDER_WAIT_SECONDS = 10
+
+# Seconds a deep zoom tile request waits for its level to be rendered
+# before the client is asked to try again
+DEEP_ZOOM_WAIT_SECONDS = 20
+
+# Thumbnail renders in progress in this process, so concurrent requests
+# for the same rendition wait for one render instead of starting their
+# own: key -> [lock, number of users]
+_renders = {}
+_renders_lock = threading.Lock()
 
 
 def initialize(base_dir: str) -> None:
@@ -75,18 +110,14 @@ def get_or_create_thumbnail(
     # Get the thumbnail size
     size = THUMBNAIL_SIZES.get(size_name, THUMBNAIL_SIZES['medium'])
     
-    # Get the thumbnail path
+    # Get the thumbnail path (keyed on the image content, so an existing
+    # thumbnail always matches the current version of the image)
     thumbnail_path = get_thumbnail_path(image_path, size)
     
-    # Check if thumbnail already exists and is newer than the source image
-    thumbnail_exists = os.path.exists(thumbnail_path)
+    thumbnail_exists = thumbnail_store.exists(thumbnail_path)
     
     # Check if we need to regenerate
-    needs_regeneration = (
-        force_regenerate or 
-        not thumbnail_exists or 
-        (os.path.getmtime(thumbnail_path) < os.path.getmtime(image_path) if thumbnail_exists else True)
-    )
+    needs_regeneration = force_regenerate or not thumbnail_exists
     
     # If the thumbnail exists and doesn't need regeneration, return it immediately
     if thumbnail_exists and not needs_regeneration:
@@ -97,12 +128,28 @@ def get_or_create_thumbnail(
             'task_id': None
         }
     
+    # Small sizes can usually be cut from the embedded EXIF preview in a
+    # few milliseconds, without decoding the original
+    if not force_regenerate and size_name in EMBEDDED_PREVIEW_SIZES:
+        if create_thumbnail_from_embedded(image_path, thumbnail_path, size):
+            return {
+                'success': True,
+                'path': thumbnail_path,
+                'ready': True,
+                'task_id': None
+            }
+    
     # Check if we can generate it immediately or should delegate to background
     if not background or not needs_regeneration:
         try:
+            # Another request may be rendering the same thumbnail right now
+            if not force_regenerate:
+                _wait_for_render(thumbnail_path)
+            
             # Generate the thumbnail immediately
-            with thumbnail_lock:
-                create_thumbnail(image_path, thumbnail_path, size)
+            with _single_flight(thumbnail_path):
+                if force_regenerate or not thumbnail_store.exists(thumbnail_path):
+                    render_pool.run(create_thumbnail, image_path, thumbnail_path, size)
             
             return {
                 'success': True,
@@ -120,25 +167,87 @@ def get_or_create_thumbnail(
                 'task_id': None
             }
     else:
-        # Generate the thumbnail in the background
-        task_id = tasks.enqueue_task(
+        # Generate the thumbnail in the background, once however many
+        # requests are waiting for it
+        task_id = tasks.enqueue_unique_task(
+            _render_key(thumbnail_path),
             'thumbnail', 
             _generate_thumbnail_task,
-            image_path, thumbnail_path, size
+            image_path, thumbnail_path, size, force_regenerate
         )
         
+        ready = thumbnail_store.exists(thumbnail_path)
+        
+        # Until the render is done, the embedded preview (even if smaller
+        # than the requested size) is better than a placeholder
+        preview = None
+        if not ready and size_name in EMBEDDED_PREVIEW_SIZES:
+            preview = get_embedded_preview(image_path)
+        
         return {
             'success': True,
-            'path': thumbnail_path if os.path.exists(thumbnail_path) else None,
-            'ready': os.path.exists(thumbnail_path),
-            'task_id': task_id
+            'path': thumbnail_path if ready else None,
+            'ready': ready,
+            'task_id': task_id,
+            'preview': preview
         }
 
 
+def _render_key(thumbnail_path: str) -> str:
+    """Get the task key of a rendition (its path names the source content and size)."""
+    return f"thumbnail:{thumbnail_path}"
+
+
+@contextmanager
+def _single_flight(key: Any):
+    """
+    Hold the render lock for a key in this process.
+    
+    Callers check whether the rendition exists once they hold the lock,
+    so only the first of several concurrent requests renders it.
+    """
+    with _renders_lock:
+        entry = _renders.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _renders_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                _renders.pop(key, None)
+
+
+def _wait_for_render(thumbnail_path: str, timeout: float = RENDER_WAIT_SECONDS) -> bool:
+    """
+    Wait for a background render of a thumbnail that has already started.
+    
+    A render that is only queued isn't waited for, since rendering here
+    is quicker than waiting for the queue.
+    
+    Args:
+        thumbnail_path: Path of the thumbnail
+        timeout: Maximum time to wait in seconds
+        
+    Returns:
+        True if the thumbnail exists
+    """
+    deadline = time.time() + timeout
+    while not thumbnail_store.exists(thumbnail_path):
+        task = tasks.get_active_task(_render_key(thumbnail_path))
+        if task is None or task['status'] != tasks.STATUS_PROCESSING or time.time() >= deadline:
+            return False
+        time.sleep(0.1)
+    return True
+
+
 def _generate_thumbnail_task(
     image_path: str, 
     thumbnail_path: str, 
-    size: Tuple[int, int]
+    size: Tuple[int, int],
+    force: bool = False
 ) -> Dict[str, Any]:
     """
     Background task to generate a thumbnail.
@@ -147,19 +256,25 @@ def _generate_thumbnail_task(
         image_path: Path to the original image
         thumbnail_path: Path to save the thumbnail
         size: Thumbnail size as (width, height)
+        force: Whether to render it even if it exists
         
     Returns:
         Result information
     """
     try:
-        with thumbnail_lock:
-            create_thumbnail(image_path, thumbnail_path, size)
+        with _single_flight(thumbnail_path):
+            # A request or an ingest task may have rendered it since this
+            # task was queued
+            skipped = not force and thumbnail_store.exists(thumbnail_path)
+            if not skipped:
+                render_pool.run(create_thumbnail, image_path, thumbnail_path, size)
         
         return {
             'success': True,
             'path': thumbnail_path,
             'image_path': image_path,
-            'size': size
+            'size': size,
+            'skipped': skipped
         }
     except Exception as e:
         logger.error(f"Error in thumbnail generation task for {image_path}: {str(e)}")
@@ -172,6 +287,94 @@ def _generate_thumbnail_task(
         }
 
 
+def _missing_renditions(image_path: str, sizes: List[str]) -> List[Tuple[str, Tuple[int, int]]]:
+    """
+    Get the renditions of an image that haven't been created yet.
+    
+    Renditions of the same content (e.g. a renamed or backed up copy) are
+    reused as they are.
+    
+    Args:
+        image_path: Path to the original image
+        sizes: List of thumbnail size names
+        
+    Returns:
+        List of (thumbnail_path, size) pairs to render
+    """
+    fingerprint = get_fingerprint(image_path)
+    renditions = []
+    for size_name in sizes:
+        size = THUMBNAIL_SIZES.get(size_name)
+        if not size:
+            continue
+        
+        thumbnail_path = get_thumbnail_path(image_path, size, fingerprint)
+        if not thumbnail_store.exists(thumbnail_path):
+            renditions.append((thumbnail_path, size))
+    
+    return renditions
+
+
+def generate_thumbnails_for_image(image_path: str, sizes: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Generate the missing thumbnails of a single image in the background.
+    
+    Args:
+        image_path: Path to the original image
+        sizes: List of thumbnail sizes to generate
+        
+    Returns:
+        Task information
+    """
+    # Default to all sizes if not specified
+    if not sizes:
+        sizes = list(THUMBNAIL_SIZES.keys())
+    
+    task_id = tasks.enqueue_unique_task(
+        f"image_thumbnails:{image_path}:{','.join(sizes)}",
+        'image_thumbnails',
+        _image_thumbnails_task,
+        image_path, sizes
+    )
+    
+    return {
+        'success': True,
+        'task_id': task_id,
+        'image_path': image_path,
+        'sizes': sizes
+    }
+
+
+def _image_thumbnails_task(image_path: str, sizes: List[str]) -> Dict[str, Any]:
+    """
+    Background task to generate the missing thumbnails of an image.
+    
+    Args:
+        image_path: Path to the original image
+        sizes: List of thumbnail sizes to generate
+        
+    Returns:
+        Result information
+    """
+    try:
+        renditions = _missing_renditions(image_path, sizes)
+        written = render_pool.run(render_thumbnails, image_path, renditions) if renditions else []
+        
+        return {
+            'success': True,
+            'image_path': image_path,
+            'thumbnails_created': len(written),
+            'skipped': len(sizes) - len(renditions)
+        }
+    except Exception as e:
+        logger.error(f"Error generating thumbnails for {image_path}: {str(e)}")
+        return {
+            'success': False,
+            'image_path': image_path,
+            'error': str(e)
+        }
+
+
 def generate_thumbnails_for_directory(
     directory_path: str,
     sizes: Optional[List[str]] = None,
@@ -211,71 +414,124 @@ def generate_thumbnails_for_directory(
 def _batch_thumbnail_generation_task(
     directory_path: str,
     sizes: List[str],
-    recursive: bool
-) -> Dict[str, Any]:
+    recursive: bool,
+    after: Optional[str] = None,
+    results: Optional[Dict[str, Any]] = None,
+    image_files: Optional[List[str]] = None
+) -> Any:
     """
     Background task to generate thumbnails for a directory.
     
+    Between images the task checks whether more urgent tasks are waiting
+    (e.g. thumbnails for the grid someone is looking at). If so, it lets
+    the renders in flight finish and is queued again for the remaining
+    images. It also reports its progress, and stops when cancelled.
+    
     Args:
         directory_path: Path to the directory
         sizes: List of thumbnail sizes to generate
         recursive: Whether to process subdirectories recursively
+        after: Last image processed (when continued)
+        results: Counts so far (when continued)
+        image_files: Sorted images of the directory (when continued and
+            short enough to carry along)
         
     Returns:
-        Result information
+        Result information, or a tasks.Continuation for the remaining images
     """
-    results = {
+    results = results or {
         'success': True,
         'directory': directory_path,
         'images_processed': 0,
+        'thumbnails_created': 0,
         'errors': 0,
         'skipped': 0
     }
     
     try:
-        # Find all image files in the directory
-        image_files = []
-        
-        for root, dirs, files in os.walk(directory_path):
-            # Skip hidden directories
-            dirs[:] = [d for d in dirs if not d.startswith('.')]
+        if image_files is None:
+            # Find all image files in the directory
+            image_files = []
             
-            for file in files:
-                if is_image_file(file):
-                    image_files.append(os.path.join(root, file))
+            for root, dirs, files in os.walk(directory_path):
+                # Skip hidden directories
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                
+                for file in files:
+                    if is_image_file(file):
+                        image_files.append(os.path.join(root, file))
+                
+                # If not recursive, break after first iteration
+                if not recursive:
+                    break
             
-            # If not recursive, break after first iteration
-            if not recursive:
-                break
+            # A stable order, so a continued task can find where it left off
+            image_files.sort()
         
-        # Generate thumbnails for each image
-        for image_path in image_files:
-            try:
-                for size_name in sizes:
-                    size = THUMBNAIL_SIZES.get(size_name)
-                    if not size:
-                        continue
-                    
-                    thumbnail_path = get_thumbnail_path(image_path, size)
-                    
-                    # Check if thumbnail needs regeneration
-                    if os.path.exists(thumbnail_path) and os.path.getmtime(thumbnail_path) >= os.path.getmtime(image_path):
-                        results['skipped'] += 1
-                        continue
-                    
-                    # Generate the thumbnail
-                    with thumbnail_lock:
-                        create_thumbnail(image_path, thumbnail_path, size)
-                    
+        # A continued task resumes after the last image it processed. That
+        # is found by path, so images added or removed in the meantime
+        # don't make it skip or repeat any
+        start = bisect.bisect_right(image_files, after) if after is not None else 0
+        
+        # Render in parallel, keeping a bounded number of jobs in flight
+        # so a huge folder doesn't queue thousands of futures at once.
+        # Each image's missing renditions are rendered together, so each
+        # original is decoded only once for all its sizes.
+        max_in_flight = max(1, render_pool.pool_size()) * BATCH_QUEUE_DEPTH
+        in_flight = {}
+        next_index = start
+        yielding = False
+        
+        while True:
+            while not yielding and next_index < len(image_files) and len(in_flight) < max_in_flight:
+                image_path = image_files[next_index]
+                next_index += 1
+                try:
+                    renditions = _missing_renditions(image_path, sizes)
+                except OSError as e:
+                    logger.error(f"Error checking thumbnails for {image_path}: {str(e)}")
+                    results['errors'] += 1
+                    continue
+                
+                results['skipped'] += len(sizes) - len(renditions)
+                if renditions:
+                    in_flight[render_pool.submit(render_thumbnails, image_path, renditions)] = image_path
+            
+            if not in_flight:
+                break
+            
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                image_path = in_flight.pop(future)
+                try:
+                    written = future.result()
                     results['images_processed'] += 1
-                    
-                    # Small sleep to avoid overwhelming the system
-                    time.sleep(0.01)
-                    
-            except Exception as e:
-                logger.error(f"Error generating thumbnail for {image_path}: {str(e)}")
-                results['errors'] += 1
+                    results['thumbnails_created'] += len(written)
+                except Exception as e:
+                    logger.error(f"Error generating thumbnail for {image_path}: {str(e)}")
+                    results['errors'] += 1
+            
+            tasks.report_progress(next_index - len(in_flight), len(image_files))
+            
+            # Drop the renders that haven't started if the task was cancelled
+            if tasks.cancel_requested():
+                for future in in_flight:
+                    future.cancel()
+                raise tasks.TaskCancelled()
+            
+            # Stop submitting if something more urgent is waiting
+            if not yielding and tasks.should_yield():
+                yielding = True
         
+        if next_index < len(image_files):
+            # The renders in flight were drained, so every image before
+            # next_index is done
+            carried = image_files if len(image_files) <= BATCH_CONTINUATION_MAX_FILES else None
+            return tasks.Continuation(
+                directory_path, sizes, recursive, image_files[next_index - 1], results, carried
+            )
+        
+        tasks.report_progress(len(image_files), len(image_files))
         return results
     
     except Exception as e:
@@ -285,6 +541,230 @@ def _batch_thumbnail_generation_task(
         return results
 
 
+def find_thumbnails(image_paths: List[str], size_name: str) -> Dict[str, Optional[str]]:
+    """
+    Get the thumbnails of one size that already exist, queueing renders of
+    the missing ones.
+    
+    Small sizes missing are first cut from the embedded EXIF preview, as
+    /api/thumbnail does. The rest are rendered by the task consumer in the
+    interactive lane, keyed like every other render of them, so a page's
+    per-item thumbnail requests share those tasks.
+    
+    Args:
+        image_paths: Paths to the original images
+        size_name: Size name ('small', 'medium', ...)
+        
+    Returns:
+        Dictionary mapping each image path to its thumbnail path, or None
+        if the thumbnail doesn't exist yet
+    """
+    size = THUMBNAIL_SIZES[size_name]
+    thumbnails = {}
+    
+    for image_path in image_paths:
+        thumbnails[image_path] = None
+        try:
+            thumbnail_path = get_thumbnail_path(image_path, size)
+        except OSError as e:
+            logger.error(f"Error reading {image_path}: {str(e)}")
+            continue
+        
+        if thumbnail_store.exists(thumbnail_path):
+            thumbnails[image_path] = thumbnail_path
+        elif (size_name in EMBEDDED_PREVIEW_SIZES
+                and create_thumbnail_from_embedded(image_path, thumbnail_path, size)):
+            thumbnails[image_path] = thumbnail_path
+        else:
+            tasks.enqueue_unique_task(
+                _render_key(thumbnail_path),
+                'thumbnail',
+                _generate_thumbnail_task,
+                image_path, thumbnail_path, size
+            )
+    
+    return thumbnails
+
+
+def get_contact_sheet(image_paths: List[str], size_name: str = 'small') -> Dict[str, Any]:
+    """
+    Get a contact sheet: one sprite JPEG holding the thumbnails of a page
+    of images, plus the offset of each thumbnail in it.
+    
+    Sheets are identified by the thumbnails they contain, so a page is
+    only rendered again when one of its photos changes. A sheet is only
+    made of thumbnails that exist or can be cut from an embedded preview:
+    the others are queued and listed as missing, for the browser to fetch
+    one by one.
+    
+    Args:
+        image_paths: Paths to the original images, in display order
+        size_name: Thumbnail size to use for the tiles
+        
+    Returns:
+        Dictionary with the sheet 'id' (None if no tile could be made),
+        'width', 'height', 'tiles' mapping image path to [x, y, width,
+        height], and 'missing' listing the images that aren't on the sheet
+        
+    Raises:
+        ValueError: If the size is unknown or there are too many images
+    """
+    if size_name not in THUMBNAIL_SIZES:
+        raise ValueError(f"Unknown thumbnail size: {size_name}")
+    if len(image_paths) > CONTACT_SHEET_MAX_TILES:
+        raise ValueError(f"A contact sheet holds at most {CONTACT_SHEET_MAX_TILES} images")
+    
+    size = THUMBNAIL_SIZES[size_name]
+    thumbnails = find_thumbnails(image_paths, size_name)
+    included = [path for path in image_paths if thumbnails.get(path)]
+    missing = [path for path in image_paths if not thumbnails.get(path)]
+    
+    if not included:
+        return {'id': None, 'width': 0, 'height': 0, 'tiles': {}, 'missing': missing}
+    
+    # Thumbnail names are content fingerprints, so they identify the sheet
+    sheet_id = hashlib.sha1(json.dumps([
+        size, CONTACT_SHEET_COLUMNS,
+        [os.path.basename(thumbnails[path]) for path in included]
+    ]).encode()).hexdigest()
+    sheet_path = get_contact_sheet_path(sheet_id)
+    map_path = get_contact_sheet_path(sheet_id, 'json')
+    
+    try:
+        if not thumbnail_store.exists(sheet_path):
+            raise FileNotFoundError(sheet_path)
+        layout = json.loads(thumbnail_store.read(map_path))
+    except FileNotFoundError:
+        layout = render_pool.run(
+            render_contact_sheet,
+            [thumbnails[path] for path in included],
+            size, CONTACT_SHEET_COLUMNS, sheet_path
+        )
+        thumbnail_store.write(map_path, json.dumps(layout).encode())
+    
+    tiles = {}
+    for path, tile in zip(included, layout['tiles']):
+        if tile is None:
+            missing.append(path)
+        else:
+            tiles[path] = tile
+    
+    return {
+        'id': sheet_id,
+        'width': layout['width'],
+        'height': layout['height'],
+        'tiles': tiles,
+        'missing': missing
+    }
+
+
+def get_deep_zoom_tile(image_path: str, level: int, column: int, row: int) -> Optional[str]:
+    """
+    Get a deep zoom tile, rendering its level on first use.
+    
+    The first request for a level queues one task that cuts all of that
+    level's tiles from one decode; every later tile of the level is a
+    store lookup. Requests for the same level share the task, whichever
+    gunicorn worker they reach.
+    
+    Args:
+        image_path: Path to the original image
+        level: Pyramid level
+        column: Tile column
+        row: Tile row
+        
+    Returns:
+        Path of the tile in the thumbnail store, or None if its level is
+        still being rendered after DEEP_ZOOM_WAIT_SECONDS
+        
+    Raises:
+        ValueError: If the tile is outside the pyramid
+        RuntimeError: If rendering the level failed
+    """
+    fingerprint = get_fingerprint(image_path)
+    tile_path = get_deep_zoom_tile_path(fingerprint, level, column, row)
+    if thumbnail_store.exists(tile_path):
+        return tile_path
+    
+    info = get_deep_zoom_info(image_path)
+    if not 0 <= level <= info['max_level']:
+        raise ValueError(f"Level {level} is outside the pyramid (0-{info['max_level']})")
+    level_width, level_height = get_deep_zoom_level_size(info, level)
+    if not (0 <= column * info['tile_size'] < level_width and 0 <= row * info['tile_size'] < level_height):
+        raise ValueError(f"Tile {column}_{row} is outside level {level}")
+    
+    task_id = tasks.enqueue_unique_task(
+        f"deep_zoom:{fingerprint}:{level}",
+        'deep_zoom',
+        _deep_zoom_level_task,
+        image_path, fingerprint, info, level
+    )
+    
+    # Tiles are stored as they are cut, so this one may be ready long
+    # before the whole level is
+    deadline = time.time() + DEEP_ZOOM_WAIT_SECONDS
+    while not thumbnail_store.exists(tile_path):
+        task = tasks.get_task_status(task_id)
+        if task['status'] not in (tasks.STATUS_PENDING, tasks.STATUS_PROCESSING):
+            # Finished without this tile (it may have been stored just now)
+            if thumbnail_store.exists(tile_path):
+                break
+            error = task.get('error') or (task.get('result') or {}).get('error')
+            raise RuntimeError(error or f"Deep zoom level {level} was not rendered")
+        if time.time() >= deadline:
+            return None
+        time.sleep(0.1)
+    
+    return tile_path
+
+
+def _deep_zoom_level_task(
+    image_path: str,
+    fingerprint: str,
+    info: Dict[str, int],
+    level: int
+) -> Dict[str, Any]:
+    """
+    Background task to render every tile of one deep zoom level.
+    
+    Args:
+        image_path: Path to the original image
+        fingerprint: Content fingerprint of the image
+        info: Pyramid description from get_deep_zoom_info
+        level: Level to render
+        
+    Returns:
+        Result information
+    """
+    try:
+        # The last tile is cut last, so if it is stored the level is
+        # complete (e.g. an earlier task rendered it)
+        level_width, level_height = get_deep_zoom_level_size(info, level)
+        last_tile_path = get_deep_zoom_tile_path(
+            fingerprint, level,
+            (level_width - 1) // info['tile_size'], (level_height - 1) // info['tile_size']
+        )
+        count = 0
+        if not thumbnail_store.exists(last_tile_path):
+            count = render_pool.run(render_deep_zoom_level, image_path, fingerprint, info, level)
+            logger.info(f"Rendered {count} deep zoom tiles for {image_path} (level {level})")
+        
+        return {
+            'success': True,
+            'image_path': image_path,
+            'level': level,
+            'tiles': count
+        }
+    except Exception as e:
+        logger.error(f"Error rendering deep zoom level {level} for {image_path}: {str(e)}")
+        return {
+            'success': False,
+            'image_path': image_path,
+            'level': level,
+            'error': str(e)
+        }
+
+
 def cleanup_thumbnails(max_age_days: int = 30) -> Dict[str, Any]:
     """
     Clean up unused thumbnails.
@@ -328,36 +808,10 @@ def _cleanup_thumbnails_task(max_age_days: int) -> Dict[str, Any]:
         # Calculate cutoff time
         cutoff_time = time.time() - (max_age_days * 86400)
         
-        # Process all thumbnail directories
-        for size_name in THUMBNAIL_SIZES.keys():
-            size_dir = os.path.join(THUMBNAIL_DIR, size_name)
-            
-            # Skip if directory doesn't exist
-            if not os.path.exists(size_dir) or not os.path.isdir(size_dir):
-                continue
-            
-            # Scan for old thumbnails
-            for filename in os.listdir(size_dir):
-                file_path = os.path.join(size_dir, filename)
-                
-                # Skip if not a file
-                if not os.path.isfile(file_path):
-                    continue
-                
-                # Check file modification time
-                if os.path.getmtime(file_path) < cutoff_time:
-                    # Get file size before removing
-                    file_size = os.path.getsize(file_path)
-                    
-                    # Remove the file
-                    os.remove(file_path)
-                    
-                    # Update results
-                    results['files_removed'] += 1
-                    results['bytes_freed'] += file_size
-                    
-                    # Small sleep to avoid overwhelming the system
-                    time.sleep(0.01)
+        # Remove old thumbnails from every size (shards and packed store)
+        files_removed, bytes_freed = thumbnail_store.remove_older_than(cutoff_time)
+        results['files_removed'] = files_removed
+        results['bytes_freed'] = bytes_freed
         
         return results
     
@@ -379,43 +833,24 @@ def get_thumbnail_stats() -> Dict[str, Any]:
         'success': True,
         'total_thumbnails': 0,
         'total_size_bytes': 0,
+        'store': thumbnail_store.THUMBNAIL_STORE,
         'by_size': {}
     }
     
     try:
-        # Process all thumbnail directories
+        # Counted by the store in one pass over the shards (or one query
+        # on the packed store) rather than a listdir per size
+        by_size = thumbnail_store.get_stats()
+        
         for size_name in THUMBNAIL_SIZES.keys():
-            size_dir = os.path.join(THUMBNAIL_DIR, size_name)
-            
-            # Skip if directory doesn't exist
-            if not os.path.exists(size_dir) or not os.path.isdir(size_dir):
-                stats['by_size'][size_name] = {'count': 0, 'size_bytes': 0}
-                continue
-            
-            # Count files and size
-            count = 0
-            size_bytes = 0
-            
-            for filename in os.listdir(size_dir):
-                file_path = os.path.join(size_dir, filename)
-                
-                # Skip if not a file
-                if not os.path.isfile(file_path):
-                    continue
-                
-                # Count and add size
-                count += 1
-                size_bytes += os.path.getsize(file_path)
+            size_stats = by_size.get(size_name, {'count': 0, 'size_bytes': 0})
             
             # Add to statistics
-            stats['by_size'][size_name] = {
-                'count': count,
-                'size_bytes': size_bytes
-            }
+            stats['by_size'][size_name] = size_stats
             
             # Update totals
-            stats['total_thumbnails'] += count
-            stats['total_size_bytes'] += size_bytes
+            stats['total_thumbnails'] += size_stats['count']
+            stats['total_size_bytes'] += size_stats['size_bytes']
         
         return stats
     
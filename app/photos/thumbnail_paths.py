@@ -0,0 +1,96 @@
+"""
+Thumbnail locations for the Photos module.
+
+A thumbnail's location depends only on the content fingerprint of its
+original and its size. This module needs nothing beyond the standard
+library, so TakePhoto.py loads it from the web app's files (together with
+thumbnail_store.py) and writes capture-time thumbnails exactly where the
+app looks for them, in whichever store the app uses.
+"""
+
+import os
+import hashlib
+from typing import Optional, Tuple
+
+# Application base directory
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+# Where thumbnails (or the packed thumbnail store) are kept
+THUMBNAIL_DIR = os.environ.get(
+    'CREATUREBOX_THUMBNAIL_DIR', os.path.join(BASE_DIR, 'instance', 'thumbnails')
+)
+
+# Renditions at least this wide are screen previews for the viewer, kept
+# apart from the grid thumbnails
+PREVIEW_MIN_EDGE = 1024
+
+# Bytes hashed from each end of a file for its content fingerprint
+FINGERPRINT_CHUNK_SIZE = 64 * 1024
+
+
+def compute_fingerprint(image_path: str, stat_result: Optional[os.stat_result] = None) -> str:
+    """
+    Compute a cheap content fingerprint for a file.
+
+    Hashes the file size with the first and last 64KB instead of the whole
+    file, which is enough to tell photos apart (the JPEG header and EXIF
+    block sit at the start) while reading only 128KB of a 20MB original.
+
+    Args:
+        image_path: Path to the file
+        stat_result: Result of os.stat for the file, if already known
+
+    Returns:
+        Fingerprint as a hex string
+    """
+    if stat_result is None:
+        stat_result = os.stat(image_path)
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(stat_result.st_size).encode())
+
+    with open(image_path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_CHUNK_SIZE))
+        if stat_result.st_size > FINGERPRINT_CHUNK_SIZE:
+            f.seek(max(FINGERPRINT_CHUNK_SIZE, stat_result.st_size - FINGERPRINT_CHUNK_SIZE))
+            digest.update(f.read(FINGERPRINT_CHUNK_SIZE))
+
+    return digest.hexdigest()
+
+
+def get_size_dir(size: Tuple[int, int]) -> str:
+    """
+    Get the directory a rendition size is kept in.
+
+    The directories are named after the sizes in THUMBNAIL_SIZES
+    (thumbnail_manager.py): small (100), medium (240), large (480),
+    xlarge (800) and preview (PREVIEW_MIN_EDGE and up).
+    """
+    if size[0] <= 100:
+        return 'small'
+    if size[0] >= PREVIEW_MIN_EDGE:
+        return 'preview'
+    if size[0] >= 800:
+        return 'xlarge'
+    if size[0] >= 400:
+        return 'large'
+    return 'medium'
+
+
+def get_rendition_path(thumbnail_dir: str, fingerprint: str, size: Tuple[int, int]) -> str:
+    """
+    Get the path of a rendition: `<size>/<ab>/<fingerprint>_<w>x<h>.jpg`.
+
+    The first two characters of the fingerprint pick a shard directory,
+    which keeps every directory small.
+
+    Args:
+        thumbnail_dir: Thumbnail directory
+        fingerprint: Content fingerprint of the original
+        size: Rendition size as (width, height)
+
+    Returns:
+        Path of the rendition (its key in the packed store)
+    """
+    filename = f"{fingerprint}_{size[0]}x{size[1]}.jpg"
+    return os.path.join(thumbnail_dir, get_size_dir(size), fingerprint[:2], filename)
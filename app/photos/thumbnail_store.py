@@ -0,0 +1,242 @@
+"""
+Thumbnail storage for the Photos module.
+
+Thumbnails are addressed by the path returned by get_thumbnail_path and
+stored either as individual files in hash-prefix shards
+(`<size>/<ab>/<fingerprint>_<w>x<h>.jpg`) or, in packed mode, as blobs in
+a single SQLite file so that millions of small JPEGs cost a handful of
+files and one index lookup each.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Tuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Storage backend: 'files' (sharded directories) or 'packed' (SQLite blobs)
+THUMBNAIL_STORE = os.environ.get('CREATUREBOX_THUMBNAIL_STORE', 'files')
+PACKED = THUMBNAIL_STORE == 'packed'
+
+# Name of the packed store inside the thumbnail directory
+PACKED_STORE_NAME = 'thumbnails.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS thumbnails (
+    key TEXT PRIMARY KEY,
+    size_dir TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    data BLOB NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_thumbnails_created
+    ON thumbnails (created_at);
+"""
+
+# Thumbnail directory (set by configure) and per-thread connections
+STORE_DIR = None
+_local = threading.local()
+
+
+def configure(thumbnail_dir: str) -> None:
+    """Set the directory that holds the thumbnails (and the packed store)."""
+    global STORE_DIR
+
+    STORE_DIR = thumbnail_dir
+    logger.info(f"Thumbnail store: {THUMBNAIL_STORE} in {thumbnail_dir}")
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Get the packed store connection for the current thread and process."""
+    conn = getattr(_local, 'conn', None)
+    # Render processes are forked, and must not share the parent's connection
+    if conn is None or getattr(_local, 'pid', None) != os.getpid():
+        if not STORE_DIR:
+            raise RuntimeError("Thumbnail store has not been configured")
+
+        os.makedirs(STORE_DIR, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(STORE_DIR, PACKED_STORE_NAME), timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def _key(thumbnail_path: str) -> Tuple[str, str]:
+    """Get the packed store key and size directory of a thumbnail path."""
+    key = os.path.relpath(thumbnail_path, STORE_DIR)
+    return key, key.split(os.sep, 1)[0]
+
+
+def exists(thumbnail_path: str) -> bool:
+    """Check whether a thumbnail has been stored."""
+    if not PACKED:
+        return os.path.exists(thumbnail_path)
+
+    key, _ = _key(thumbnail_path)
+    row = _get_connection().execute('SELECT 1 FROM thumbnails WHERE key = ?', (key,)).fetchone()
+    return row is not None
+
+
+def read(thumbnail_path: str) -> bytes:
+    """
+    Read a stored thumbnail.
+
+    Args:
+        thumbnail_path: Path returned by get_thumbnail_path
+
+    Returns:
+        JPEG bytes
+
+    Raises:
+        FileNotFoundError: If the thumbnail is not stored
+    """
+    if not PACKED:
+        with open(thumbnail_path, 'rb') as f:
+            return f.read()
+
+    key, _ = _key(thumbnail_path)
+    row = _get_connection().execute('SELECT data FROM thumbnails WHERE key = ?', (key,)).fetchone()
+    if row is None:
+        raise FileNotFoundError(thumbnail_path)
+    return row[0]
+
+
+def write(thumbnail_path: str, data: bytes) -> None:
+    """
+    Store a thumbnail, replacing any previous version.
+
+    Files are written via a temporary file and renamed into place, so
+    readers never see a partial JPEG.
+
+    Args:
+        thumbnail_path: Path returned by get_thumbnail_path
+        data: JPEG bytes
+    """
+    if PACKED:
+        key, size_dir = _key(thumbnail_path)
+        conn = _get_connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO thumbnails (key, size_dir, bytes, created_at, data) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, size_dir, len(data), time.time(), data)
+            )
+        return
+
+    temp_path = f"{thumbnail_path}.{os.getpid()}.tmp"
+    try:
+        try:
+            f = open(temp_path, 'wb')
+        except FileNotFoundError:
+            # First thumbnail in this shard
+            os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+            f = open(temp_path, 'wb')
+        with f:
+            f.write(data)
+        os.replace(temp_path, thumbnail_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _scan_files(directory: str):
+    """Yield a DirEntry for every file below a directory."""
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from _scan_files(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+    except FileNotFoundError:
+        return
+
+
+def get_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Count stored thumbnails and their size.
+
+    Returns:
+        Dictionary mapping size directory to {'count', 'size_bytes'}
+    """
+    stats = {}
+
+    if PACKED:
+        rows = _get_connection().execute(
+            'SELECT size_dir, COUNT(*), COALESCE(SUM(bytes), 0) FROM thumbnails GROUP BY size_dir'
+        ).fetchall()
+        for size_dir, count, size_bytes in rows:
+            stats[size_dir] = {'count': count, 'size_bytes': size_bytes}
+        return stats
+
+    if not STORE_DIR or not os.path.isdir(STORE_DIR):
+        return stats
+
+    with os.scandir(STORE_DIR) as size_dirs:
+        for size_dir in size_dirs:
+            if not size_dir.is_dir(follow_symlinks=False):
+                continue
+
+            count = 0
+            size_bytes = 0
+            for entry in _scan_files(size_dir.path):
+                count += 1
+                size_bytes += entry.stat(follow_symlinks=False).st_size
+            stats[size_dir.name] = {'count': count, 'size_bytes': size_bytes}
+
+    return stats
+
+
+def remove_older_than(cutoff_time: float) -> Tuple[int, int]:
+    """
+    Remove thumbnails stored before a given time.
+
+    Args:
+        cutoff_time: Timestamp; older thumbnails are removed
+
+    Returns:
+        Tuple of (thumbnails removed, bytes freed)
+    """
+    if PACKED:
+        conn = _get_connection()
+        with conn:
+            count, size_bytes = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM thumbnails WHERE created_at < ?',
+                (cutoff_time,)
+            ).fetchone()
+            conn.execute('DELETE FROM thumbnails WHERE created_at < ?', (cutoff_time,))
+        return count, size_bytes
+
+    files_removed = 0
+    bytes_freed = 0
+
+    if not STORE_DIR or not os.path.isdir(STORE_DIR):
+        return files_removed, bytes_freed
+
+    with os.scandir(STORE_DIR) as size_dirs:
+        for size_dir in size_dirs:
+            if not size_dir.is_dir(follow_symlinks=False):
+                continue
+
+            for entry in _scan_files(size_dir.path):
+                stat_result = entry.stat(follow_symlinks=False)
+                if stat_result.st_mtime >= cutoff_time:
+                    continue
+
+                os.remove(entry.path)
+                files_removed += 1
+                bytes_freed += stat_result.st_size
+
+                # Small sleep to avoid overwhelming the system
+                time.sleep(0.01)
+
+    return files_removed, bytes_freed
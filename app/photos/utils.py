@@ -5,25 +5,32 @@ Handles file operations, thumbnail generation, and metadata extraction.
 """
 
 import os
+import io
 import re
+import math
 import time
 import json
-import hashlib
+import struct
 import shutil
 import logging
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional, Any, Union
+from typing import List, Dict, Tuple, Optional, Any, Union, BinaryIO
 from werkzeug.utils import secure_filename
 from flask import current_app, abort
 
+from app.photos import thumbnail_store, thumbnail_paths
+from app.photos.thumbnail_paths import compute_fingerprint, get_rendition_path, PREVIEW_MIN_EDGE
+
 # Try to import PIL for image processing
 Image = None
 ExifTags = None
+ImageOps = None
 try:
-    from PIL import Image as PILImage, ExifTags as PILExifTags
+    from PIL import Image as PILImage, ExifTags as PILExifTags, ImageOps as PILImageOps
     Image = PILImage
     ExifTags = PILExifTags
+    ImageOps = PILImageOps
     PIL_AVAILABLE = True
 except ImportError:
     PIL_AVAILABLE = False
@@ -46,10 +53,47 @@ IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif'}
 # Determine the base directory for the application
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 
-# Define thumbnail directory with absolute path
-THUMBNAIL_DIR = os.path.join(BASE_DIR, 'instance', 'thumbnails')
+# Define thumbnail directory with absolute path (shared with TakePhoto.py)
+THUMBNAIL_DIR = thumbnail_paths.THUMBNAIL_DIR
 THUMBNAIL_QUALITY = 85
 
+# Screen previews for the viewer (renditions at least PREVIEW_MIN_EDGE
+# wide) are saved as progressive JPEGs at a lower quality, which paint
+# early on a slow link and are a fraction of the size of the original
+PREVIEW_QUALITY = 80
+
+# Bytes read from the start of an image for its metadata; JPEG keeps
+# EXIF (at most 64KB) and the frame header before the image data
+METADATA_HEADER_BYTES = 256 * 1024
+
+# Contact sheets: space between tiles (so scaled tiles don't bleed) and quality
+CONTACT_SHEET_GAP = 2
+CONTACT_SHEET_QUALITY = 80
+
+# Deep zoom pyramid: tile edge and the pixels each tile shares with its
+# neighbours (as in the DZI format), so scaled tiles meet without seams
+DEEP_ZOOM_TILE_SIZE = 256
+DEEP_ZOOM_OVERLAP = 1
+
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+# EXIF tags used to locate the embedded preview (IFD1) and its orientation
+EXIF_TAG_ORIENTATION = 0x0112
+EXIF_TAG_THUMBNAIL_OFFSET = 0x0201
+EXIF_TAG_THUMBNAIL_LENGTH = 0x0202
+
+# Orientation value -> transpose operation to make the image upright
+EXIF_ORIENTATION_TRANSPOSE = {
+    2: 'FLIP_LEFT_RIGHT',
+    3: 'ROTATE_180',
+    4: 'FLIP_TOP_BOTTOM',
+    5: 'TRANSPOSE',
+    6: 'ROTATE_270',
+    7: 'TRANSVERSE',
+    8: 'ROTATE_90',
+}
+
 def ensure_thumbnail_dir():
     """Ensure the thumbnail directory exists."""
     global THUMBNAIL_DIR
@@ -89,6 +133,8 @@ except Exception as e:
     logger.error(f"Failed to create thumbnail directories: {str(e)}")
     # Will use a fallback location when thumbnails are requested
 
+thumbnail_store.configure(THUMBNAIL_DIR)
+
 def is_image_file(filename: str) -> bool:
     """Check if a file is an image based on its extension."""
     return os.path.splitext(filename.lower())[1] in IMAGE_EXTENSIONS
@@ -185,28 +231,144 @@ def list_directory_contents(directory: str) -> List[Dict[str, Any]]:
     
     return contents
 
-def get_thumbnail_path(image_path: str, size: Tuple[int, int]) -> str:
+def get_thumbnail_path(image_path: str, size: Tuple[int, int], fingerprint: Optional[str] = None) -> str:
     """
     Get path for thumbnail of a specific size.
     
+    Thumbnails are keyed on the content fingerprint of the original rather
+    than its path, so renditions survive renames, moves and backups. The
+    first two characters of the fingerprint pick a shard directory, which
+    keeps every directory small.
+    
     Args:
         image_path: Path to the original image
         size: Thumbnail size as (width, height)
+        fingerprint: Content fingerprint of the image, looked up if not given
         
     Returns:
         Path where the thumbnail should be stored
     """
-    # Create a unique filename based on original path and size
-    file_hash = hashlib.md5(image_path.encode()).hexdigest()
-    size_dir = 'medium'  # Default
+    if fingerprint is None:
+        # Imported here because the catalog itself depends on this module
+        from app.photos.catalog import get_fingerprint
+        fingerprint = get_fingerprint(image_path)
     
-    if size[0] <= 100:
-        size_dir = 'small'
-    elif size[0] >= 400:
-        size_dir = 'large'
+    return get_rendition_path(THUMBNAIL_DIR, fingerprint, size)
+
+def get_contact_sheet_path(sheet_id: str, extension: str = 'jpg') -> str:
+    """
+    Get path for a contact sheet (or its offset map) in the thumbnail store.
+    
+    Args:
+        sheet_id: Contact sheet identifier (a hex digest)
+        extension: 'jpg' for the sprite, 'json' for the offset map
+        
+    Returns:
+        Path where the contact sheet should be stored
+    """
+    return os.path.join(THUMBNAIL_DIR, 'sheets', sheet_id[:2], f"{sheet_id}.{extension}")
+
+def get_deep_zoom_tile_path(fingerprint: str, level: int, column: int, row: int) -> str:
+    """
+    Get path for a deep zoom tile in the thumbnail store.
     
-    filename = f"{file_hash}_{size[0]}x{size[1]}.jpg"
-    return os.path.join(THUMBNAIL_DIR, size_dir, filename)
+    Args:
+        fingerprint: Content fingerprint of the image
+        level: Pyramid level (0 is a single pixel)
+        column: Tile column
+        row: Tile row
+        
+    Returns:
+        Path where the tile should be stored
+    """
+    return os.path.join(
+        THUMBNAIL_DIR, 'tiles', fingerprint[:2], fingerprint, str(level), f"{column}_{row}.jpg"
+    )
+
+def get_deep_zoom_info(image_path: str) -> Dict[str, int]:
+    """
+    Describe the deep zoom pyramid of an image (the fields of a DZI file).
+    
+    Level `max_level` is the upright image at full resolution, and every
+    level below it halves the size (rounding up) down to 1x1 at level 0.
+    Only the image header is read.
+    
+    Args:
+        image_path: Path to the original image
+        
+    Returns:
+        Dictionary with 'width', 'height', 'tile_size', 'overlap' and 'max_level'
+    """
+    if not PIL_AVAILABLE or Image is None:
+        raise ImportError("Pillow is required for deep zoom")
+    
+    with Image.open(image_path) as img:
+        width, height = img.size
+        if img.getexif().get(EXIF_TAG_ORIENTATION) in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+    
+    return {
+        'width': width,
+        'height': height,
+        'tile_size': DEEP_ZOOM_TILE_SIZE,
+        'overlap': DEEP_ZOOM_OVERLAP,
+        'max_level': math.ceil(math.log2(max(width, height, 1)))
+    }
+
+def get_deep_zoom_level_size(info: Dict[str, int], level: int) -> Tuple[int, int]:
+    """Get the size of a deep zoom level as (width, height)."""
+    scale = 2 ** (info['max_level'] - level)
+    return (max(1, -(-info['width'] // scale)), max(1, -(-info['height'] // scale)))
+
+def render_deep_zoom_level(image_path: str, fingerprint: str, info: Dict[str, int], level: int) -> int:
+    """
+    Cut every tile of one deep zoom level from a single decode.
+    
+    Levels below full resolution are decoded at reduced scale, so only
+    the deepest levels pay for a full decode of the original.
+    
+    Args:
+        image_path: Path to the original image
+        fingerprint: Content fingerprint of the image
+        info: Pyramid description from get_deep_zoom_info
+        level: Level to render
+        
+    Returns:
+        Number of tiles written
+    """
+    if not PIL_AVAILABLE or Image is None:
+        raise ImportError("Pillow is required for deep zoom")
+    
+    level_width, level_height = get_deep_zoom_level_size(info, level)
+    tile_size = info['tile_size']
+    overlap = info['overlap']
+    written = 0
+    
+    img = _open_for_thumbnails(image_path, (level_width, level_height))
+    try:
+        if img.size != (level_width, level_height):
+            resized = img.resize((level_width, level_height), Image.BICUBIC)
+            img.close()
+            img = resized
+        
+        for column in range(-(-level_width // tile_size)):
+            for row in range(-(-level_height // tile_size)):
+                box = (
+                    max(0, column * tile_size - overlap),
+                    max(0, row * tile_size - overlap),
+                    min(level_width, (column + 1) * tile_size + overlap),
+                    min(level_height, (row + 1) * tile_size + overlap)
+                )
+                tile = img.crop(box)
+                try:
+                    _save_thumbnail(tile, get_deep_zoom_tile_path(fingerprint, level, column, row))
+                finally:
+                    tile.close()
+                written += 1
+    finally:
+        img.close()
+    
+    return written
 
 def create_thumbnail(image_path: str, thumbnail_path: str, size: Tuple[int, int]) -> None:
     """
@@ -217,81 +379,458 @@ def create_thumbnail(image_path: str, thumbnail_path: str, size: Tuple[int, int]
         thumbnail_path: Path where thumbnail should be saved
         size: Thumbnail size as (width, height)
         
+    Raises:
+        Exception: If thumbnail creation fails
+    """
+    create_thumbnail_pyramid(image_path, [(thumbnail_path, size)])
+
+def _open_for_thumbnails(image_path: str, max_size: Tuple[int, int]) -> 'PILImage.Image':
+    """
+    Open an image decoded at the smallest scale that still covers max_size.
+    
+    For JPEGs, draft() makes libjpeg decode at 1/2, 1/4 or 1/8 scale,
+    which skips most of the work for a 64MP original.
+    
+    Args:
+        image_path: Path to the original image
+        max_size: Largest thumbnail box that will be rendered
+        
+    Returns:
+        Loaded, upright RGB or L image (caller must close it)
+    """
+    img = Image.open(image_path)
+    try:
+        # The box is made square so the scale is right whatever the orientation
+        edge = max(max_size)
+        img.draft('RGB', (edge, edge))
+        
+        # Apply the EXIF orientation (also loads the reduced image)
+        upright = ImageOps.exif_transpose(img)
+        if upright is not img:
+            img.close()
+            img = upright
+        
+        # Convert transparency to white background if needed
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            rgba = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.split()[3])
+            img.close()
+            img = background
+        elif img.mode not in ('RGB', 'L'):
+            converted = img.convert('RGB')
+            img.close()
+            img = converted
+        
+        return img
+    except Exception:
+        img.close()
+        raise
+
+def create_thumbnail_pyramid(image_path: str, renditions: List[Tuple[str, Tuple[int, int]]]) -> List[str]:
+    """
+    Create several thumbnail sizes of an image from a single decode.
+    
+    The original is decoded once at reduced resolution, then each size is
+    downscaled from the previous (larger) one, largest first.
+    
+    Args:
+        image_path: Path to the original image
+        renditions: List of (thumbnail_path, size) pairs to write
+        
+    Returns:
+        List of thumbnail paths written
+        
     Raises:
         Exception: If thumbnail creation fails
     """
     if not PIL_AVAILABLE or Image is None:
         raise ImportError("Pillow is required for thumbnail generation")
     
-    os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+    if not renditions:
+        return []
+    
+    # Largest first, so every step shrinks the previous rendition
+    renditions = sorted(renditions, key=lambda r: max(r[1]), reverse=True)
+    written = []
     
     try:
-        with Image.open(image_path) as img:
-            # Preserve orientation from EXIF if available
-            try:
-                if ExifTags is not None:
-                    for orientation in ExifTags.TAGS.keys():
-                        if ExifTags.TAGS[orientation] == 'Orientation':
-                            break
-                    
-                    exif = dict(img._getexif().items())
-                    if exif[orientation] == 3:
-                        img = img.rotate(180, expand=True)
-                    elif exif[orientation] == 6:
-                        img = img.rotate(270, expand=True)
-                    elif exif[orientation] == 8:
-                        img = img.rotate(90, expand=True)
-            except (AttributeError, KeyError, IndexError, TypeError):
-                # No EXIF data available or no orientation tag
-                pass
-            
-            # Create thumbnail
-            img.thumbnail(size, Image.LANCZOS)
-            
-            # Convert transparency to white background if needed
-            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[3] if img.mode == 'RGBA' else None)
-                img = background
-            
-            # Save as JPEG with quality setting
-            img.save(thumbnail_path, 'JPEG', quality=THUMBNAIL_QUALITY)
+        img = _open_for_thumbnails(image_path, renditions[0][1])
+        try:
+            for thumbnail_path, size in renditions:
+                # thumbnail() works in place and never enlarges
+                img.thumbnail(size, Image.BICUBIC)
+                _save_thumbnail(img, thumbnail_path)
+                written.append(thumbnail_path)
+        finally:
+            img.close()
     except Exception as e:
         logger.error(f"Error creating thumbnail for {image_path}: {str(e)}")
         raise
+    
+    return written
+
+def _read_exif_block(f) -> Optional[bytes]:
+    """
+    Read the raw TIFF block of a JPEG's EXIF APP1 segment.
+    
+    Only the segment headers are read; parsing stops at the start of scan.
+    
+    Args:
+        f: Binary file object positioned at the start of the file
+        
+    Returns:
+        TIFF bytes, or None if the file has no EXIF segment
+    """
+    if f.read(2) != b'\xff\xd8':
+        return None
+    
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        
+        # Start of scan or end of image: no more metadata segments
+        if marker[1] in (0xDA, 0xD9):
+            return None
+        
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        
+        if marker[1] == 0xE1:
+            data = f.read(length - 2)
+            if data.startswith(b'Exif\x00\x00'):
+                return data[6:]
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+def _read_ifd(tiff: bytes, offset: int, endian: str) -> Tuple[Dict[int, int], int]:
+    """
+    Read the integer-valued entries of a TIFF IFD.
+    
+    Args:
+        tiff: TIFF block
+        offset: Offset of the IFD within the block
+        endian: struct byte order ('<' or '>')
+        
+    Returns:
+        Tuple of ({tag: value}, offset of the next IFD or 0)
+    """
+    entries = {}
+    count = struct.unpack_from(f'{endian}H', tiff, offset)[0]
+    
+    for i in range(count):
+        tag, field_type, _ = struct.unpack_from(f'{endian}HHI', tiff, offset + 2 + i * 12)
+        if field_type == 3:  # SHORT
+            entries[tag] = struct.unpack_from(f'{endian}H', tiff, offset + 10 + i * 12)[0]
+        elif field_type == 4:  # LONG
+            entries[tag] = struct.unpack_from(f'{endian}I', tiff, offset + 10 + i * 12)[0]
+    
+    next_offset = struct.unpack_from(f'{endian}I', tiff, offset + 2 + count * 12)[0]
+    return entries, next_offset
+
+def read_embedded_thumbnail(image_path: str) -> Optional[Tuple[bytes, int]]:
+    """
+    Read the JPEG preview embedded in an image's EXIF data (IFD1).
+    
+    The main image is not decoded; only the file header is read.
+    
+    Args:
+        image_path: Path to the image file
+        
+    Returns:
+        Tuple of (JPEG bytes, EXIF orientation), or None if there is no preview
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            tiff = _read_exif_block(f)
+        
+        if not tiff or tiff[:2] not in (b'II', b'MM'):
+            return None
+        
+        endian = '<' if tiff[:2] == b'II' else '>'
+        ifd0_offset = struct.unpack_from(f'{endian}I', tiff, 4)[0]
+        ifd0, ifd1_offset = _read_ifd(tiff, ifd0_offset, endian)
+        if not ifd1_offset:
+            return None
+        
+        ifd1, _ = _read_ifd(tiff, ifd1_offset, endian)
+        start = ifd1.get(EXIF_TAG_THUMBNAIL_OFFSET)
+        length = ifd1.get(EXIF_TAG_THUMBNAIL_LENGTH)
+        if not start or not length:
+            return None
+        
+        data = tiff[start:start + length]
+        if len(data) != length or not data.startswith(b'\xff\xd8'):
+            return None
+        
+        return data, ifd0.get(EXIF_TAG_ORIENTATION, 1)
+    except (OSError, struct.error) as e:
+        logger.debug(f"No embedded thumbnail in {image_path}: {str(e)}")
+        return None
+
+def _open_embedded_thumbnail(image_path: str) -> Optional['PILImage.Image']:
+    """Decode the embedded EXIF preview of an image, rotated upright."""
+    if not PIL_AVAILABLE or Image is None:
+        return None
+    
+    embedded = read_embedded_thumbnail(image_path)
+    if embedded is None:
+        return None
+    
+    data, orientation = embedded
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Exception as e:
+        logger.debug(f"Unreadable embedded thumbnail in {image_path}: {str(e)}")
+        return None
+    
+    transpose = EXIF_ORIENTATION_TRANSPOSE.get(orientation)
+    if transpose:
+        img = img.transpose(getattr(Image.Transpose, transpose))
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    return img
+
+def get_embedded_preview(image_path: str) -> Optional[bytes]:
+    """
+    Get an upright JPEG of an image's embedded EXIF preview.
+    
+    Args:
+        image_path: Path to the image file
+        
+    Returns:
+        JPEG bytes, or None if the image has no usable preview
+    """
+    embedded = read_embedded_thumbnail(image_path)
+    if embedded is None:
+        return None
+    
+    data, orientation = embedded
+    if orientation not in EXIF_ORIENTATION_TRANSPOSE:
+        return data
+    
+    img = _open_embedded_thumbnail(image_path)
+    if img is None:
+        return None
+    
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=THUMBNAIL_QUALITY)
+    return buffer.getvalue()
+
+def _save_thumbnail(img: 'PILImage.Image', thumbnail_path: str) -> None:
+    """Encode a thumbnail (or preview) and write it to the thumbnail store."""
+    buffer = io.BytesIO()
+    if max(img.size) >= PREVIEW_MIN_EDGE:
+        img.save(buffer, 'JPEG', quality=PREVIEW_QUALITY, progressive=True, optimize=True)
+    else:
+        img.save(buffer, 'JPEG', quality=THUMBNAIL_QUALITY)
+    thumbnail_store.write(thumbnail_path, buffer.getvalue())
+
+def _render_from_embedded(image_path: str, renditions: List[Tuple[str, Tuple[int, int]]]) -> List[str]:
+    """
+    Create the thumbnails that the embedded EXIF preview is big enough for.
+    
+    Args:
+        image_path: Path to the original image
+        renditions: List of (thumbnail_path, size) pairs wanted
+        
+    Returns:
+        List of thumbnail paths written
+    """
+    written = []
+    
+    preview = _open_embedded_thumbnail(image_path)
+    if preview is None:
+        return written
+    
+    try:
+        covered = [r for r in renditions if max(preview.size) >= max(r[1])]
+        for thumbnail_path, size in sorted(covered, key=lambda r: max(r[1]), reverse=True):
+            preview.thumbnail(size, Image.BICUBIC)
+            _save_thumbnail(preview, thumbnail_path)
+            written.append(thumbnail_path)
+    finally:
+        preview.close()
+    
+    return written
+
+def create_thumbnail_from_embedded(image_path: str, thumbnail_path: str, size: Tuple[int, int]) -> bool:
+    """
+    Create a thumbnail from the embedded EXIF preview, if it is big enough.
+    
+    Args:
+        image_path: Path to the original image
+        thumbnail_path: Path where thumbnail should be saved
+        size: Thumbnail size as (width, height)
+        
+    Returns:
+        True if the thumbnail was written, False if a full render is needed
+    """
+    try:
+        return bool(_render_from_embedded(image_path, [(thumbnail_path, size)]))
+    except Exception as e:
+        logger.warning(f"Error using embedded thumbnail of {image_path}: {str(e)}")
+        return False
+
+def render_thumbnails(image_path: str, renditions: List[Tuple[str, Tuple[int, int]]]) -> List[str]:
+    """
+    Create thumbnails, using the embedded EXIF preview where it is big enough.
+    
+    Sizes the embedded preview covers are scaled down from it without
+    touching the main image. Any remaining sizes are rendered with a single
+    pyramid decode of the original.
+    
+    Args:
+        image_path: Path to the original image
+        renditions: List of (thumbnail_path, size) pairs to write
+        
+    Returns:
+        List of thumbnail paths written
+    """
+    written = _render_from_embedded(image_path, renditions)
+    remaining = [r for r in renditions if r[0] not in written]
+    
+    if remaining:
+        written.extend(create_thumbnail_pyramid(image_path, remaining))
+    
+    return written
+
+def render_contact_sheet(
+    thumbnail_paths: List[str],
+    tile_size: Tuple[int, int],
+    columns: int,
+    sheet_path: str
+) -> Dict[str, Any]:
+    """
+    Paste thumbnails into a single sprite JPEG.
+    
+    Tiles are laid out row by row in cells of `tile_size`, each thumbnail
+    in the top-left corner of its cell.
+    
+    Args:
+        thumbnail_paths: Thumbnails to include, in display order
+        tile_size: Cell size as (width, height)
+        columns: Number of cells per row
+        sheet_path: Path where the sprite should be stored
+        
+    Returns:
+        Dictionary with the sheet 'width', 'height' and 'tiles', a list of
+        [x, y, width, height] per thumbnail (None if it couldn't be read)
+    """
+    if not PIL_AVAILABLE or Image is None:
+        raise ImportError("Pillow is required for contact sheets")
+    
+    cell_width = tile_size[0] + CONTACT_SHEET_GAP
+    cell_height = tile_size[1] + CONTACT_SHEET_GAP
+    rows = max(1, -(-len(thumbnail_paths) // columns))
+    width = min(columns, max(1, len(thumbnail_paths))) * cell_width - CONTACT_SHEET_GAP
+    height = rows * cell_height - CONTACT_SHEET_GAP
+    
+    sheet = Image.new('RGB', (width, height), (0, 0, 0))
+    tiles = []
+    try:
+        for index, thumbnail_path in enumerate(thumbnail_paths):
+            x = (index % columns) * cell_width
+            y = (index // columns) * cell_height
+            try:
+                with Image.open(io.BytesIO(thumbnail_store.read(thumbnail_path))) as tile:
+                    tile.thumbnail(tile_size, Image.BICUBIC)
+                    sheet.paste(tile.convert('RGB'), (x, y))
+                    tiles.append([x, y, tile.width, tile.height])
+            except Exception as e:
+                logger.warning(f"Error adding {thumbnail_path} to contact sheet: {str(e)}")
+                tiles.append(None)
+        
+        buffer = io.BytesIO()
+        sheet.save(buffer, 'JPEG', quality=CONTACT_SHEET_QUALITY)
+        thumbnail_store.write(sheet_path, buffer.getvalue())
+    finally:
+        sheet.close()
+    
+    return {'width': width, 'height': height, 'tiles': tiles}
+
+def _read_metadata_source(image_path: str) -> Tuple[BinaryIO, bool]:
+    """
+    Read the part of an image file that holds its metadata.
+    
+    Args:
+        image_path: Path to the image file
+        
+    Returns:
+        Tuple of (stream, complete): the header of a JPEG in memory (or the
+        open file for any other format), and whether the stream holds the
+        whole file. The caller closes the stream.
+    """
+    f = open(image_path, 'rb')
+    try:
+        data = f.read(METADATA_HEADER_BYTES)
+        complete = len(data) < METADATA_HEADER_BYTES
+        
+        # Other formats (e.g. TIFF) may keep their metadata anywhere, so
+        # they are parsed from the file rather than read into memory
+        if not complete and data[:2] != b'\xff\xd8':
+            f.seek(0)
+            return f, True
+    except Exception:
+        f.close()
+        raise
+    
+    f.close()
+    return io.BytesIO(data), complete
 
-def get_image_metadata(image_path: str) -> Dict[str, Any]:
+def get_image_metadata(image_path: str, stat_result: Optional[os.stat_result] = None) -> Dict[str, Any]:
     """
     Extract metadata from an image file.
     
+    The file is read once; Pillow and exifread both parse the same
+    in-memory header (or, for formats other than JPEG, the same open file).
+    
     Args:
         image_path: Path to the image file
+        stat_result: Result of os.stat for the file, if already known
         
     Returns:
         Dictionary with metadata information
     """
+    if stat_result is None:
+        stat_result = os.stat(image_path)
+    
     metadata = {
         'filename': os.path.basename(image_path),
         'path': image_path,
-        'size': os.path.getsize(image_path),
-        'modified': datetime.fromtimestamp(os.path.getmtime(image_path)).isoformat(),
+        'size': stat_result.st_size,
+        'modified': datetime.fromtimestamp(stat_result.st_mtime).isoformat(),
     }
     
-    # Get basic image info using Pillow
-    if PIL_AVAILABLE and Image is not None:
-        try:
-            with Image.open(image_path) as img:
-                metadata['dimensions'] = img.size
-                metadata['format'] = img.format
-                metadata['mode'] = img.mode
-        except Exception as e:
-            logger.warning(f"Error reading image info with Pillow: {str(e)}")
-    
-    # Get EXIF data using exifread
-    if EXIFREAD_AVAILABLE and exifread is not None:
-        try:
-            with open(image_path, 'rb') as f:
-                tags = exifread.process_file(f, details=False)
+    source, complete = _read_metadata_source(image_path)
+    
+    with source:
+        # Get basic image info using Pillow
+        if PIL_AVAILABLE and Image is not None:
+            try:
+                try:
+                    img = Image.open(source)
+                except (OSError, SyntaxError):
+                    if complete:
+                        raise
+                    # The frame header is past the bytes we read
+                    img = Image.open(image_path)
+                with img:
+                    metadata['dimensions'] = img.size
+                    metadata['format'] = img.format
+                    metadata['mode'] = img.mode
+            except Exception as e:
+                logger.warning(f"Error reading image info with Pillow: {str(e)}")
+        
+        # Get EXIF data using exifread
+        if EXIFREAD_AVAILABLE and exifread is not None:
+            try:
+                source.seek(0)
+                tags = exifread.process_file(source, details=False)
                 
                 # Convert tag objects to strings
                 exif = {}
@@ -303,7 +842,7 @@ def get_image_metadata(image_path: str) -> Dict[str, Any]:
                 
                 if exif:
                     metadata['exif'] = exif
-        except Exception as e:
-            logger.warning(f"Error reading EXIF data: {str(e)}")
+            except Exception as e:
+                logger.warning(f"Error reading EXIF data: {str(e)}")
     
     return metadata
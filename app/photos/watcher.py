@@ -0,0 +1,293 @@
+"""
+Ingest watcher for the Photos module.
+
+Watches the photo roots for new files and ingests each one once it has
+been completely written: its catalog entry and metadata are stored and
+its thumbnails are queued. Keeping up with capture then costs time proportional to the
+new files rather than to the size of the tree. Uses inotify where
+available and falls back to polling.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.photos import catalog, thumbnail_manager
+from app.photos.utils import is_image_file
+
+# Try to import inotify for event driven watching (Linux only)
+INotify = None
+inotify_flags = None
+try:
+    from inotify_simple import INotify as INotifyClass, flags as inotify_flags_module
+    INotify = INotifyClass
+    inotify_flags = inotify_flags_module
+    INOTIFY_AVAILABLE = True
+except ImportError:
+    INOTIFY_AVAILABLE = False
+
+# fcntl is only available on Unix
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Whether the app starts the watcher
+WATCHER_ENABLED = os.environ.get('CREATUREBOX_PHOTO_WATCHER', '1') == '1'
+
+# Seconds between scans when polling (a file is ingested once its size
+# and mtime are unchanged over one interval)
+POLL_INTERVAL = int(os.environ.get('CREATUREBOX_WATCHER_POLL_INTERVAL', 10))
+
+# Thumbnail sizes rendered for new photos
+INGEST_SIZES = ['small', 'medium', 'large']
+
+# Watcher state
+_thread = None
+_running = False
+_lock_file = None
+
+
+def start(roots: List[str], base_dir: str) -> bool:
+    """
+    Start the watcher thread.
+
+    Only one process runs the watcher: with several gunicorn workers the
+    first one to take the lock file watches for all of them.
+
+    Args:
+        roots: Photo root directories to watch
+        base_dir: Application base directory (for the lock file)
+
+    Returns:
+        True if this process is running the watcher
+    """
+    global _thread, _running, _lock_file
+
+    if _thread is not None and _thread.is_alive():
+        return True
+
+    roots = [root for root in roots if os.path.isdir(root)]
+    if not roots:
+        return False
+
+    if fcntl is not None:
+        lock_path = os.path.join(base_dir, 'instance', 'state', 'photo_watcher.lock')
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        lock_file = open(lock_path, 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            logger.info("Photo watcher is running in another process")
+            return False
+        _lock_file = lock_file
+
+    _running = True
+    _thread = threading.Thread(target=_run, args=(roots,), daemon=True)
+    _thread.start()
+    return True
+
+
+def stop(wait: bool = True, timeout: int = 5) -> None:
+    """Stop the watcher thread."""
+    global _thread, _running, _lock_file
+
+    _running = False
+    if wait and _thread is not None:
+        _thread.join(timeout)
+    _thread = None
+
+    if _lock_file is not None:
+        _lock_file.close()
+        _lock_file = None
+
+
+def _run(roots: List[str]) -> None:
+    """Watcher thread: watch with inotify, or poll if that isn't possible."""
+    if INOTIFY_AVAILABLE:
+        try:
+            _watch_inotify(roots)
+            return
+        except OSError as e:
+            # e.g. the inotify watch limit has been reached
+            logger.warning(f"inotify unavailable, polling instead: {str(e)}")
+
+    _watch_polling(roots)
+
+
+def ingest_file(path: str) -> None:
+    """
+    Ingest a file that has been completely written.
+
+    Args:
+        path: Path of the new or updated file
+    """
+    try:
+        if not catalog.ingest_file(path):
+            return
+
+        if is_image_file(path):
+            # The header was just written, so reading it now is nearly free
+            catalog.get_metadata(path)
+            thumbnail_manager.generate_thumbnails_for_image(path, INGEST_SIZES)
+            logger.info(f"Ingested {path}")
+    except Exception as e:
+        logger.error(f"Error ingesting {path}: {str(e)}")
+
+
+def _directory_changed(directory: str) -> None:
+    """Resynchronize a directory whose entries were removed or renamed."""
+    try:
+        catalog.sync_directory(directory)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error synchronizing {directory}: {str(e)}")
+
+
+def _watch_inotify(roots: List[str]) -> None:
+    """Watch the roots with inotify until stopped."""
+    inotify = INotify()
+    mask = (
+        inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.MOVED_FROM |
+        inotify_flags.CREATE | inotify_flags.DELETE
+    )
+    watches = {}
+
+    def add_tree(top: str) -> List[str]:
+        added = []
+        for directory, dirs, _ in os.walk(top):
+            # Skip hidden directories
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            watches[inotify.add_watch(directory, mask)] = directory
+            added.append(directory)
+        return added
+
+    try:
+        for root in roots:
+            add_tree(root)
+        logger.info(f"Photo watcher started (inotify, {len(watches)} directories)")
+
+        while _running:
+            for event in inotify.read(timeout=1000):
+                if event.mask & inotify_flags.Q_OVERFLOW:
+                    # Events were lost; let the catalog catch up from mtimes
+                    logger.warning("Photo watcher event queue overflowed, resynchronizing")
+                    for directory in list(watches.values()):
+                        _directory_changed(directory)
+                    continue
+
+                if event.mask & inotify_flags.IGNORED:
+                    # The directory was removed
+                    watches.pop(event.wd, None)
+                    continue
+
+                directory = watches.get(event.wd)
+                if directory is None or not event.name or event.name.startswith('.'):
+                    continue
+                path = os.path.join(directory, event.name)
+
+                if event.mask & inotify_flags.ISDIR:
+                    if event.mask & (inotify_flags.CREATE | inotify_flags.MOVED_TO):
+                        # Whatever landed in the tree before its watches
+                        # were added produced no events of its own
+                        for added in add_tree(path):
+                            _directory_changed(added)
+                    _directory_changed(directory)
+                elif event.mask & (inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO):
+                    ingest_file(path)
+                elif event.mask & (inotify_flags.DELETE | inotify_flags.MOVED_FROM):
+                    _directory_changed(directory)
+    finally:
+        inotify.close()
+        logger.info("Photo watcher stopped")
+
+
+def _scan_directory(directory: str) -> Tuple[Set[str], Set[str]]:
+    """List the visible files and subdirectories of a directory."""
+    files = set()
+    dirs = set()
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                dirs.add(entry.name)
+            elif entry.is_file(follow_symlinks=False):
+                files.add(entry.name)
+    return files, dirs
+
+
+def _watch_polling(roots: List[str]) -> None:
+    """
+    Watch the roots by polling until stopped.
+
+    Only directories whose mtime changed are listed again, so a poll
+    costs one stat per directory. New files are ingested once their size
+    and mtime have been stable for one interval.
+    """
+    known: Dict[str, Tuple[int, Set[str], Set[str]]] = {}
+    pending: Dict[str, Optional[Tuple[int, int]]] = {}
+
+    def add_directory(directory: str, new: bool) -> None:
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            files, dirs = _scan_directory(directory)
+        except OSError:
+            return
+        known[directory] = (mtime, files, dirs)
+        if new:
+            for name in files:
+                pending[os.path.join(directory, name)] = None
+        for name in dirs:
+            add_directory(os.path.join(directory, name), new)
+
+    for root in roots:
+        add_directory(root, new=False)
+    logger.info(f"Photo watcher started (polling, {len(known)} directories)")
+
+    while _running:
+        time.sleep(POLL_INTERVAL)
+
+        for directory, (mtime, files, dirs) in list(known.items()):
+            try:
+                current_mtime = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                known.pop(directory, None)
+                continue
+            if current_mtime == mtime:
+                continue
+
+            try:
+                current_files, current_dirs = _scan_directory(directory)
+            except OSError:
+                continue
+            known[directory] = (current_mtime, current_files, current_dirs)
+
+            for name in current_files - files:
+                pending[os.path.join(directory, name)] = None
+            for name in current_dirs - dirs:
+                add_directory(os.path.join(directory, name), new=True)
+            if files - current_files or dirs != current_dirs:
+                _directory_changed(directory)
+
+        # Ingest the new files that are no longer being written
+        for path, previous in list(pending.items()):
+            try:
+                stat_info = os.stat(path)
+            except FileNotFoundError:
+                pending.pop(path)
+                continue
+
+            current = (stat_info.st_size, stat_info.st_mtime_ns)
+            if current == previous:
+                pending.pop(path)
+                ingest_file(path)
+            else:
+                pending[path] = current
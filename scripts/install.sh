@@ -115,6 +115,7 @@ FLASK_APP=app
 FLASK_ENV=production
 SECRET_KEY=$SECRET_KEY
 CREATUREBOX_PASSWORD=creaturebox
+CREATUREBOX_TASK_CONSUMER=external
 EOF
 
 # Set secure permissions for .env
@@ -187,7 +188,9 @@ echo "Setting up permissions for hardware access..."
 sudo usermod -a -G video creature
 sudo usermod -a -G gpio creature
 
-# Ensure our service has access to hardware
+# Ensure our service has access to hardware. Threaded workers keep a
+# request slot free while browsers follow task progress (event streams
+# stay open until the task finishes).
 echo "Creating systemd service..."
 sudo tee /etc/systemd/system/creaturebox-web.service > /dev/null << EOF
 [Unit]
@@ -197,7 +200,7 @@ After=network.target
 [Service]
 User=creature
 WorkingDirectory=$INSTALL_DIR
-ExecStart=$INSTALL_DIR/venv/bin/gunicorn -b 127.0.0.1:8000 'app:create_app()'
+ExecStart=$INSTALL_DIR/venv/bin/gunicorn --worker-class gthread --threads 8 -b 127.0.0.1:8000 'app:create_app()'
 Restart=always
 RestartSec=5
 Environment="PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin:$INSTALL_DIR/venv/bin"
@@ -209,9 +212,47 @@ SupplementaryGroups=video gpio
 WantedBy=multi-user.target
 EOF
 
+# Background photo tasks (thumbnails, archives) run in their own process,
+# shared by all gunicorn workers
+sudo tee /etc/systemd/system/creaturebox-tasks.service > /dev/null << EOF
+[Unit]
+Description=Creaturebox photo task consumer
+After=network.target
+
+[Service]
+User=creature
+WorkingDirectory=$INSTALL_DIR
+ExecStart=$INSTALL_DIR/venv/bin/python -m app.photos.consumer
+Restart=always
+RestartSec=5
+TimeoutStopSec=40
+Environment="PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin:$INSTALL_DIR/venv/bin"
+EnvironmentFile=$INSTALL_DIR/.env
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
 # Set up Nginx if available
 if command -v nginx &>/dev/null; then
     echo "Setting up Nginx..."
+    
+    # Files the app hands over with X-Accel-Redirect once it has checked
+    # the login and the path: one internal location per directory it
+    # serves files from, so nothing else is reachable through them
+    ACCEL_DIRS="/home/pi/creaturebox/images /home/pi/mothbox/images $INSTALL_DIR/instance/photos $INSTALL_DIR/instance/thumbnails $INSTALL_DIR/instance/downloads"
+    ACCEL_LOCATIONS=""
+    for dir in $ACCEL_DIRS; do
+        ACCEL_LOCATIONS+="
+    location /_accel$dir/ {
+        internal;
+        alias $dir/;
+        sendfile on;
+        tcp_nopush on;
+    }
+"
+    done
+    
     sudo tee /etc/nginx/sites-available/creaturebox-web > /dev/null << EOF
 server {
     listen 80;
@@ -224,17 +265,32 @@ server {
         proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
         proxy_set_header X-Forwarded-Proto \$scheme;
     }
-}
+$ACCEL_LOCATIONS}
 EOF
 
     sudo ln -sf /etc/nginx/sites-available/creaturebox-web /etc/nginx/sites-enabled/
-    sudo nginx -t && sudo systemctl restart nginx || echo -e "${YELLOW}Warning: Nginx configuration failed. Please check configuration manually.${NC}"
+    if sudo nginx -t && sudo systemctl restart nginx; then
+        # Let nginx send photos and archives if it can read the photo directories
+        ACCEL_READABLE=true
+        for dir in /home/pi/creaturebox/images /home/pi/mothbox/images "$INSTALL_DIR"; do
+            if [ -d "$dir" ] && ! sudo -u www-data test -r "$dir" -a -x "$dir"; then
+                ACCEL_READABLE=false
+            fi
+        done
+        if [ "$ACCEL_READABLE" = true ]; then
+            echo "CREATUREBOX_X_ACCEL_REDIRECT=1" >> "$INSTALL_DIR/.env"
+        else
+            echo -e "${YELLOW}Note: nginx cannot read the photo directories; photos will be sent by the app.${NC}"
+        fi
+    else
+        echo -e "${YELLOW}Warning: Nginx configuration failed. Please check configuration manually.${NC}"
+    fi
 fi
 
 # Enable and start the service
 echo "Enabling and starting service..."
-sudo systemctl enable creaturebox-web.service
-sudo systemctl start creaturebox-web.service
+sudo systemctl enable creaturebox-web.service creaturebox-tasks.service
+sudo systemctl start creaturebox-web.service creaturebox-tasks.service
 
 # Create minimal bootstrap.bundle.min.js for modals
 echo "Creating bootstrap.bundle.min.js..." 
@@ -41,6 +41,14 @@ if [ -f /etc/systemd/system/creaturebox-web.service ]; then
     sudo systemctl daemon-reload
 fi
 
+if [ -f /etc/systemd/system/creaturebox-tasks.service ]; then
+    echo "Stopping and disabling Creaturebox task consumer..."
+    sudo systemctl stop creaturebox-tasks.service
+    sudo systemctl disable creaturebox-tasks.service
+    sudo rm /etc/systemd/system/creaturebox-tasks.service
+    sudo systemctl daemon-reload
+fi
+
 # Remove Nginx configuration if present
 if [ -f /etc/nginx/sites-enabled/creaturebox-web ]; then
     echo "Removing Nginx configuration..."
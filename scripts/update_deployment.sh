@@ -9,6 +9,7 @@ set -e
 REPO_DIR="$HOME/creaturebox_web"
 INSTALL_DIR="/opt/creaturebox_web"
 SERVICE_NAME="creaturebox-web"
+TASKS_SERVICE_NAME="creaturebox-tasks"
 
 # Text colors
 RED='\033[0;31m'
@@ -147,9 +148,20 @@ sudo cp "$REPO_DIR/scripts/run_validation.sh" "$INSTALL_DIR/scripts/"
 sudo chmod +x "$INSTALL_DIR/scripts/validate_paths.py"
 sudo chmod +x "$INSTALL_DIR/scripts/run_validation.sh"
 
+# Task progress streams need threaded workers; update services installed before them
+SERVICE_FILE="/etc/systemd/system/$SERVICE_NAME.service"
+if [ -f "$SERVICE_FILE" ] && ! grep -q "gthread" "$SERVICE_FILE"; then
+    echo "Switching gunicorn to threaded workers..."
+    sudo sed -i "s|bin/gunicorn -b|bin/gunicorn --worker-class gthread --threads 8 -b|" "$SERVICE_FILE"
+    sudo systemctl daemon-reload
+fi
+
 # Restart service
 echo -e "${GREEN}Restarting service...${NC}"
 sudo systemctl restart "$SERVICE_NAME"
+if [ -f "/etc/systemd/system/$TASKS_SERVICE_NAME.service" ]; then
+    sudo systemctl restart "$TASKS_SERVICE_NAME"
+fi
 
 # Check service status
 echo -e "${GREEN}Checking service status...${NC}"
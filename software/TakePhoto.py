@@ -36,6 +36,7 @@ import csv
 import sys
 
 import io
+import importlib.util
 from PIL import Image
 import piexif
 import subprocess
@@ -376,6 +377,136 @@ def list_exposuretimes(middle_exposuretime, num_photos, exposure_width):
     exposure_times.append(current_exposure)
   return exposure_times
 
+def make_exif_thumbnail(pil_image, max_size=(320, 320), quality=75):
+  """
+  Makes a small JPEG preview to embed in the EXIF 1st IFD.
+
+  The web interface shows this preview instantly instead of decoding
+  the full 64MP photo. EXIF segments are limited to 64KB, so keep it small.
+
+  Args:
+      pil_image: The captured PIL image.
+      max_size: Largest width and height of the preview.
+      quality: JPEG quality of the preview.
+
+  Returns:
+      The preview as JPEG bytes.
+  """
+  # reduce() box-averages by an integer factor, far cheaper than resizing 64MP
+  factor = max(1, max(pil_image.size) // max(max_size))
+  preview = pil_image.reduce(factor)
+  preview.thumbnail(max_size)
+  if preview.mode != "RGB":
+    preview = preview.convert("RGB")
+  preview_buffer = io.BytesIO()
+  preview.save(preview_buffer, format="JPEG", quality=quality)
+  return preview_buffer.getvalue()
+
+def load_web_thumbnail_modules(web_app_dir):
+  """
+  Loads the web app's thumbnail path and store helpers.
+
+  Reads the web app's .env first, so the thumbnail directory
+  (CREATUREBOX_THUMBNAIL_DIR) and store (CREATUREBOX_THUMBNAIL_STORE) are
+  the ones the app uses. The helpers only need the standard library, so
+  they are loaded straight from the web app's files.
+
+  Args:
+      web_app_dir: Where the web app is installed.
+
+  Returns:
+      The thumbnail_paths and thumbnail_store modules.
+  """
+  global web_thumbnail_modules
+  if web_thumbnail_modules is not None:
+    return web_thumbnail_modules
+
+  try:
+    with open(os.path.join(web_app_dir, ".env")) as env_file:
+      for line in env_file:
+        line = line.strip()
+        if line and not line.startswith("#") and "=" in line:
+          key, value = line.split("=", 1)
+          os.environ.setdefault(key.strip(), value.strip().strip("'\""))
+  except OSError:
+    pass  # the app falls back to its defaults too
+
+  modules = []
+  for name in ("thumbnail_paths", "thumbnail_store"):
+    module_path = os.path.join(web_app_dir, "app", "photos", name+".py")
+    spec = importlib.util.spec_from_file_location("creaturebox_web_"+name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    modules.append(module)
+
+  paths, store = modules
+  store.configure(paths.THUMBNAIL_DIR)
+  web_thumbnail_modules = (paths, store)
+  return web_thumbnail_modules
+
+def make_web_thumbnail_dirs(shard_path, thumbnail_dir):
+  """
+  Creates a thumbnail shard directory (and its size directory) that the
+  web app can write to as well.
+
+  New directories get the owner and group of the web app's thumbnail
+  directory, as this script usually runs as root, and only they can write
+  to them: no other user can swap in the thumbnails the app serves.
+
+  Args:
+      shard_path: The shard directory a thumbnail goes in.
+      thumbnail_dir: The web app's thumbnail directory.
+  """
+  if os.path.isdir(shard_path):
+    return
+  os.makedirs(thumbnail_dir, exist_ok=True)
+  owner = os.stat(thumbnail_dir)
+  for path in (os.path.dirname(shard_path), shard_path):
+    if not os.path.isdir(path):
+      os.makedirs(path, exist_ok=True)
+      os.chmod(path, 0o2775)  # new subdirectories keep the group too
+      try:
+        os.chown(path, owner.st_uid, owner.st_gid)
+      except PermissionError:
+        pass  # not root: the directory is already the web app's or ours
+
+def write_web_thumbnails(pil_image, filepath, web_app_dir, sizes, quality=85):
+  """
+  Writes the web interface's thumbnails for a photo that was just saved.
+
+  Renders from the image already in memory, so the web app never has to
+  decode the full 64MP file again. Thumbnails are named and stored by the
+  web app's own helpers, so they go wherever get_thumbnail_path() looks
+  for them, in either thumbnail store.
+
+  Args:
+      pil_image: The captured PIL image.
+      filepath: Where the photo was saved.
+      web_app_dir: Where the web app is installed.
+      sizes: Thumbnail sizes to write, as (width, height).
+      quality: JPEG quality of the thumbnails.
+  """
+  paths, store = load_web_thumbnail_modules(web_app_dir)
+  fingerprint = paths.compute_fingerprint(filepath)
+  sizes = sorted(sizes, key=max, reverse=True)
+
+  # reduce() once to roughly the largest size, then shrink step by step
+  factor = max(1, max(pil_image.size) // max(sizes[0]))
+  thumb = pil_image.reduce(factor)
+  if thumb.mode != "RGB":
+    thumb = thumb.convert("RGB")
+
+  for size in sizes:
+    thumb.thumbnail(size, Image.BICUBIC)
+    thumbnail_path = paths.get_rendition_path(paths.THUMBNAIL_DIR, fingerprint, size)
+
+    if not store.PACKED:
+      make_web_thumbnail_dirs(os.path.dirname(thumbnail_path), paths.THUMBNAIL_DIR)
+
+    thumb_buffer = io.BytesIO()
+    thumb.save(thumb_buffer, format="JPEG", quality=quality)
+    store.write(thumbnail_path, thumb_buffer.getvalue())  # the web app never sees a partial file
+
 def create_dated_folder(base_path):
   """
   Creates a folder with the current date in the format YYYY-MM-DD if it doesn't exist.
@@ -525,9 +656,16 @@ def takePhoto_Manual():
              }
           
           exif_dict = {"0th":zeroth_ifd, "Exif":exif_ifd, "GPS":gps_ifd, "1st":first_ifd}
+          if embed_exif_thumbnail and ImageFileType==0:
+              exif_dict["thumbnail"] = make_exif_thumbnail(pil_image)
           exif_bytes = piexif.dump(exif_dict)
           img.save(filepath,exif=exif_bytes, quality=96)
           print("Image saved to "+filepath)
+          if save_web_thumbnails:
+              try:
+                  write_web_thumbnails(pil_image, filepath, web_app_dir, web_thumbnail_sizes)
+              except Exception as e:
+                  print("Could not write web thumbnails: "+str(e))
           i=i+1
 
 
@@ -621,6 +759,18 @@ else:
 	print(os.uname()[1])   # doesnt work on windows
 
 
+#Embed a small preview in each JPEG's EXIF so the web interface can show it without decoding the photo
+embed_exif_thumbnail = True
+
+#Write the web interface's small/medium/large thumbnails at capture time, so browsing needs no decoding
+#(the thumbnail directory and store are read from the web app's .env)
+save_web_thumbnails = True
+web_app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not os.path.isdir(os.path.join(web_app_dir, "app", "photos")):
+  web_app_dir = "/opt/creaturebox_web"
+web_thumbnail_modules = None
+web_thumbnail_sizes = [(100, 100), (240, 240), (480, 480)]
+
 #HDR Controls
 num_photos = 3
 exposuretime_width = 18000